@@ -0,0 +1,81 @@
+"""
+Measures memory retained by parsed emails in a long running process.
+
+Every email of a repository is read a number of times and all results are kept alive, like in an API worker caching
+its whole corpus. The same is measured with templates read again for every email, as they were before Template
+instances were shared, and for placeholders with and without __slots__.
+
+Usage: python benchmarks/memory.py [root path] [copies]
+"""
+import logging
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from email_parser import fs, reader  # noqa: E402
+from email_parser.model import *  # noqa: E402
+
+PLACEHOLDERS = 100000
+
+
+class DictPlaceholder(object):
+    """
+    Placeholder's attributes stored in an instance dict like before __slots__ were introduced.
+    """
+
+    def __init__(self, name, content, is_global=False, p_type=PlaceholderType.text, variants=None, opt_attr=None):
+        self.name = name
+        self.is_global = is_global
+        self.type = p_type
+        self._content = content
+        self.variants = variants or {}
+        self._opt_attr = opt_attr
+
+
+def _traced(build):
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def _read_all(root_path, emails, copies, shared):
+    results = []
+    for _ in range(copies):
+        for email in emails:
+            if not shared:
+                reader._shared_templates.invalidate()
+            results.append(reader.read(root_path, email))
+    return results
+
+
+def main():
+    root_path = sys.argv[1] if len(sys.argv) > 1 else 'tests'
+    copies = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    emails = list(fs.emails(root_path))
+    # malformed emails log their tracebacks on every read
+    logging.disable(logging.CRITICAL)
+    # load lazy modules and fill lxml's caches before measuring
+    _read_all(root_path, emails, 1, True)
+
+    print('{:<40}{:>12}'.format('retained by', 'KiB'))
+    for name, build in [
+        ('%s parsed emails, shared templates' % (len(emails) * copies),
+         lambda: _read_all(root_path, emails, copies, True)),
+        ('%s parsed emails, templates per email' % (len(emails) * copies),
+         lambda: _read_all(root_path, emails, copies, False)),
+        ('%s placeholders with __slots__' % PLACEHOLDERS,
+         lambda: [Placeholder('name', 'content') for _ in range(PLACEHOLDERS)]),
+        ('%s placeholders with __dict__' % PLACEHOLDERS,
+         lambda: [DictPlaceholder('name', 'content') for _ in range(PLACEHOLDERS)]),
+    ]:
+        reader._shared_templates.invalidate()
+        print('{:<40}{:>12.1f}'.format(name, _traced(build) / 1024))
+
+
+if __name__ == '__main__':
+    main()
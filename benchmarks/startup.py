@@ -0,0 +1,40 @@
+"""
+Measures how long it takes to start the command line tool.
+
+The tool is called many times per job by other scripts so the import time dominates small operations.
+
+Usage: python benchmarks/startup.py [runs]
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('import email_parser', ['-c', 'import email_parser']),
+    ('import email_parser.cmd', ['-c', 'import email_parser.cmd']),
+    ('ks-email-parser --version', ['-m', 'email_parser.cmd', '--version']),
+    ('import renderer dependencies', ['-c', 'from email_parser import renderer; renderer.inline_styler.inline_css']),
+]
+
+
+def _measure(args, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.check_call([sys.executable] + args, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print('{:<32}{:>12}{:>12}'.format('command', 'median ms', 'min ms'))
+    for name, args in COMMANDS:
+        timings = _measure(args, runs)
+        print('{:<32}{:>12.1f}{:>12.1f}'.format(name, statistics.median(timings), min(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,17 +7,64 @@
     :copyright: (c) 2014 by KeepSafe.
     :license: Apache, see LICENSE for more details.
 """
-import json
 import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
-from . import placeholder, fs, reader, renderer, const, config
+from . import placeholder, fs, reader, renderer, const, config, link_shortener, preview
+from . import dependencies, metadata, resources, check, render_cache, cache as caches
 from .model import *
 
+__version__ = '0.3.0'
+
 
 class Parser:
-    def __init__(self, root_path, **kwargs):
+    def __init__(self, root_path, cache_limits=None, render_cache_dir=None, source_cache_dir=None, conf=None,
+                 metadata_cache_dir=None, **kwargs):
+        """
+        :param root_path: root path of repository
+        :param cache_limits: optional dict overriding const.CACHE_LIMITS
+        :param render_cache_dir: optional directory of rendered emails shared between runs, see RenderCache
+        :param source_cache_dir: optional directory of compiled email sources loaded instead of parsing XML
+        :param metadata_cache_dir: optional directory of the metadata index, the render or source cache directory by
+                                   default. Without any the index isn't persisted
+        :param conf: optional Config, see `config.create`
+        :param kwargs: arguments of `config.create` used without conf. Module defaults set by `config.init` are used
+                       without both
+        """
         self.root_path = root_path
-        config.init(**kwargs)
+        # every Parser owns its configuration, parsers of different repositories can be used side by side
+        self.config = conf or (config.create(**kwargs) if kwargs else config.current())
+        self.cache = caches.CacheManager(cache_limits, source_cache_dir)
+        self.placeholders_config = placeholder.PlaceholdersConfig(root_path, self.cache, self.config)
+        self._batch_depth = 0
+        self.link_shortener = link_shortener.link_shortener(root_path, self.config.paths.source,
+                                                            self.config.shortener_url)
+        self._preview_sessions = OrderedDict()
+        self._dependency_graph = None
+        # guards preview sessions and creation of the dependency graph for threads sharing the parser
+        self._lock = threading.RLock()
+        self.metadata = metadata.MetadataIndex(root_path, self.config,
+                                               metadata_cache_dir or render_cache_dir or source_cache_dir)
+        self.resources = resources.ResourcesCache(root_path, conf=self.config)
+        self.render_cache = render_cache.RenderCache(render_cache_dir, __version__) if render_cache_dir else None
+        self.render_keys = self.render_cache or render_cache.RenderKeys(__version__)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def close(self):
+        """
+        Writes state kept in memory, i.e. the metadata index.
+        """
+        self.metadata.save()
 
     def __hash__(self):
         return hash(self.root_path)
@@ -30,82 +77,257 @@ class Parser:
         return self.__hash__() == hash(other)
 
     def get_template_for_email(self, email_name, locale):
-        email = fs.email(self.root_path, email_name, locale)
+        email = fs.email(self.root_path, email_name, locale, self.config)
         if not email:
             return None
-        template, _ = reader.read(self.root_path, email)
+        template, _ = reader.read(self.root_path, email, cache=self.cache, conf=self.config)
         return template.content
 
     def get_email_type(self, email_name, locale):
-        email = fs.email(self.root_path, email_name, locale)
-        return reader.get_email_type(self.root_path, email)
+        email_metadata = self.get_email_metadata(email_name, locale)
+        return email_metadata.email_type if email_metadata else None
+
+    def get_email_metadata(self, email_name, locale):
+        """
+        :returns: EmailMetadata served from the metadata index or None if the email doesn't exist or is malformed
+        """
+        return self.metadata.get(fs.email(self.root_path, email_name, locale, self.config))
+
+    def get_emails_metadata(self, locale=const.DEFAULT_LOCALE):
+        """
+        Metadata of all emails in a locale, only emails changed since the last call are parsed.
+
+        :param locale: locale or None for all locales
+        :returns: generator of dicts of EmailMetadata fields
+        """
+        return (email_metadata._asdict() for email_metadata in self.metadata.refresh(locale))
 
     def render(self, email_name, locale, variant=None):
-        email = fs.email(self.root_path, email_name, locale)
+        email = fs.email(self.root_path, email_name, locale, self.config)
         return self.render_email(email, variant)
 
-    def render_email(self, email, variant=None):
+    def render_key(self, email_name, locale, variant=None):
+        """
+        :returns: hex digest of everything the email is rendered from, e.g. for ETags, or None if it doesn't exist
+        """
+        email = fs.email(self.root_path, email_name, locale, self.config)
+        if not email:
+            return None
+        return self.render_keys.key(self.root_path, email, variant, self.config)
+
+    def render_with_key(self, email_name, locale, variant=None):
+        """
+        :returns: tuple of `render_key` and `render` results, the key is None if sources changed while rendering
+        """
+        key = self.render_key(email_name, locale, variant)
+        result = self.render(email_name, locale, variant)
+        if key is not None and key != self.render_key(email_name, locale, variant):
+            key = None
+        return key, result
+
+    def render_email(self, email, variant=None, errors=None):
         if not email:
             return None
-        template, persisted_placeholders = reader.read(self.root_path, email)
+        if self.render_cache is None or self.link_shortener.enabled:
+            # shortened links aren't part of the render cache key
+            return self._render_email(email, variant, errors)
+        key = self.render_cache.key(self.root_path, email, variant, self.config)
+        result = self.render_cache.get(key)
+        if result is None:
+            failures = []
+            result = self._render_email(email, variant, failures)
+            if errors is not None:
+                errors.extend(failures)
+            if result and not failures:
+                # emails rendered from the default locale are rendered every time to report the fallback
+                self.render_cache.set(key, result)
+        return result
+
+    def _render_email(self, email, variant=None, errors=None, links=None):
+        template, persisted_placeholders = reader.read(self.root_path, email, errors, self.cache, self.config)
         if template:
-            return renderer.render(email.locale, template, persisted_placeholders, variant)
+            if self.link_shortener.enabled:
+                # text fragments depend on the links shortened so far, they aren't memoized
+                return renderer.render(email.locale, template, persisted_placeholders, variant,
+                                       links=links or self.link_shortener.links, conf=self.config)
+            return renderer.render(email.locale, template, persisted_placeholders, variant,
+                                   fragments=self.cache.fragments, conf=self.config)
+
+    def collect_links(self, emails, variant=None):
+        """
+        :returns: set of all links used in text versions of given emails
+        """
+        links = set()
+        for email in emails:
+            template, placeholders = reader.read(self.root_path, email, cache=self.cache, conf=self.config)
+            if template:
+                links.update(renderer.links_to_shorten(email.locale, template, placeholders, variant, self.config))
+        return links
+
+    def render_many(self, emails, variant=None):
+        """
+        Renders a batch of emails. When link shortening is configured emails are rendered once with new links marked,
+        all of them are shortened concurrently and replaced in the texts, links already shortened in previous runs
+        are taken from the cache.
 
-    def render_email_content(self, content, locale=const.DEFAULT_LOCALE, variant=None, highlight=None):
-        template, persisted_placeholders = reader.read_from_content(self.root_path, content, locale)
-        return renderer.render(locale, template, persisted_placeholders, variant=variant, highlight=highlight)
+        :returns: list of (subject, text, html) tuples or None for emails which couldn't be rendered
+        """
+        if not self.link_shortener.enabled:
+            return [self.render_email(email, variant) for email in emails]
+        marked = link_shortener.MarkedLinks(self.link_shortener.cache)
+        results = [self._render_email(email, variant, links=marked) if email else None for email in emails]
+        links = set()
+        for result in filter(None, results):
+            links.update(link_shortener.marked_links(result[1]))
+        self.link_shortener.shorten(links)
+        shortened = self.link_shortener.cache
+        return [(subject, link_shortener.unmark(text, shortened), html) if subject is not None else None
+                for subject, text, html in (result or (None, None, None) for result in results)]
+
+    def render_email_content(self, content, locale=const.DEFAULT_LOCALE, variant=None, highlight=None, session=None):
+        """
+        :param session: optional id of the editor session, consecutive previews in the same session reuse
+                        parsed content, templates and placeholders which didn't change since the previous call
+        """
+        if session is not None:
+            return self._preview_session(session).render(content, locale, variant, highlight)
+        template, persisted_placeholders = reader.read_from_content(self.root_path, content, locale, cache=self.cache,
+                                                                    conf=self.config)
+        return renderer.render(locale, template, persisted_placeholders, variant=variant, highlight=highlight,
+                               fragments=self.cache.fragments, conf=self.config)
+
+    def _preview_session(self, session):
+        with self._lock:
+            preview_session = self._preview_sessions.pop(session, None) or preview.PreviewSession(
+                self.root_path, self.cache, self.config)
+            self._preview_sessions[session] = preview_session
+            if len(self._preview_sessions) > const.PREVIEW_SESSIONS_LIMIT:
+                self._preview_sessions.popitem(last=False)
+            return preview_session
 
     def get_email(self, email_name, locale):
-        email = fs.email(self.root_path, email_name, locale)
+        email = fs.email(self.root_path, email_name, locale, self.config)
         return fs.read_file(email.path)
 
     def original(self, email_name, locale, variant=None):
-        email = fs.email(self.root_path, email_name, locale)
+        email = fs.email(self.root_path, email_name, locale, self.config)
         if not email:
             return None
-        template, placeholders = reader.read(self.root_path, email)
+        template, placeholders = reader.read(self.root_path, email, cache=self.cache, conf=self.config)
         return '\n\n'.join([placeholders[name].get_content() for name in template.placeholders if
                             placeholders[name].type == PlaceholderType.text])
 
     def get_email_components(self, email_name, locale):
-        email = fs.email(self.root_path, email_name, locale)
-        template, placeholders = reader.read(self.root_path, email)
+        email = fs.email(self.root_path, email_name, locale, self.config)
+        template, placeholders = reader.read(self.root_path, email, cache=self.cache, conf=self.config)
         serialized_placeholders = {name: dict(placeholder) for name, placeholder in placeholders.items()}
-        return template.name, template.type, template.styles_names, serialized_placeholders
+        return template.name, template.type, list(template.styles_names), serialized_placeholders
 
-    def get_email_variants(self, email_name):
-        email = fs.email(self.root_path, email_name, const.DEFAULT_LOCALE)
-        _, placeholders = reader.read(self.root_path, email)
-        variants = set([name for _, p in placeholders.items() for name in p.variants.keys()])
-        return list(variants)
+    def get_email_variants(self, email_name, locale=const.DEFAULT_LOCALE):
+        """
+        :returns: sorted list of variants of the email's placeholders and of the global placeholders its template uses
+        """
+        email_metadata = self.get_email_metadata(email_name, locale)
+        if not email_metadata:
+            return []
+        variants = set(email_metadata.variants)
+        global_placeholders = reader.get_global_placeholders(self.root_path, locale, cache=self.cache, conf=self.config)
+        global_variants = {name: global_placeholder.variants for name, global_placeholder in global_placeholders.items()
+                           if global_placeholder.variants}
+        if global_variants:
+            # the index has only the email's own placeholders, globals are part of it when its template uses them
+            template = reader.get_template(self.root_path, email_metadata.template, email_metadata.email_type,
+                                           email_metadata.styles_names, self.cache, self.config)
+            for name, placeholder_variants in global_variants.items():
+                if name in template.placeholders:
+                    variants.update(placeholder_variants)
+        return sorted(variants)
 
     def delete_email(self, email_name):
-        emails = fs.emails(self.root_path, email_name=email_name)
+        emails = fs.emails(self.root_path, email_name=email_name, conf=self.config)
         files = []
         for email in emails:
             files.append(email.path)
             fs.delete_file(email.path)
-        self.refresh_email_placeholders_config()
+            self.invalidate(email.path)
+            if self._dependency_graph:
+                self._dependency_graph.remove(email.name, email.locale)
+        self.placeholders_config.remove(email_name)
+        self._flush_placeholders_config()
         return files
 
     def save_email(self, email_name, locale, content):
-        saved_path = fs.save_email(self.root_path, content, email_name, locale)
-        self.refresh_email_placeholders_config()
+        saved_path = fs.save_email(self.root_path, content, email_name, locale, self.config)
+        self._email_saved(email_name, locale, saved_path)
+        self._flush_placeholders_config()
         return saved_path
 
+    def _email_saved(self, email_name, locale, path):
+        self.invalidate(path)
+        self._update_dependencies(email_name, locale, path)
+        self.placeholders_config.update(Email(email_name, locale, path))
+
+    def _flush_placeholders_config(self):
+        if not self._batch_depth:
+            self.placeholders_config.flush()
+
+    @contextmanager
+    def batch(self):
+        """
+        Coalesces placeholders config updates of all emails saved or deleted in the block into a single write,
+        e.g. for bulk imports. Blocks can be nested, the config is written when the outermost one exits.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            self._flush_placeholders_config()
+
+    @property
+    def dependency_graph(self):
+        with self._lock:
+            if self._dependency_graph is None:
+                self._dependency_graph = dependencies.DependencyGraph(self.root_path, self.config).build()
+            return self._dependency_graph
+
+    def _update_dependencies(self, email_name, locale, path):
+        if self._dependency_graph:
+            self._dependency_graph.add(Email(email_name, locale, os.path.realpath(path)))
+
+    def get_dependents(self, path):
+        """
+        Lists emails which depend on a file, e.g. which emails are affected by editing a template.
+
+        :param path: template, style, globals or email path, absolute or relative to the root path
+        :returns: list of Email tuples
+        """
+        return self.dependency_graph.get_dependents(path)
+
+    def get_dependencies(self, email_name, locale):
+        """
+        :returns: sorted list of absolute paths of files used to render the email
+        """
+        return self.dependency_graph.get_dependencies(email_name, locale)
+
     def save_email_variant_as_default(self, email_name, locales, variant, email_type=None):
+        with self.batch():
+            return self._save_email_variant_as_default(email_name, locales, variant, email_type)
+
+    def _save_email_variant_as_default(self, email_name, locales, variant, email_type):
         paths = []
         for locale in locales:
-            email = fs.email(self.root_path, email_name, locale)
-            template, placeholders = reader.read(self.root_path, email)
+            email = fs.email(self.root_path, email_name, locale, self.config)
+            template, placeholders = reader.read(self.root_path, email, cache=self.cache, conf=self.config)
             placeholders_list = [p.pick_variant(variant) for _, p in placeholders.items() if not p.is_global]
             if email_type:
                 email_type = EmailType(email_type)
             elif template.type:
                 email_type = EmailType(template.type)
             content = reader.create_email_content(self.root_path, template.name, template.styles_names,
-                                                  placeholders_list, email_type)
-            email_path = fs.save_email(self.root_path, content, email_name, locale)
+                                                  placeholders_list, email_type, self.config)
+            email_path = fs.save_email(self.root_path, content, email_name, locale, self.config)
+            self._email_saved(email_name, locale, email_path)
             paths.append(email_path)
         return paths
 
@@ -131,22 +353,23 @@ class Parser:
             placeholder_list.append(p)
         if email_type:
             email_type = EmailType(email_type)
-        return reader.create_email_content(self.root_path, template_name, styles_names, placeholder_list, email_type)
+        return reader.create_email_content(self.root_path, template_name, styles_names, placeholder_list, email_type,
+                                           self.config)
 
     def render_template_content(self, template_content, styles_names, placeholders, locale=const.DEFAULT_LOCALE):
-        styles = reader.get_inline_style(self.root_path, styles_names)
+        styles = reader.get_inline_style(self.root_path, styles_names, self.cache, self.config)
         placeholders_objs = {name: Placeholder(name, content) for name, content in placeholders.items()}
         template = Template('preview', styles_names, styles, template_content, placeholders_objs, None)
-        return renderer.render(locale, template, placeholders_objs)
+        return renderer.render(locale, template, placeholders_objs, conf=self.config)
 
     def get_email_names(self):
-        return (email.name for email in fs.emails(self.root_path, locale=const.DEFAULT_LOCALE))
+        return (email.name for email in fs.emails(self.root_path, locale=const.DEFAULT_LOCALE, conf=self.config))
 
     def get_emails(self, locale=const.DEFAULT_LOCALE):
-        return (email._asdict() for email in fs.emails(self.root_path, locale=locale))
+        return (email._asdict() for email in fs.emails(self.root_path, locale=locale, conf=self.config))
 
     def get_email_placeholders(self):
-        expected_placeholders = placeholder.expected_placeholders_file(self.root_path)
+        expected_placeholders = placeholder.expected_placeholders_file(self.root_path, self.cache)
         return {k: list(v) for k, v in expected_placeholders.items()}
 
     def get_template(self, template_filename, template_type=None):
@@ -154,26 +377,43 @@ class Parser:
             template_type = EmailType(template_type)
         except ValueError:
             template_type = None
-        content, placeholders = reader.get_template_parts(self.root_path, template_filename, template_type)
+        content, placeholders = reader.get_template_parts(self.root_path, template_filename, template_type,
+                                                          self.config)
         return content, placeholders
 
     def save_template(self, template_filename, template_type, template_content):
         template_type = EmailType(template_type)
-        return fs.save_template(self.root_path, template_filename, template_type, template_content)
+        path, written = fs.save_template(self.root_path, template_filename, template_type, template_content,
+                                         self.config)
+        # emails depend on template paths whether the files exist or not, the dependency graph doesn't change
+        self.invalidate(path)
+        return path, written
 
     def refresh_email_placeholders_config(self):
-        placeholders_config = placeholder.generate_config(self.root_path)
+        """
+        Generates the placeholders config from all emails, saves and deletes update it incrementally.
+        """
+        placeholders_config = placeholder.generate_config(self.root_path, self.cache, self.config)
         if placeholders_config:
-            fs.save_file(
-                json.dumps(placeholders_config, sort_keys=True, indent=const.JSON_INDENT),
-                self.get_placeholders_filepath())
-            placeholder.expected_placeholders_file.cache_clear()
+            self.placeholders_config.save(placeholders_config)
+
+    def invalidate(self, path=None):
+        """
+        Drops everything cached from a file. Caches validate files' modification times on their own, this is needed
+        only when a file changed without its modification time changing.
+
+        :param path: changed file, absolute or relative to the root path, or None to clear all caches
+        """
+        if path is not None:
+            path = os.path.join(self.root_path, str(path))
+        self.cache.invalidate(path)
+        self.resources.invalidate(path)
 
     def get_placeholders_filepath(self):
         return os.path.join(self.root_path, const.REPO_SRC_PATH, const.PLACEHOLDERS_FILENAME)
 
     def get_templates_directory_filepath(self):
-        return os.path.join(self.root_path, config.paths.templates)
+        return os.path.join(self.root_path, self.config.paths.templates)
 
     def get_email_filepaths(self, email_name, locale=None):
         """
@@ -182,34 +422,66 @@ class Parser:
         :param locale:
         :return:
         """
-        emails = fs.emails(self.root_path, email_name, locale)
-        abs_paths = map(lambda email: fs.get_email_filepath(email.name, email.locale), emails)
+        emails = fs.emails(self.root_path, email_name, locale, self.config)
+        abs_paths = map(lambda email: fs.get_email_filepath(email.name, email.locale, self.config), emails)
         return list(abs_paths)
 
     def get_email_resources_filepaths(self, email_name):
-        email = fs.email(self.root_path, email_name, 'en')
-        if not email:
+        email_metadata = self.get_email_metadata(email_name, const.DEFAULT_LOCALE)
+        if not email_metadata:
             return None
-        template, _ = reader.read(self.root_path, email)
-        file_paths = fs.get_template_resources_filepaths(self.root_path, template)
+        template = Template(email_metadata.template, email_metadata.styles_names, None, None, None,
+                            email_metadata.email_type)
+        file_paths = fs.get_template_resources_filepaths(self.root_path, template, self.config)
         return list(map(lambda p: str(p.relative_to(self.root_path)), file_paths))
 
     def get_email_placeholders_validation_errors(self, email_name, locale):
-        email = fs.email(self.root_path, email_name, locale)
-        return placeholder.get_email_validation(self.root_path, email)['errors']
+        email = fs.email(self.root_path, email_name, locale, self.config)
+        return placeholder.get_email_validation(self.root_path, email, self.cache, self.config)['errors']
+
+    def validate_placeholders(self, locale=None, **kwargs):
+        """
+        Validates placeholders of all emails against the placeholders config in parallel.
+
+        :param locale: optionally limits validation to one locale
+        :returns: dict with the number of validated and invalid emails and a list of invalid ones with missing,
+                  extra and count-mismatched placeholders or the error which prevented validation
+        """
+        emails = fs.emails(self.root_path, locale=locale, conf=self.config)
+        return placeholder.validate_emails(self.root_path, emails, self.cache, conf=self.config, **kwargs)
+
+    def check_emails(self, locale=None, **kwargs):
+        """
+        Checks in parallel that emails can be rendered, nothing is rendered or written.
+
+        :param locale: optionally limits the check to one locale
+        :returns: list of EmailResult
+        """
+        emails = fs.emails(self.root_path, locale=locale, conf=self.config)
+        return check.check_emails(self.root_path, emails, self.cache, conf=self.config, **kwargs)
+
+    def compile_sources(self, locale=None, **kwargs):
+        """
+        Compiles email sources into the source cache in parallel so later reads, also by other processes and after
+        restarts, don't parse XML.
+
+        :param locale: optionally limits compilation to one locale
+        :returns: list of emails which couldn't be compiled because they are empty or malformed
+        """
+        if self.cache.sources is None:
+            raise ValueError('no source cache directory, see source_cache_dir')
+        emails = list(fs.emails(self.root_path, locale=locale, conf=self.config))
+        failed = set(reader.compile_sources([email.path for email in emails], self.cache.sources_path, **kwargs))
+        return [email for email in emails if email.path in failed]
 
     def get_resources(self):
-        templates_view = {}
-        templates, styles = fs.resources(self.root_path)
-        sections_map = fs.get_html_sections_map(self.root_path)
-        for template_type in templates:
-            types_templates = templates[template_type]
-            templates_view_type = templates_view.setdefault(template_type, {})
-            for template_name in types_templates:
-                tpl_content, tpl_placeholders = self.get_template(template_name, template_type)
-                templates_view_type[template_name] = tpl_placeholders
-        return templates_view, styles, sections_map
+        """
+        :returns: tuple of templates' placeholders by type and name, list of styles and sections' content by name,
+                  served from a cache validated by files' modification time
+        """
+        return self.resources.get()
 
     def get_global_placeholders_map(self, locale=const.DEFAULT_LOCALE):
-        global_placeholders = reader.get_global_placeholders(self.root_path, locale)
+        global_placeholders = reader.get_global_placeholders(self.root_path, locale, cache=self.cache,
+                                                             conf=self.config)
         return {name: placeholder.get_content() for name, placeholder in global_placeholders.items()}
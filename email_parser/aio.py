@@ -0,0 +1,267 @@
+"""
+Coroutine API of Parser for services running an asyncio event loop, e.g. the editor backend.
+
+Reads and writes run on a bounded pool of threads, rendering on a pool of processes so it doesn't hold the GIL of
+the service. Identical calls made while one is in flight share its result instead of doing the work again.
+"""
+
+import asyncio
+import itertools
+from functools import partial
+
+from . import Parser, const, utils
+
+_tokens = itertools.count()
+# parsers of worker processes by AsyncParser token, created on first use so their caches survive between calls
+_worker_parsers = {}
+
+
+def _worker_parser(token, args, kwargs):
+    parser = _worker_parsers.get(token)
+    if parser is None:
+        parser = _worker_parsers[token] = Parser(*args, **kwargs)
+    return parser
+
+
+def _call_in_worker(token, parser_args, parser_kwargs, name, args, kwargs):
+    parser = _worker_parser(token, parser_args, parser_kwargs)
+    return getattr(parser, name)(*args, **kwargs)
+
+
+def _render_email(parser, email, variant):
+    failures = []
+    return parser.render_email(email, variant, failures), failures
+
+
+def _render_email_in_worker(token, parser_args, parser_kwargs, email, variant):
+    return _render_email(_worker_parser(token, parser_args, parser_kwargs), email, variant)
+
+
+class AsyncParser(object):
+    """
+    Mirrors the Parser API with coroutines.
+
+    Concurrent calls with the same arguments share one in-flight call and get the same result objects, callers
+    shouldn't modify them. Saves and deletes run one at a time and calls started after them never share results of
+    calls started before.
+    """
+
+    def __init__(self, root_path, io_workers=const.DEFAULT_IO_POOL, render_workers=None, **kwargs):
+        """
+        :param root_path: root path of repository
+        :param io_workers: number of threads reading and writing files
+        :param render_workers: number of processes rendering emails, os.cpu_count() by default. With 0 emails are
+                               rendered by the I/O threads
+        :param kwargs: arguments of Parser
+        """
+        self.parser = Parser(root_path, **kwargs)
+        # worker processes build their own parser with the same configuration instead of unpickling one per call
+        kwargs['conf'] = self.parser.config
+        self._parser_spec = (next(_tokens), (root_path,), kwargs)
+        self._io_executor = utils.concurrent_futures.ThreadPoolExecutor(max_workers=io_workers)
+        self._render_executor = None
+        if render_workers != 0:
+            self._render_executor = utils.concurrent_futures.ProcessPoolExecutor(max_workers=render_workers)
+        self._in_flight = {}
+        self._write_lock = None
+
+    @property
+    def root_path(self):
+        return self.parser.root_path
+
+    @property
+    def config(self):
+        return self.parser.config
+
+    def close(self):
+        """
+        Shuts down the pools, waits for running calls to finish, and closes the parser.
+        """
+        self._io_executor.shutdown()
+        if self._render_executor:
+            self._render_executor.shutdown()
+        self.parser.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def _shared(self, key, run):
+        """
+        :param key: key of the call, calls with unhashable keys aren't shared
+        :param run: function returning a future of the call
+        """
+        try:
+            future = self._in_flight.get(key)
+        except TypeError:
+            # arguments like dicts of placeholders aren't hashable, such calls aren't shared
+            return asyncio.shield(run())
+        if future is None:
+            future = asyncio.ensure_future(run())
+            self._in_flight[key] = future
+            future.add_done_callback(partial(self._done, key))
+        # a cancelled caller must not cancel the call for the others
+        return asyncio.shield(future)
+
+    def _done(self, key, future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    def _io(self, function, *args):
+        return asyncio.get_event_loop().run_in_executor(self._io_executor, partial(function, *args))
+
+    def _read(self, name, *args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        return self._shared(key, lambda: self._io(partial(getattr(self.parser, name), **kwargs), *args))
+
+    def _read_list(self, name, *args):
+        # generators of Parser are consumed on the I/O thread
+        return self._shared((name, args, ()), lambda: self._io(lambda: list(getattr(self.parser, name)(*args))))
+
+    def _render(self, name, *args, **kwargs):
+        if self._render_executor is None:
+            return self._read(name, *args, **kwargs)
+        key = (name, args, tuple(sorted(kwargs.items())))
+        return self._shared(key, lambda: asyncio.get_event_loop().run_in_executor(
+            self._render_executor, _call_in_worker, *self._parser_spec, name, args, kwargs))
+
+    async def _write(self, name, *args):
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            # calls started from now on must see the write
+            self._in_flight.clear()
+            return await self._io(getattr(self.parser, name), *args)
+
+    async def get_template_for_email(self, email_name, locale):
+        return await self._read('get_template_for_email', email_name, locale)
+
+    async def get_email_type(self, email_name, locale):
+        return await self._read('get_email_type', email_name, locale)
+
+    async def get_email_metadata(self, email_name, locale):
+        return await self._read('get_email_metadata', email_name, locale)
+
+    async def get_emails_metadata(self, locale=const.DEFAULT_LOCALE):
+        """
+        :returns: list of dicts of EmailMetadata fields
+        """
+        return await self._read_list('get_emails_metadata', locale)
+
+    async def render(self, email_name, locale, variant=None):
+        return await self._render('render', email_name, locale, variant)
+
+    async def render_key(self, email_name, locale, variant=None):
+        return await self._read('render_key', email_name, locale, variant)
+
+    async def render_with_key(self, email_name, locale, variant=None):
+        return await self._render('render_with_key', email_name, locale, variant)
+
+    async def render_email(self, email, variant=None, errors=None):
+        if self._render_executor is None:
+            run = partial(self._io, _render_email, self.parser, email, variant)
+        else:
+            run = partial(asyncio.get_event_loop().run_in_executor, self._render_executor, _render_email_in_worker,
+                          *self._parser_spec, email, variant)
+        result, failures = await self._shared(('render_email', email, variant), run)
+        if errors is not None:
+            errors.extend(failures)
+        return result
+
+    async def render_many(self, emails, variant=None):
+        return await self._render('render_many', tuple(emails), variant)
+
+    async def render_email_content(self, content, locale=const.DEFAULT_LOCALE, variant=None, highlight=None,
+                                   session=None):
+        """
+        Sessions live in worker processes, consecutive previews of a session reuse its state when they are
+        rendered by the same worker.
+        """
+        return await self._render('render_email_content', content, locale, variant, highlight, session)
+
+    async def render_template_content(self, template_content, styles_names, placeholders,
+                                      locale=const.DEFAULT_LOCALE):
+        return await self._render('render_template_content', template_content, styles_names, placeholders, locale)
+
+    async def get_email(self, email_name, locale):
+        return await self._read('get_email', email_name, locale)
+
+    async def original(self, email_name, locale, variant=None):
+        return await self._read('original', email_name, locale, variant)
+
+    async def get_email_components(self, email_name, locale):
+        return await self._read('get_email_components', email_name, locale)
+
+    async def get_email_variants(self, email_name, locale=const.DEFAULT_LOCALE):
+        return await self._read('get_email_variants', email_name, locale)
+
+    async def delete_email(self, email_name):
+        return await self._write('delete_email', email_name)
+
+    async def save_email(self, email_name, locale, content):
+        return await self._write('save_email', email_name, locale, content)
+
+    async def save_email_variant_as_default(self, email_name, locales, variant, email_type=None):
+        return await self._write('save_email_variant_as_default', email_name, locales, variant, email_type)
+
+    async def get_dependents(self, path):
+        return await self._read('get_dependents', path)
+
+    async def get_dependencies(self, email_name, locale):
+        return await self._read('get_dependencies', email_name, locale)
+
+    async def create_email_content(self, template_name, styles_names, placeholders, email_type=None):
+        return await self._read('create_email_content', template_name, styles_names, placeholders, email_type)
+
+    async def get_email_names(self):
+        return await self._read_list('get_email_names')
+
+    async def get_emails(self, locale=const.DEFAULT_LOCALE):
+        return await self._read_list('get_emails', locale)
+
+    async def get_email_placeholders(self):
+        return await self._read('get_email_placeholders')
+
+    async def get_template(self, template_filename, template_type=None):
+        return await self._read('get_template', template_filename, template_type)
+
+    async def save_template(self, template_filename, template_type, template_content):
+        return await self._write('save_template', template_filename, template_type, template_content)
+
+    async def refresh_email_placeholders_config(self):
+        return await self._write('refresh_email_placeholders_config')
+
+    async def invalidate(self, path=None):
+        return await self._write('invalidate', path)
+
+    def get_placeholders_filepath(self):
+        return self.parser.get_placeholders_filepath()
+
+    def get_templates_directory_filepath(self):
+        return self.parser.get_templates_directory_filepath()
+
+    async def get_email_filepaths(self, email_name, locale=None):
+        return await self._read('get_email_filepaths', email_name, locale)
+
+    async def get_email_resources_filepaths(self, email_name):
+        return await self._read('get_email_resources_filepaths', email_name)
+
+    async def get_email_placeholders_validation_errors(self, email_name, locale):
+        return await self._read('get_email_placeholders_validation_errors', email_name, locale)
+
+    async def validate_placeholders(self, locale=None, **kwargs):
+        return await self._read('validate_placeholders', locale, **kwargs)
+
+    async def check_emails(self, locale=None, **kwargs):
+        return await self._read('check_emails', locale, **kwargs)
+
+    async def compile_sources(self, locale=None, **kwargs):
+        return await self._read('compile_sources', locale, **kwargs)
+
+    async def get_resources(self):
+        return await self._read('get_resources')
+
+    async def get_global_placeholders_map(self, locale=const.DEFAULT_LOCALE):
+        return await self._read('get_global_placeholders_map', locale)
@@ -0,0 +1,181 @@
+"""
+Single file of rendered emails for sending services.
+
+The file starts with a header, followed by subjects, texts and htmls of all emails as utf-8 and a json index of their
+offsets by name, locale and variant. Identical contents, e.g. of untranslated locales, are stored once. A footer at
+the end points to the index so the file can be written sequentially, e.g. to stdout:
+
+    header: magic, format version
+    data: subject, text and html of every email
+    index: json list of [name, locale, variant, subject offset, subject length, text offset, ..., runtime placeholders,
+           compressed]
+    footer: index offset, index length, magic
+
+Runtime placeholders are lists of [start, end, name] of the subject, text and html, relative to the start of each, so
+emails are personalized without searching them again, see `personalize`. Compressed maps encodings to offsets and
+lengths of the compressed text and html, it's empty unless the build compressed outputs.
+"""
+
+import hashlib
+import json
+import mmap
+import struct
+
+from . import const, personalize
+
+_HEADER = struct.Struct('<4sI')
+_FOOTER = struct.Struct('<QQ4s')
+
+
+class BundleError(Exception):
+    pass
+
+
+class BundleWriter(object):
+    def __init__(self, fp):
+        """
+        :param fp: binary file object, written sequentially
+        """
+        self._fp = fp
+        self._offset = 0
+        self._index = []
+        # offsets of contents by digest, identical subjects, texts and htmls are stored once
+        self._contents = {}
+        self._write(_HEADER.pack(const.BUNDLE_MAGIC, const.BUNDLE_FORMAT))
+
+    def _write(self, content):
+        self._fp.write(content)
+        offset = self._offset
+        self._offset += len(content)
+        return offset
+
+    def _add_content(self, content):
+        digest = hashlib.sha256(content).digest()
+        offset = self._contents.get(digest)
+        if offset is None:
+            offset = self._contents[digest] = self._write(content)
+        return offset, len(content)
+
+    def add(self, name, locale, variant, subject, text, html, compressed=None):
+        """
+        :param compressed: optional dict of tuples of compressed text and html by encoding
+        """
+        entry, spans = [name, locale, variant], []
+        for content in (subject, text, html):
+            content, content_spans = personalize.encoded_tokens(content)
+            entry.extend(self._add_content(content))
+            spans.append(content_spans)
+        entry.append(spans)
+        entry.append({encoding: self._add_content(compressed_text) + self._add_content(compressed_html)
+                      for encoding, (compressed_text, compressed_html) in (compressed or {}).items()})
+        self._index.append(entry)
+
+    def finish(self):
+        index = json.dumps(self._index, separators=(',', ':')).encode('utf-8')
+        offset = self._write(index)
+        self._write(_FOOTER.pack(offset, len(index), const.BUNDLE_MAGIC))
+
+
+class Bundle(object):
+    """
+    Memory mapped bundle, emails are looked up in a dict and returned as slices of the mapped file without copying.
+
+    Slices and prebuilt emails can outlive the bundle, the file is unmapped when the last of them is released or
+    garbage collected.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            try:
+                self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise BundleError('%s is empty' % path)
+        try:
+            self._index = self._read_index(path)
+        except Exception:
+            self._mmap.close()
+            raise
+        self._view = memoryview(self._mmap)
+        self._prebuilt = {}
+
+    def _read_index(self, path):
+        if len(self._mmap) < _HEADER.size + _FOOTER.size:
+            raise BundleError('%s is not a bundle' % path)
+        magic, version = _HEADER.unpack_from(self._mmap, 0)
+        offset, length, footer_magic = _FOOTER.unpack_from(self._mmap, len(self._mmap) - _FOOTER.size)
+        if magic != const.BUNDLE_MAGIC or footer_magic != const.BUNDLE_MAGIC:
+            raise BundleError('%s is not a bundle or is truncated' % path)
+        if version != const.BUNDLE_FORMAT:
+            raise BundleError('%s has format %s, expected %s' % (path, version, const.BUNDLE_FORMAT))
+        entries = json.loads(self._mmap[offset:offset + length].decode('utf-8'))
+        return {(name, locale, variant): (tuple(offsets), tokens, compressed)
+                for name, locale, variant, *offsets, tokens, compressed in entries}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        """
+        :returns: list of (name, locale, variant) tuples
+        """
+        return list(self._index)
+
+    def get(self, name, locale, variant=None):
+        """
+        :returns: tuple of memoryviews of utf-8 subject, text and html or None if the bundle doesn't have the email
+        """
+        entry = self._index.get((name, locale, variant))
+        if entry is None:
+            return None
+        offsets, view = entry[0], self._view
+        return tuple(view[offsets[i]:offsets[i] + offsets[i + 1]] for i in range(0, 6, 2))
+
+    def get_str(self, name, locale, variant=None):
+        """
+        :returns: tuple of decoded subject, text and html or None
+        """
+        parts = self.get(name, locale, variant)
+        return tuple(str(part, 'utf-8') for part in parts) if parts else None
+
+    def get_compressed(self, name, locale, variant=None, encoding='gzip'):
+        """
+        :returns: tuple of memoryviews of the compressed text and html or None if the bundle doesn't have them
+        """
+        entry = self._index.get((name, locale, variant))
+        offsets = entry[2].get(encoding) if entry else None
+        if offsets is None:
+            return None
+        view = self._view
+        return view[offsets[0]:offsets[0] + offsets[1]], view[offsets[2]:offsets[2] + offsets[3]]
+
+    def prebuilt(self, name, locale, variant=None):
+        """
+        :returns: PrebuiltEmail personalizing the email straight from the mapped file, returning utf-8 bytes, or None
+        """
+        key = (name, locale, variant)
+        prebuilt = self._prebuilt.get(key)
+        if prebuilt is None:
+            parts = self.get(name, locale, variant)
+            if parts is None:
+                return None
+            prebuilt = self._prebuilt[key] = personalize.PrebuiltEmail(*parts, spans=self._index[key][1])
+        return prebuilt
+
+    def close(self):
+        self._prebuilt.clear()
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # slices held by callers keep the mapping alive, it's closed when they are gone
+            pass
+        self._mmap = None
@@ -0,0 +1,193 @@
+"""
+Caches shared by everything a Parser reads and renders.
+
+Values read from files are validated by the files' modification times on every lookup so changes made by other
+processes are picked up. All caches are bounded and drop least recently used entries first.
+"""
+
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from . import fs, const
+
+logger = logging.getLogger(__name__)
+
+
+def _abspath(path):
+    return os.path.abspath(str(path))
+
+
+class LruDict(object):
+    """
+    Thread safe mapping keeping at most `limit` most recently used items.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # items are process local, e.g. parsed trees can't be pickled
+        return {'limit': self.limit}
+
+    def __setstate__(self, state):
+        self.__init__(state['limit'])
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.limit:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def keys(self):
+        with self._lock:
+            return list(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class FileCache(object):
+    """
+    Values built from files, an entry is built again as soon as one of its files changes.
+    """
+
+    def __init__(self, limit):
+        self._entries = LruDict(limit)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, paths, build):
+        """
+        :param key: cache key
+        :param paths: files the value is built from
+        :param build: function building the value
+        :returns: cached or newly built value, None values and values of files which don't exist are not cached
+        """
+        paths = tuple(str(path) for path in paths)
+        mtimes = fs.mtimes(paths)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == paths and entry[1] == mtimes:
+            return entry[2]
+        value = build()
+        if value is not None and any(mtime is not None for mtime in mtimes):
+            self._entries[key] = (paths, mtimes, value)
+        return value
+
+    def invalidate(self, path=None):
+        """
+        Drops entries built from the path or all entries if path is None.
+        """
+        if path is None:
+            self._entries.clear()
+            return
+        path = _abspath(path)
+        for key in self._entries.keys():
+            entry = self._entries.get(key)
+            if entry is not None and path in map(_abspath, entry[0]):
+                self._entries.pop(key)
+
+
+class SourceCache(object):
+    """
+    Compiled email sources stored as pickles in a directory, similar to .pyc files.
+
+    Entries are addressed by a hash of the source's content so they stay valid across checkouts and restarts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _entry_path(self, digest):
+        return os.path.join(self.path, 'v%s' % const.SOURCE_CACHE_FORMAT, digest[:2], digest + '.pickle')
+
+    def get(self, digest):
+        """
+        :returns: CompiledEmail or None
+        """
+        try:
+            with open(self._entry_path(digest), 'rb') as fp:
+                return pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            logger.warning('compiled source %s is corrupted, parsing again: %s', digest, ex)
+            return None
+
+    def set(self, digest, compiled):
+        path = self._entry_path(digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fs.save_file_atomic(pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL), path)
+        except OSError as ex:
+            logger.warning('cannot write compiled source %s: %s', digest, ex)
+
+
+class CacheManager(object):
+    """
+    All caches of a Parser:
+
+    - templates: Template instances by template filename, email type and styles names
+    - styles: inline styles by styles names
+    - globals: parsed global placeholders files by path
+    - emails: parsed email sources by path
+    - config: placeholders config
+    - fragments: rendered placeholders by their inputs, see `renderer.render`
+    - sources: optional SourceCache of compiled email sources, used instead of `emails`
+    """
+
+    def __init__(self, limits=None, sources_path=None):
+        """
+        :param limits: optional dict overriding const.CACHE_LIMITS
+        :param sources_path: optional directory of compiled email sources
+        """
+        self.limits = dict(const.CACHE_LIMITS, **(limits or {}))
+        self.sources_path = sources_path
+        self.sources = SourceCache(sources_path) if sources_path else None
+        self.templates = FileCache(self.limits['templates'])
+        self.styles = FileCache(self.limits['styles'])
+        self.globals = FileCache(self.limits['globals'])
+        self.emails = FileCache(self.limits['emails'])
+        self.config = FileCache(self.limits['config'])
+        self.fragments = LruDict(self.limits['fragments'])
+
+    def __getstate__(self):
+        # parsed trees can't be pickled, worker processes start with empty caches
+        return {'limits': self.limits, 'sources_path': self.sources_path}
+
+    def __setstate__(self, state):
+        self.__init__(state['limits'], state.get('sources_path'))
+
+    def invalidate(self, path=None):
+        """
+        :param path: file which changed or None to clear everything
+        """
+        for file_cache in (self.templates, self.styles, self.globals, self.emails, self.config):
+            file_cache.invalidate(path)
+        if path is None:
+            self.fragments.clear()
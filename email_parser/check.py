@@ -0,0 +1,130 @@
+"""
+Checks that emails can be rendered without rendering or writing anything.
+
+For every email:
+- the email and globals of its locale are well-formed XML
+- its template and styles exist
+- placeholders defined in the template and in the email use a valid PlaceholderType
+- every placeholder of the template has content in the email or in globals
+"""
+
+import os
+import time
+
+from . import fs, reader, const, config, utils, cache as caches
+from .model import *
+
+_PLACEHOLDER_TYPES = {placeholder_type.name for placeholder_type in PlaceholderType}
+
+
+class CheckError(Exception):
+    def __init__(self, error_type, message, segment_id=None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.segment_id = segment_id
+
+
+def _read_xml(path, cache_trees):
+    failures = []
+    tree = reader._read_xml(path, failures, cache_trees)
+    if failures:
+        failure = failures[-1]
+        raise CheckError('ParseError', failure.message, failure.segment_id)
+    return tree
+
+
+def _check_placeholder_types(tree):
+    for element in tree.xpath('./string | ./string-array | bitmap | ./array'):
+        placeholder_type = element.get('type', PlaceholderType.text.value)
+        if placeholder_type not in _PLACEHOLDER_TYPES:
+            raise CheckError('InvalidPlaceholderType', 'placeholder uses invalid PlaceholderType %s' % placeholder_type,
+                             element.get('name'))
+
+
+def _check_template(root_path, email_xml, cache, conf):
+    template_filename, email_type, styles_names = reader.template_attributes(email_xml)
+    if not template_filename:
+        raise CheckError('MissingTemplate', 'no HTML template name defined')
+    for style_name in styles_names:
+        if not os.path.isfile(os.path.join(root_path, conf.paths.templates, style_name)):
+            raise CheckError('StyleNotFound', 'style %s does not exist' % style_name)
+    try:
+        return reader.get_template(root_path, template_filename, email_type, styles_names, cache, conf)
+    except ValueError as ex:
+        raise CheckError('InvalidPlaceholderType', str(ex))
+    except (OSError, TypeError):
+        # without email_type no type directory has the template and its content is None
+        raise CheckError('TemplateNotFound', 'template %s does not exist' % template_filename)
+
+
+def _check(root_path, email, cache, conf):
+    email_xml = _read_xml(email.path, cache.emails)
+    if email_xml is None:
+        raise CheckError('EmptyContent', 'email has no content')
+    _check_placeholder_types(email_xml)
+    template = _check_template(root_path, email_xml, cache, conf)
+
+    globals_xml = _read_xml(fs.global_email(root_path, email.locale, conf).path, cache.globals)
+    if globals_xml is not None:
+        _check_placeholder_types(globals_xml)
+    global_placeholders = reader.get_global_placeholders(root_path, email.locale, cache=cache, conf=conf)
+    placeholders = reader.merge_placeholders(template, global_placeholders, email_xml)
+    if 'subject' not in placeholders:
+        raise CheckError('MissingSubjectError', 'email has no subject', 'subject')
+    missing = [name for name in template.placeholders if name not in placeholders]
+    if missing:
+        raise CheckError('MissingTemplatePlaceholderError',
+                         'template %s has no content for %s' % (template.name, ', '.join(missing)), missing[0])
+
+
+def _has_fallback(root_path, email, cache, conf):
+    default_email = fs.locale_email(root_path, email.name, const.DEFAULT_LOCALE, conf)
+    if not os.path.isfile(default_email.path):
+        return False
+    return check_email(root_path, default_email, cache, conf).status == ResultStatus.ok
+
+
+def check_email(root_path, email, cache=None, conf=None):
+    """
+    :param cache: optional CacheManager
+    :param conf: optional Config, module defaults are used without it
+    :returns: EmailResult, errors are reported with the same types and segment ids as rendering. Like rendering,
+              malformed emails are only a warning if the email in the default locale is fine.
+    """
+    cache = cache or caches.CacheManager()
+    conf = config.resolve(conf)
+    started = time.perf_counter()
+    status, error_type, message, segment_id = ResultStatus.ok, None, None, None
+    try:
+        _check(root_path, email, cache, conf)
+    except CheckError as ex:
+        status, error_type, message, segment_id = ResultStatus.error, ex.error_type, str(ex), ex.segment_id
+        fallback = error_type == 'ParseError' and email.locale != const.DEFAULT_LOCALE
+        if fallback and _has_fallback(root_path, email, cache, conf):
+            status = ResultStatus.warning
+    duration = round(time.perf_counter() - started, 6)
+    return EmailResult(email.name, email.locale, status, error_type, message, segment_id, duration)
+
+
+def _check_batch(emails, root_path, conf=None):
+    cache = caches.CacheManager()
+    return [check_email(root_path, email, cache, conf) for email in emails]
+
+
+def check_emails(root_path, emails=None, cache=None, batch_size=const.VALIDATION_BATCH,
+                 max_workers=const.DEFAULT_WORKER_POOL, conf=None):
+    """
+    Checks many emails, batches of emails are checked by a pool of processes, a single batch in the current process.
+
+    :param emails: collection of emails, all emails in all locales by default
+    :param cache: optional CacheManager used when checking in the current process
+    :param conf: optional Config, module defaults are used without it
+    :returns: list of EmailResult sorted by locale and name
+    """
+    conf = config.resolve(conf)
+    emails = fs.emails(root_path, conf=conf) if emails is None else emails
+    emails = sorted(emails, key=lambda email: (email.locale, email.name))
+    if len(emails) > batch_size:
+        return utils.map_batches(_check_batch, emails, batch_size, max_workers, root_path, conf)
+    cache = cache or caches.CacheManager()
+    return [check_email(root_path, email, cache, conf) for email in emails]
@@ -3,20 +3,32 @@ Handles command line and calls the email parser with corrent options.
 """
 
 import argparse
+import itertools
+import json
 import logging
 import sys
 import os
-import shutil
-import asyncio
-import concurrent.futures
-from itertools import islice
-from functools import reduce
-from multiprocessing import Manager
+import time
+from contextlib import closing
+from fnmatch import fnmatchcase
+from itertools import chain, islice
 
-from . import const, Parser, config, fs
+from . import const, Parser, config, fs, reader, utils, link_shortener, watch, dependencies, sinks, minify, \
+    compression, __version__
+from .model import EmailResult, ResultStatus, OutputOptions
+
+asyncio = utils.lazy_import('asyncio')
+concurrent_futures = utils.lazy_import('concurrent.futures')
+aio = utils.lazy_import('email_parser.aio')
+service = utils.lazy_import('email_parser.service')
 
 logger = logging.getLogger(__name__)
 
+_DEFAULT_OUTPUT = OutputOptions(variants=False, minify=False, compress=())
+_tokens = itertools.count()
+# parsers of worker processes by token of the watch session, kept so their caches survive between builds
+_worker_parsers = {}
+
 
 class ProgressConsoleHandler(logging.StreamHandler):
     store_msg_loglevels = (logging.ERROR, logging.WARN)
@@ -24,24 +36,25 @@ class ProgressConsoleHandler(logging.StreamHandler):
     on_same_line = False
     flush_errors = False
 
-    def __init__(self, err_queue, warn_queue, *args, **kwargs):
-        self.err_msgs_queue = err_queue
-        self.warn_msgs_queue = warn_queue
+    def __init__(self, *args, **kwargs):
+        # messages are only stored in the main process, workers report problems through their results
+        self.err_msgs = []
+        self.warn_msgs = []
         super(ProgressConsoleHandler, self).__init__(*args, **kwargs)
 
     def _store_msg(self, msg, loglevel):
         if loglevel == logging.ERROR:
-            self.err_msgs_queue.put(msg)
+            self.err_msgs.append(msg)
         if loglevel == logging.WARN:
-            self.warn_msgs_queue.put(msg)
+            self.warn_msgs.append(msg)
 
     def error_msgs(self):
-        while not self.err_msgs_queue.empty():
-            yield self.err_msgs_queue.get()
+        while self.err_msgs:
+            yield self.err_msgs.pop(0)
 
     def warning_msgs(self):
-        while not self.warn_msgs_queue.empty():
-            yield self.warn_msgs_queue.get()
+        while self.warn_msgs:
+            yield self.warn_msgs.pop(0)
 
     def _print_msg(self, stream, msg, record):
         same_line = hasattr(record, 'same_line')
@@ -64,9 +77,9 @@ class ProgressConsoleHandler(logging.StreamHandler):
             stream.write(self.terminator)
 
     def _flush_errors(self, stream):
-        if not self.err_msgs_queue.empty():
+        if self.err_msgs:
             self._flush_store(stream, self.error_msgs(), 'ERRORS:')
-        if not self.warn_msgs_queue.empty():
+        if self.warn_msgs:
             self._flush_store(stream, self.warning_msgs(), 'WARNINGS:')
 
     def _write_msg(self, stream, msg, record):
@@ -96,64 +109,365 @@ def read_args(argsargs=argparse.ArgumentParser):
     args.add_argument('-i', '--images', help='Images base directory')
     args.add_argument('-vv', '--verbose', help='Generate emails despite errors', action='store_true')
     args.add_argument('-v', '--version', help='Show version', action='store_true')
+    args.add_argument('-r', '--error-report', help='Write a JSON report of emails with errors to the given path')
+    args.add_argument('-l', '--shorten-links', nargs='?', const=link_shortener.KsShortener.url, metavar='URL',
+                      help='Shorten links in text emails, optionally with the given shortener url')
+    args.add_argument('-e', '--email', dest='email_filter', metavar='GLOB',
+                      help='Render only emails with matching names')
+    args.add_argument('--locale', dest='locale_filter', metavar='GLOB', help='Render only emails in matching locales')
+    args.add_argument('-t', '--template', dest='template_filter', metavar='GLOB',
+                      help='Render only emails using matching templates')
+    args.add_argument('--render-cache', metavar='DIR',
+                      help='Reuse emails rendered from the same sources by previous builds stored in the directory')
+    args.add_argument('--source-cache', metavar='DIR',
+                      help='Load email sources compiled by previous runs from the directory instead of parsing them')
+    args.add_argument('--from-list', metavar='PATH',
+                      help='Render only emails listed in the file, one path per line. Paths of templates, styles and '
+                           'globals select emails depending on them')
+    args.add_argument('--sink', choices=sinks.SINKS, default='directory',
+                      help='Write rendered emails into the destination directory, a tar or zip archive, NDJSON '
+                           'records or an indexed bundle of emails and their variants')
+    args.add_argument('--dedupe', action='store_true',
+                      help='Store identical outputs once: hardlinks in the destination directory and tar archives')
+    args.add_argument('--objects-dir', metavar='DIR',
+                      help='Directory of single copies of deduplicated outputs of the directory sink, on the same '
+                           'filesystem as the destination directory. Defaults to <destination>.objects')
+    args.add_argument('--sink-output', metavar='PATH',
+                      help='Output file of tar, zip, ndjson and bundle sinks, - for stdout')
+    args.add_argument('--minify', action='store_true', help='Minify rendered html')
+    args.add_argument('--compress', action='append', choices=sorted(const.COMPRESSION_EXTENSIONS), default=[],
+                      metavar='ENCODING',
+                      help='Also write precompressed copies of texts and htmls, gzip or br, repeat for both')
 
     subparsers = args.add_subparsers(help='Parser additional commands', dest='command')
 
     config_parser = subparsers.add_parser('config')
     config_parser.add_argument('config_name', help='Name of config to generate. Available: `placeholders`')
 
-    return args.parse_args()
+    validate_parser = subparsers.add_parser('validate', help='Validate placeholders of all emails against the config')
+    validate_parser.add_argument('--locale', help='Validate only emails in the given locale')
+    validate_parser.add_argument('-o', '--output', help='Write a JSON report of invalid emails to the given path')
 
+    check_parser = subparsers.add_parser('check', help='Check that all emails can be rendered without rendering them')
+    check_parser.add_argument('--locale', help='Check only emails in the given locale')
 
-def _parse_and_save(email, parser):
-    result = parser.render_email(email)
-    if result:
-        subject, text, html = result
-        fs.save_parsed_email(parser.root_path, email, subject, text, html)
-        return True
-    else:
-        return False
+    subparsers.add_parser('compile', help='Compile all email sources into the --source-cache directory')
 
+    watch_parser = subparsers.add_parser('watch', help='Render emails again whenever their sources change')
+    watch_parser.add_argument('--interval', type=float, default=const.WATCH_INTERVAL,
+                              help='Seconds between checks for changed files')
 
-def _parse_emails_batch(emails, parser):
-    results = []
-    for email in emails:
-        try:
-            results.append(_parse_and_save(email, parser))
-        except Exception as ex:
-            logger.exception('Cannot _parse_and_save email %s', email, exc_info=ex)
+    serve_parser = subparsers.add_parser('serve', help='Serve rendered emails over HTTP')
+    serve_parser.add_argument('--host', default=const.SERVICE_HOST, help='Address to listen on')
+    serve_parser.add_argument('--port', type=int, default=const.SERVICE_PORT, help='Port to listen on')
 
-    result = reduce(lambda acc, res: acc and res, results)
-    return result
+    return args.parse_args()
+
+
+def _email_result(email, status, started, error_type=None, message=None, segment_id=None):
+    duration = round(time.perf_counter() - started, 6)
+    return EmailResult(email.name, email.locale, status, error_type, message, segment_id, duration)
 
 
-def _parse_emails(loop, root_path):
-    shutil.rmtree(os.path.join(root_path, config.paths.destination), ignore_errors=True)
-    emails = fs.emails(root_path)
-    executor = concurrent.futures.ProcessPoolExecutor(max_workers=const.DEFAULT_WORKER_POOL)
+def _write_email(email, variant, subject, text, html, sink, rendered, options):
+    if options.minify:
+        html = minify.minify_html(html)
+    # compressed in the workers, the building process only writes outputs
+    compressed = compression.compress_email(text, html, options.compress) if options.compress else None
+    if sink:
+        sink.write(email, subject, text, html, variant, compressed)
+    else:
+        rendered.append((email, variant, subject, text, html, compressed))
+
+
+def _render_variants(email, parser, errors):
+    """
+    :param errors: list collecting parse failures of the variants
+    :returns: list of variants with their subject, text and html or None if a variant has no content
+    """
+    variants = []
+    for variant in parser.get_email_variants(email.name, email.locale):
+        result = parser.render_email(email, variant, errors=errors)
+        if not result:
+            return None
+        subject, text, html = result
+        variants.append((variant, subject, text, html))
+    return variants
+
+
+def _parse_and_save(email, parser, sink, rendered, options=_DEFAULT_OUTPUT):
+    started = time.perf_counter()
+    failures = []
+    try:
+        result = parser.render_email(email, errors=failures)
+    except Exception as ex:
+        segment_id = failures[-1].segment_id if failures else None
+        return _email_result(email, ResultStatus.error, started, type(ex).__name__, str(ex), segment_id)
+
+    if not result:
+        if not failures:
+            return _email_result(email, ResultStatus.error, started, 'EmptyContent', 'email has no content')
+        failure = failures[-1]
+        return _email_result(email, ResultStatus.error, started, 'ParseError', failure.message, failure.segment_id)
+
+    subject, text, html = result
+    variants = []
+    if options.variants:
+        # all variants are rendered before anything of the email is written
+        variant_failures = []
+        try:
+            variants = _render_variants(email, parser, variant_failures)
+        except Exception as ex:
+            return _email_result(email, ResultStatus.error, started, type(ex).__name__, 'variant: %s' % ex)
+        if variants is None:
+            if not variant_failures:
+                return _email_result(email, ResultStatus.error, started, 'EmptyContent', 'variant has no content')
+            failure = variant_failures[-1]
+            return _email_result(email, ResultStatus.error, started, 'ParseError', 'variant: %s' % failure.message,
+                                 failure.segment_id)
+    _write_email(email, None, subject, text, html, sink, rendered, options)
+    for variant, variant_subject, variant_text, variant_html in variants:
+        _write_email(email, variant, variant_subject, variant_text, variant_html, sink, rendered, options)
+    if failures:
+        # the email was rendered from the default locale after its own content failed to parse
+        failure = failures[0]
+        return _email_result(email, ResultStatus.warning, started, 'ParseError', failure.message, failure.segment_id)
+    return _email_result(email, ResultStatus.ok, started)
+
+
+def _parse_emails_batch(emails, parser, sink, options=_DEFAULT_OUTPUT, token=None):
+    """
+    :param sink: sink written by the worker or None if rendered emails are returned to the building process
+    :param options: OutputOptions, whether variants of emails are rendered too, htmls minified and outputs compressed
+    :param token: optional token of builds sharing worker processes, the worker renders with the parser it got first
+    :returns: tuple of results and rendered emails
+    """
+    if token is not None:
+        parser = _worker_parsers.setdefault(token, parser)
+    rendered = []
+    results = [_parse_and_save(email, parser, sink, rendered, options) for email in emails]
+    return results, rendered
+
+
+def _write_shortened(loop, parser, sink, rendered, options):
+    """
+    Shortens links marked in texts of all rendered emails in one batch and writes the emails.
+    """
+    links = set()
+    for _, _, _, text, _, _ in rendered:
+        links.update(link_shortener.marked_links(text))
+    yield from asyncio.ensure_future(parser.link_shortener.shorten_async(links, loop), loop=loop)
+    parser.link_shortener.cache.save()
+    for email, variant, subject, text, html, _ in rendered:
+        text = link_shortener.unmark(text, parser.link_shortener.cache)
+        compressed = compression.compress_email(text, html, options.compress) if options.compress else None
+        sink.write(email, subject, text, html, variant, compressed)
+
+
+def _log_results(results):
+    for result in results:
+        if result.status == ResultStatus.ok:
+            continue
+        log = logger.error if result.status == ResultStatus.error else logger.warning
+        log('%s (%s): %s: %s, segment ID: %s', result.name, result.locale, result.error_type, result.message,
+            result.segment_id)
+
+
+def _save_report(results, report_path):
+    failed = [result for result in results if result.status != ResultStatus.ok]
+    report = {
+        'emails': len(results),
+        'errors': sum(1 for result in failed if result.status == ResultStatus.error),
+        'warnings': sum(1 for result in failed if result.status == ResultStatus.warning),
+        'duration': round(sum(result.duration for result in results), 6),
+        'results': [dict(result._asdict(), status=result.status.value) for result in failed]
+    }
+    fs.save_file(json.dumps(report, sort_keys=True, indent=const.JSON_INDENT), report_path)
+
+
+def _email_template(root_path, email):
+    attributes = reader.read_template_attributes(email.path)
+    if attributes is None and email.locale != const.DEFAULT_LOCALE:
+        # malformed emails are rendered from the default locale
+        default_email = fs.locale_email(root_path, email.name, const.DEFAULT_LOCALE)
+        attributes = reader.read_template_attributes(default_email.path)
+    return attributes[0] if attributes else None
+
+
+def _read_list(root_path, list_path):
+    emails = {}
+    graph = None
+    for path in filter(None, (line.strip() for line in fs.read_file(list_path).splitlines())):
+        email = fs.source_email(root_path, path)
+        if email is not None:
+            if os.path.isfile(email.path):
+                emails[(email.name, email.locale)] = email
+            else:
+                logger.warning('%s does not exist, skipping', path)
+            continue
+        graph = graph or dependencies.DependencyGraph(root_path).build()
+        dependents = graph.get_dependents(path)
+        if not dependents:
+            logger.warning('%s is not used by any email, skipping', path)
+        emails.update(((email.name, email.locale), email) for email in dependents)
+    return [emails[key] for key in sorted(emails)]
+
+
+def select_emails(root_path, email_name=None, locale=None, template=None, list_path=None):
+    """
+    Selects emails matching all given filters.
+
+    :param email_name: optional glob of email names
+    :param locale: optional glob of locales
+    :param template: optional glob of template file names
+    :param list_path: optional file with paths of emails, templates, styles or globals, one per line
+    :returns: list of emails or None without any filter
+    """
+    if not any((email_name, locale, template, list_path)):
+        return None
+    if list_path:
+        emails = [email for email in _read_list(root_path, list_path)
+                  if fnmatchcase(email.name, email_name or '*') and fnmatchcase(email.locale, locale or '*')]
+    else:
+        # name and locale are pushed down to the glob of the source directory
+        emails = fs.emails(root_path, email_name, locale)
+    if template:
+        emails = [email for email in emails if fnmatchcase(_email_template(root_path, email) or '', template)]
+    return list(emails)
+
+
+def _create_parser(root_path, shortener_url=None, render_cache_dir=None, source_cache_dir=None, base_img_path=None):
+    # the config is pickled with the parser so workers render with it whichever way processes are started
+    conf = config.current()._replace(shortener_url=shortener_url)
+    if base_img_path:
+        conf = conf._replace(base_img_path=base_img_path)
+    return Parser(root_path, render_cache_dir=render_cache_dir, source_cache_dir=source_cache_dir, conf=conf)
+
+
+def _parse_emails(loop, parser, executor, emails=None, sink='directory', output_path=None, dedupe=False,
+                  minify_html=False, compress=(), objects_dir=None, token=None):
+    """
+    :param executor: process pool rendering the emails
+    :param token: optional token of builds sharing the executor, see `_parse_emails_batch`
+    """
+    root_path, conf = parser.root_path, parser.config
+    sink_kind, sink = sink, sinks.create(sink, root_path, output_path, conf, dedupe, objects_dir)
+    if compress and not sink.supports_compression:
+        logger.warning('%s sink cannot store compressed outputs, writing them uncompressed', sink_kind)
+        compress = ()
+    sink.open(full_build=emails is None)
+    options = OutputOptions(sink.variants, minify_html, tuple(compress))
+    # links are shortened once for the whole build: workers mark links missing in the cache and emails are written
+    # here after all of them are rendered, texts are compressed once their links are replaced
+    shorten_links = parser.link_shortener.enabled
+    parser.link_shortener.deferred = shorten_links
+    worker_sink = sink if sink.in_workers and not shorten_links else None
+    worker_options = options._replace(compress=()) if shorten_links else options
+    emails = fs.emails(root_path, conf=conf) if emails is None else iter(emails)
     tasks = []
-    parser = Parser(root_path)
 
     emails_batch = list(islice(emails, const.DEFAULT_WORKER_POOL))
     while emails_batch:
-        task = loop.run_in_executor(executor, _parse_emails_batch, emails_batch, parser)
+        task = loop.run_in_executor(executor, _parse_emails_batch, emails_batch, parser, worker_sink,
+                                    worker_options, token)
         tasks.append(task)
         emails_batch = list(islice(emails, const.DEFAULT_WORKER_POOL))
-    results = yield from asyncio.gather(*tasks)
-    result = reduce(lambda acc, result: True if acc and result else False, results)
-    return result
+    batches, pending = [], []
+    try:
+        # batches are written in order as soon as they are done while later ones are still rendering
+        for task in tasks:
+            results, rendered = yield from task
+            if shorten_links:
+                pending.extend(rendered)
+            else:
+                for email, variant, subject, text, html, compressed in rendered:
+                    sink.write(email, subject, text, html, variant, compressed)
+            batches.append(results)
+        if pending:
+            yield from _write_shortened(loop, parser, sink, pending, options)
+    except BaseException:
+        sink.abort()
+        raise
+    sink.close()
+    return list(chain.from_iterable(batches))
+
+
+def parse_emails(root_path, report_path=None, shortener_url=None, emails=None, render_cache_dir=None,
+                 source_cache_dir=None, base_img_path=None, sink='directory', output_path=None, dedupe=False,
+                 minify_html=False, compress=(), objects_dir=None):
+    """
+    Renders emails into the destination directory.
+
+    :param root_path: root path of repository
+    :param report_path: optional path of a JSON report with emails which failed or needed a fallback
+    :param shortener_url: optional url of the link shortener used for links in text emails
+    :param emails: optional collection of emails to render, outputs of other emails are left untouched. By default
+                   the destination directory is cleared and all emails are rendered
+    :param render_cache_dir: optional directory of emails rendered by previous builds, see RenderCache
+    :param source_cache_dir: optional directory of compiled email sources
+    :param base_img_path: optional base url of images overriding the configured one
+    :param sink: one of sinks.SINKS, rendered emails are written into the destination directory by default
+    :param output_path: output file of tar, zip, ndjson and bundle sinks or '-' for stdout
+    :param dedupe: store identical outputs once if the sink supports it
+    :param minify_html: minify rendered htmls, see `minify`
+    :param compress: encodings of precompressed copies of texts and htmls written next to them, see `compression`
+    :param objects_dir: optional directory of copies of deduplicated outputs of the directory sink
+    :returns: True if every email was rendered
+    :raises ValueError: if a compression isn't available
+    """
+    compression.check(compress)
+    loop = init_loop()
+    parser = _create_parser(root_path, shortener_url, render_cache_dir, source_cache_dir, base_img_path)
+    executor = concurrent_futures.ProcessPoolExecutor(max_workers=const.DEFAULT_WORKER_POOL)
+    try:
+        results = loop.run_until_complete(
+            _parse_emails(loop, parser, executor, emails, sink, output_path, dedupe, minify_html, compress,
+                          objects_dir))
+    finally:
+        executor.shutdown()
+        parser.close()
+    _log_results(results)
+    if report_path:
+        _save_report(results, report_path)
+    return all(result.status != ResultStatus.error for result in results)
+
+
+def watch_emails(root_path, interval=const.WATCH_INTERVAL, shortener_url=None, base_img_path=None):
+    """
+    Polls the repository for changed files and renders affected emails until interrupted. One parser and pool of
+    worker processes, with their caches, are kept for the whole session.
+    """
+    parser = _create_parser(root_path, shortener_url, base_img_path=base_img_path)
+    watcher = watch.Watcher(root_path, parser.config)
+    loop = init_loop()
+    executor = concurrent_futures.ProcessPoolExecutor(max_workers=const.DEFAULT_WORKER_POOL)
+    token = next(_tokens)
+    logger.info('watching %s for changes, press Ctrl+C to stop', root_path)
+    try:
+        while True:
+            time.sleep(interval)
+            _render_changes(loop, parser, executor, token, watcher)
+    except KeyboardInterrupt:
+        return True
+    finally:
+        executor.shutdown()
+        parser.close()
 
 
-def parse_emails(root_path):
-    loop = init_loop()
-    result = loop.run_until_complete(_parse_emails(loop, root_path))
-    return result
+def _render_changes(loop, parser, executor, token, watcher):
+    emails, removed = watcher.poll()
+    for email in removed:
+        logger.info('removing %s (%s)', email.name, email.locale)
+        fs.delete_parsed_email(parser.root_path, email, parser.config)
+    if emails:
+        logger.info('rendering %s', ', '.join('%s (%s)' % (email.name, email.locale) for email in emails))
+        _log_results(loop.run_until_complete(_parse_emails(loop, parser, executor, emails, token=token)))
+    if emails or removed:
+        logger.info('done', extra={'flush_errors': True})
 
 
 def print_version():
-    import pkg_resources
-    version = pkg_resources.require('ks-email-parser')[0].version
-    print(version)
+    print(__version__)
     return True
 
 
@@ -163,17 +477,98 @@ def generate_config(root_path):
     return True
 
 
-def execute_command(args):
+def validate_placeholders(root_path, locale=None, output_path=None):
+    """
+    Validates placeholders of all emails in parallel.
+
+    :returns: True if all emails have expected placeholders
+    """
+    report = Parser(root_path).validate_placeholders(locale)
+    for result in report['results']:
+        if result['error']:
+            logger.error('%s (%s): %s', result['name'], result['locale'], result['error'])
+        else:
+            logger.error('%s (%s): missing: %s, extra: %s, count mismatch: %s', result['name'], result['locale'],
+                         result['missing'], result['extra'],
+                         ['%(placeholder)s %(count)s/%(expected_count)s' % diff for diff in result['diff_number']])
+    if output_path:
+        fs.save_file(json.dumps(report, sort_keys=True, indent=const.JSON_INDENT), output_path)
+    logger.info('%s emails validated, %s invalid', report['emails'], report['invalid'])
+    return not report['invalid']
+
+
+def check_emails(root_path, locale=None, report_path=None):
+    """
+    Checks sources, templates, styles and placeholders of all emails in parallel.
+
+    :param report_path: optional path of a JSON report with emails which failed the check
+    :returns: True if every email can be rendered
+    """
+    results = Parser(root_path).check_emails(locale)
+    _log_results(results)
+    if report_path:
+        _save_report(results, report_path)
+    errors = sum(1 for result in results if result.status == ResultStatus.error)
+    logger.info('%s emails checked, %s with errors', len(results), errors)
+    return not errors
+
+
+def compile_sources(root_path, source_cache_dir):
+    """
+    Compiles all email sources into the source cache directory.
+
+    :returns: True if the directory was given, malformed emails are only reported, builds parse them again
+    """
+    if not source_cache_dir:
+        logger.error('compile needs a --source-cache directory')
+        return False
+    failed = Parser(root_path, source_cache_dir=source_cache_dir).compile_sources()
+    for email in failed:
+        logger.warning('%s (%s) is empty or malformed, not compiled', email.name, email.locale)
+    return True
+
+
+def serve(root_path, host=const.SERVICE_HOST, port=const.SERVICE_PORT, render_cache_dir=None, source_cache_dir=None,
+          base_img_path=None):
+    """
+    Serves rendered emails over HTTP until interrupted, see RenderService.
+    """
+    conf = config.current()
+    if base_img_path:
+        conf = conf._replace(base_img_path=base_img_path)
+    loop = init_loop()
+    with closing(aio.AsyncParser(root_path, render_cache_dir=render_cache_dir, source_cache_dir=source_cache_dir,
+                                 conf=conf)) as parser:
+        server = loop.run_until_complete(service.RenderService(parser).start(host, port))
+        logger.info('serving %s on http://%s:%s, press Ctrl+C to stop', root_path, host, port)
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+    return True
+
+
+def execute_command(args, root_path):
     if args.command == 'config' and args.config_name == 'placeholders':
-        return generate_config(args)
+        return generate_config(root_path)
+    if args.command == 'validate':
+        return validate_placeholders(root_path, args.locale, args.output)
+    if args.command == 'check':
+        return check_emails(root_path, args.locale, args.error_report)
+    if args.command == 'compile':
+        return compile_sources(root_path, args.source_cache)
+    if args.command == 'watch':
+        return watch_emails(root_path, args.interval, args.shorten_links, args.images)
+    if args.command == 'serve':
+        return serve(root_path, args.host, args.port, args.render_cache, args.source_cache, args.images)
     return False
 
 
-def init_log(verbose):
+def init_log(verbose, stream=None):
     log_level = logging.DEBUG if verbose else logging.INFO
-    error_msgs_queue = Manager().Queue()
-    warning_msgs_queue = Manager().Queue()
-    handler = ProgressConsoleHandler(error_msgs_queue, warning_msgs_queue, stream=sys.stdout)
+    handler = ProgressConsoleHandler(stream=stream or sys.stdout)
     logger.setLevel(log_level)
     logger.addHandler(handler)
 
@@ -187,15 +582,27 @@ def init_loop():
 def main():
     root_path = os.getcwd()
     args = read_args()
-    init_log(args.verbose)
-    if args.images:
-        config.base_img_path = args.images
+    # emails streamed to stdout mustn't be mixed with the log
+    init_log(args.verbose, sys.stderr if args.sink_output == const.STDOUT_PATH else None)
     if args.version:
         result = print_version()
     elif args.command:
-        result = execute_command(args)
+        result = execute_command(args, root_path)
     else:
-        result = parse_emails(root_path)
+        if args.sink != 'directory' and not args.sink_output:
+            logger.error('%s sink needs --sink-output', args.sink)
+            sys.exit(1)
+        try:
+            compression.check(args.compress)
+        except ValueError as ex:
+            logger.error(ex)
+            sys.exit(1)
+        emails = select_emails(root_path, args.email_filter, args.locale_filter, args.template_filter, args.from_list)
+        if emails is not None:
+            logger.info('rendering %s selected emails', len(emails))
+        result = parse_emails(root_path, args.error_report, args.shorten_links, emails, args.render_cache,
+                              args.source_cache, args.images, args.sink, args.sink_output, args.dedupe, args.minify,
+                              args.compress, args.objects_dir)
     logger.info('\nAll done', extra={'flush_errors': True})
     sys.exit(0) if result else sys.exit(1)
 
@@ -0,0 +1,55 @@
+"""
+Precompressed copies of rendered emails, e.g. served as they are by storage with a Content-Encoding.
+"""
+
+import gzip
+import io
+
+from . import utils
+
+brotli = utils.lazy_import('brotli')
+
+
+def _gzip(content):
+    buffer = io.BytesIO()
+    # without a timestamp identical outputs compress to identical files, see deduplication
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0) as fp:
+        fp.write(content)
+    return buffer.getvalue()
+
+
+def _brotli(content):
+    return brotli.compress(content)
+
+
+_COMPRESSORS = {'gzip': _gzip, 'br': _brotli}
+
+
+def check(encodings):
+    """
+    :raises ValueError: if an encoding is unknown or its optional dependency isn't installed
+    """
+    for encoding in encodings:
+        if encoding not in _COMPRESSORS:
+            raise ValueError('unknown compression %s, use one of %s' % (encoding, ', '.join(sorted(_COMPRESSORS))))
+        if encoding == 'br':
+            try:
+                brotli.compress
+            except ImportError:
+                raise ValueError('br compression needs the brotli package')
+
+
+def compress(content, encoding):
+    """
+    :param content: str, compressed as utf-8, or bytes
+    :param encoding: gzip or br
+    :returns: compressed bytes
+    """
+    return _COMPRESSORS[encoding](content.encode('utf-8') if isinstance(content, str) else content)
+
+
+def compress_email(text, html, encodings):
+    """
+    :returns: dict of tuples of compressed text and html by encoding, subjects aren't worth compressing
+    """
+    return {encoding: (compress(text, encoding), compress(html, encoding)) for encoding in encodings}
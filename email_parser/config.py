@@ -1,29 +1,59 @@
 from collections import namedtuple
 
 Paths = namedtuple('Paths', ['source', 'destination', 'templates', 'images', 'sections'])
+# lists and dicts are stored as tuples so a Config can't change once it's shared, e.g. with worker processes
+Config = namedtuple('Config', ['paths', 'pattern', 'base_img_path', 'rtl_locales', 'lang_mappings', 'shortener_url'])
 
 _default_paths = Paths('src', 'target', 'templates_html', 'templates_html/img', 'templates_html/sections')
 _default_pattern = '{locale}/{name}.xml'
 _default_base_img_path = 'http://www.getkeepsafe.com/emails/img'
 _default_rtl = ['ar', 'he']
 _default_lang_mappings = {'pt-BR': 'pt', 'zh-TW-Hant': 'zh-TW'}
+_default_shortener_url = None
 
 paths = _default_paths
 pattern = _default_pattern
 base_img_path = _default_base_img_path
 rtl_locales = _default_rtl
 lang_mappings = _default_lang_mappings
+shortener_url = _default_shortener_url
 
 
-def init(*,
-         _paths=_default_paths,
-         _pattern=_default_pattern,
-         _base_img_path=_default_base_img_path,
-         _rtl_locales=_default_rtl,
-         _lang_mappings=_default_lang_mappings):
-    global paths, pattern, base_img_path, rtl_locales, lang_mappings
-    paths = _default_paths
-    pattern = _pattern
-    base_img_path = _base_img_path
-    rtl_locales = _rtl_locales
-    lang_mappings = _lang_mappings
+def create(*,
+           _paths=_default_paths,
+           _pattern=_default_pattern,
+           _base_img_path=_default_base_img_path,
+           _rtl_locales=_default_rtl,
+           _lang_mappings=_default_lang_mappings,
+           _shortener_url=_default_shortener_url):
+    """
+    :returns: Config, module defaults aren't changed
+    """
+    return Config(Paths(*_paths), _pattern, _base_img_path, tuple(_rtl_locales),
+                  tuple(sorted(dict(_lang_mappings).items())), _shortener_url)
+
+
+def current():
+    """
+    :returns: Config of module defaults, used by functions called without a Config
+    """
+    return create(_paths=paths, _pattern=pattern, _base_img_path=base_img_path, _rtl_locales=rtl_locales,
+                  _lang_mappings=lang_mappings, _shortener_url=shortener_url)
+
+
+def resolve(conf):
+    return conf if conf is not None else current()
+
+
+def init(**kwargs):
+    """
+    Sets module defaults, takes the same arguments as `create`.
+    """
+    global paths, pattern, base_img_path, rtl_locales, lang_mappings, shortener_url
+    conf = create(**kwargs)
+    paths = conf.paths
+    pattern = conf.pattern
+    base_img_path = conf.base_img_path
+    rtl_locales = list(conf.rtl_locales)
+    lang_mappings = dict(conf.lang_mappings)
+    shortener_url = conf.shortener_url
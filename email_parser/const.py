@@ -9,6 +9,9 @@ GLOBALS_EMAIL_NAME = 'global'
 GLOBALS_PLACEHOLDER_PREFIX = 'global_'
 REPO_SRC_PATH = 'src'
 PLACEHOLDERS_FILENAME = 'placeholders_config.json'
+LINKS_CACHE_FILENAME = 'links_cache.json'
+# indexes of checkouts sharing a cache directory are told apart by a digest of their root path
+METADATA_INDEX_FILENAME = 'metadata_index.%s.json'
 
 INLINE_TEXT_PATTERN = r'\[{2}(.+)\]{2}'
 IMAGE_PATTERN = '![{}]({}/{})'
@@ -18,7 +21,35 @@ SEGMENT_NAME_REGEX = r' name="([^"]+)"'
 TEXT_EMAIL_PLACEHOLDER_SEPARATOR = '\n\n'
 HTML_PARSER = 'lxml'
 LOCALE_PLACEHOLDER = '{link_locale}'
+# placeholders left in rendered emails and filled in when sending, e.g. {{unsubscribe_link}}
+RUNTIME_PLACEHOLDER_REGEX = r'\{\{(\w+)\}\}'
 
 DEFAULT_LOCALE = 'en'
 DEFAULT_WORKER_POOL = 10
+DEFAULT_SHORTENER_POOL = 8
+DEFAULT_READER_POOL = 8
+DEFAULT_IO_POOL = 16
+VALIDATION_BATCH = 100
+# bump when CompiledEmail or placeholders change so stale compiled sources aren't loaded
+SOURCE_CACHE_FORMAT = 1
+PREVIEW_SESSIONS_LIMIT = 32
+WATCH_INTERVAL = 1.0
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8080
+STDOUT_PATH = '-'
+# single copies of deduplicated outputs in the destination directory
+# directory of copies of deduplicated outputs next to the destination directory, out of deployed files
+OBJECTS_SUFFIX = '.objects'
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'br': '.br'}
+BUNDLE_MAGIC = b'KSEB'
+# bump when the layout of bundles changes
+BUNDLE_FORMAT = 3
 JSON_INDENT = 4
+CACHE_LIMITS = {
+    'templates': 256,
+    'styles': 256,
+    'globals': 64,
+    'emails': 1024,
+    'config': 4,
+    'fragments': 4096,
+}
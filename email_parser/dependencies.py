@@ -0,0 +1,118 @@
+"""
+Reverse dependency graph of a repository: which emails use a given template, style or globals file.
+"""
+
+import logging
+import os
+import threading
+
+from . import fs, reader, const, config
+from .model import *
+
+logger = logging.getLogger(__name__)
+
+
+def _realpath(*path_parts):
+    return os.path.realpath(os.path.join(*path_parts))
+
+
+def email_dependencies(root_path, email, conf=None):
+    """
+    :param conf: optional Config, module defaults are used without it
+    :returns: set of paths of all files the rendered email depends on
+    """
+    conf = config.resolve(conf)
+    dependencies = {_realpath(email.path), _realpath(fs.global_email(root_path, email.locale, conf).path)}
+    attributes = reader.read_template_attributes(email.path)
+    if attributes is None:
+        if email.locale != const.DEFAULT_LOCALE:
+            # malformed emails are rendered from the default locale
+            default_email = fs.locale_email(root_path, email.name, const.DEFAULT_LOCALE, conf)
+            dependencies.update(email_dependencies(root_path, default_email, conf))
+        return dependencies
+    template_filename, email_type, styles_names = attributes
+    if template_filename:
+        # without email_type the template is looked up in every type directory, all of them are dependencies
+        paths = reader.template_paths(root_path, template_filename, email_type, styles_names, conf)
+    else:
+        paths = [os.path.join(root_path, conf.paths.templates, f) for f in styles_names]
+    dependencies.update(_realpath(str(path)) for path in paths)
+    return dependencies
+
+
+class DependencyGraph(object):
+    """
+    Maps emails to the files they depend on and files to the emails depending on them.
+
+    Edges are read from emails' root element only (template, style and email_type attributes) and the locale.
+    Files are identified by their real path so a template can be queried before it exists. The graph is safe to use
+    from many threads.
+    """
+
+    def __init__(self, root_path, conf=None):
+        self.root_path = root_path
+        self.conf = conf
+        self.emails = {}
+        self._dependencies = {}
+        self._dependents = {}
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def build(self):
+        for email in fs.emails(self.root_path, conf=self.conf):
+            self.add(email)
+        return self
+
+    def add(self, email):
+        """
+        Adds an email or updates its dependencies if it's already in the graph.
+        """
+        key = (email.name, email.locale)
+        dependencies = email_dependencies(self.root_path, email, self.conf)
+        with self._lock:
+            self.remove(*key)
+            self.emails[key] = email
+            self._dependencies[key] = dependencies
+            for path in dependencies:
+                self._dependents.setdefault(path, set()).add(key)
+
+    def remove(self, email_name, locale):
+        key = (email_name, locale)
+        with self._lock:
+            self.emails.pop(key, None)
+            for path in self._dependencies.pop(key, set()):
+                dependents = self._dependents.get(path)
+                if dependents:
+                    dependents.discard(key)
+                    if not dependents:
+                        del self._dependents[path]
+
+    def path(self, path):
+        """
+        :param path: absolute path or path relative to the repository root
+        :returns: normalized path used as graph key
+        """
+        return _realpath(self.root_path, str(path))
+
+    def get_dependents(self, path):
+        """
+        :returns: list of emails depending on the file sorted by name and locale
+        """
+        path = self.path(path)
+        with self._lock:
+            return [self.emails[key] for key in sorted(self._dependents.get(path, set()))]
+
+    def get_dependencies(self, email_name, locale):
+        """
+        :returns: sorted list of paths the email depends on
+        """
+        with self._lock:
+            return sorted(self._dependencies.get((email_name, locale), set()))
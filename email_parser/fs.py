@@ -2,15 +2,19 @@
 All filesystem interaction.
 """
 
+import hashlib
 import logging
 import os
-import parse
+import threading
+from fnmatch import fnmatchcase
 from pathlib import Path
 from string import Formatter
 
-from . import const, config
+from . import const, config, utils
 from .model import *
 
+parse = utils.lazy_import('parse')
+
 logger = logging.getLogger(__name__)
 
 
@@ -30,9 +34,13 @@ def _has_correct_ext(path, pattern):
 
 
 # TODO extract globals
-def _emails(root_path, pattern, params):
-    source_path = os.path.join(root_path, config.paths.source)
-    wildcard_params = {k: '*' for k in params}
+def _emails(root_path, pattern, params, filters=None, conf=None):
+    """
+    :param filters: optional dict of globs by pattern param, they narrow the glob of the source directory
+    """
+    filters = filters or {}
+    source_path = os.path.join(root_path, config.resolve(conf).paths.source)
+    wildcard_params = {k: filters.get(k, '*') for k in params}
     wildcard_pattern = pattern.format(**wildcard_params)
     parser = parse.compile(pattern)
     glob_path = Path(source_path).glob(wildcard_pattern)
@@ -40,58 +48,79 @@ def _emails(root_path, pattern, params):
         if not path.is_dir() and _has_correct_ext(path, pattern):
             str_path = str(path.relative_to(source_path))
             result = parser.parse(str_path)
-            if result:  # HACK: result can be empty when pattern doesn't contain any placeholder
+            if result and all(fnmatchcase(result.named[k], v) for k, v in filters.items()):
+                # HACK: result can be empty when pattern doesn't contain any placeholder
                 result.named['path'] = str(path.resolve())
                 if not str_path.endswith(const.GLOBALS_EMAIL_NAME + const.SOURCE_EXTENSION):
                     logger.debug('loading email %s', result.named['path'])
                     yield result
 
 
-def get_email_filepath(email_name, locale):
-    pattern = config.pattern.replace('{name}', email_name)
+def get_email_filepath(email_name, locale, conf=None):
+    conf = config.resolve(conf)
+    pattern = conf.pattern.replace('{name}', email_name)
     pattern = pattern.replace('{locale}', locale)
-    filepath = os.path.join(config.paths.source, pattern)
+    filepath = os.path.join(conf.paths.source, pattern)
     return filepath
 
 
-def get_template_filepath(root_path, template_name, template_type):
-    return Path(root_path, config.paths.templates, template_type, template_name)
+def get_template_filepath(root_path, template_name, template_type, conf=None):
+    return Path(root_path, config.resolve(conf).paths.templates, template_type, template_name)
 
 
-def get_template_resources_filepaths(root_path, template):
+def get_template_resources_filepaths(root_path, template, conf=None):
     """
     :return: list of file paths of resources (css & html) related with given email
     """
-    paths = [Path(root_path, config.paths.templates, f) or ' ' for f in template.styles_names]
-    paths.append(get_template_filepath(root_path, template.name, template.type))
+    conf = config.resolve(conf)
+    paths = [Path(root_path, conf.paths.templates, f) or ' ' for f in template.styles_names]
+    paths.append(get_template_filepath(root_path, template.name, template.type, conf))
     return paths
 
 
-def emails(root_path, email_name=None, locale=None):
+def emails(root_path, email_name=None, locale=None, conf=None):
     """
     Resolves a pattern to a collection of emails.
 
-    :param src_dir: base dir for the search
-    :param pattern: search pattern
-    :exclusive_path: single email path, glob path for emails subset or None to not affect emails set
+    Names and locales are globs substituted into the pattern, only matching paths are listed.
+
+    :param root_path: root path of repository
+    :param email_name: optional email name or glob of names
+    :param locale: optional locale or glob of locales
+    :param conf: optional Config, module defaults are used without it
 
     :returns: generator for the emails matching the pattern
     """
-    params = _parse_params(config.pattern)
-    pattern = config.pattern
-    if email_name:
-        pattern = pattern.replace('{name}', email_name)
-    if locale:
-        pattern = pattern.replace('{locale}', locale)
-    for result in _emails(root_path, pattern, params):
-        if email_name:
-            result.named['name'] = email_name
-        if locale:
-            result.named['locale'] = locale
+    conf = config.resolve(conf)
+    params = _parse_params(conf.pattern)
+    filters = {k: v for k, v in (('name', email_name), ('locale', locale)) if v}
+    for result in _emails(root_path, conf.pattern, params, filters, conf):
         yield Email(**result.named)
 
 
-def email(root_path, email_name, locale):
+def source_email(root_path, path, conf=None):
+    """
+    Gets an email by the path of its source.
+
+    :param path: absolute path or path relative to the repository root
+    :returns: Email or None if the path isn't an email source
+    """
+    conf = config.resolve(conf)
+    source_path = os.path.realpath(os.path.join(root_path, conf.paths.source))
+    path = os.path.realpath(os.path.join(root_path, path))
+    relative_path = os.path.relpath(path, source_path)
+    if relative_path.startswith(os.pardir) or not _has_correct_ext(path, conf.pattern):
+        return None
+    if os.path.basename(path) == const.GLOBALS_EMAIL_NAME + const.SOURCE_EXTENSION:
+        return None
+    result = parse.parse(conf.pattern, relative_path)
+    if not result:
+        return None
+    result.named['path'] = path
+    return Email(**result.named)
+
+
+def email(root_path, email_name, locale, conf=None):
     """
     Gets an email by name and locale
 
@@ -102,21 +131,39 @@ def email(root_path, email_name, locale):
 
     :returns: generator for the emails with email_name
     """
-    params = _parse_params(config.pattern)
-    pattern = config.pattern.replace('{name}', email_name)
+    conf = config.resolve(conf)
+    params = _parse_params(conf.pattern)
+    pattern = conf.pattern.replace('{name}', email_name)
     pattern = pattern.replace('{locale}', locale)
-    for result in _emails(root_path, pattern, params):
+    for result in _emails(root_path, pattern, params, conf=conf):
         result.named['name'] = email_name
         result.named['locale'] = locale
         return Email(**result.named)
     return None
 
 
-def global_email(root_path, locale):
-    path = os.path.join(root_path, config.paths.source, locale, const.GLOBALS_EMAIL_NAME + const.SOURCE_EXTENSION)
+def global_email(root_path, locale, conf=None):
+    path = os.path.join(root_path, config.resolve(conf).paths.source, locale,
+                        const.GLOBALS_EMAIL_NAME + const.SOURCE_EXTENSION)
     return Email(const.GLOBALS_EMAIL_NAME, locale, path)
 
 
+def locale_email(root_path, email_name, locale, conf=None):
+    """
+    Gets an email by name and locale building its path from the pattern instead of searching the source directory.
+
+    :returns: Email tuple, the file might not exist
+    """
+    conf = config.resolve(conf)
+    try:
+        pattern = conf.pattern.format(name=email_name, locale=locale)
+    except KeyError:
+        # the pattern has other params, they can only be resolved by searching
+        return email(root_path, email_name, locale, conf)
+    path = os.path.join(root_path, conf.paths.source, pattern)
+    return Email(email_name, locale, os.path.abspath(path))
+
+
 def read_file(*path_parts):
     """
     Helper for reading files
@@ -127,16 +174,98 @@ def read_file(*path_parts):
         return fp.read()
 
 
+def read_bytes(*path_parts):
+    """
+    Helper for reading files without decoding them.
+    """
+    path = os.path.join(*path_parts)
+    logger.debug('reading bytes from %s', path)
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
 def save_file(content, *path_parts):
     """
-    Helper for saving files
+    Helper for saving files, bytes are saved as they are
     """
     path = os.path.join(*path_parts)
     logger.debug('saving file to %s', path)
-    with open(path, 'w') as fp:
+    with open(path, 'wb' if isinstance(content, bytes) else 'w') as fp:
         return fp.write(content)
 
 
+def mtimes(paths):
+    """
+    :returns: tuple of modification times in ns, None for paths which don't exist
+    """
+    result = []
+    for path in paths:
+        try:
+            result.append(os.stat(str(path)).st_mtime_ns)
+        except FileNotFoundError:
+            result.append(None)
+    return tuple(result)
+
+
+def _tmp_path(path):
+    # unique per thread, threads of a process may write the same file
+    return '%s.%s.%s.tmp' % (path, os.getpid(), threading.get_ident())
+
+
+def save_file_atomic(content, *path_parts):
+    """
+    Saves a file through a temporary one so readers never see it partially written
+    """
+    path = os.path.join(*path_parts)
+    tmp_path = _tmp_path(path)
+    save_file(content, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_file_linked(content, objects_path, *path_parts):
+    """
+    Saves a file as a hardlink of a single copy of its content in a content addressed directory, files with the same
+    content share it. The file is replaced, not written, so other links of its previous content are left intact.
+
+    :param objects_path: directory of copies, on the same filesystem
+    """
+    path = os.path.join(*path_parts)
+    digest = hashlib.sha256(content.encode('utf-8') if isinstance(content, str) else content).hexdigest()
+    object_path = os.path.join(objects_path, digest[:2], digest)
+    if not os.path.isfile(object_path):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        # concurrent builds write the same content, either copy is fine
+        save_file_atomic(content, object_path)
+    tmp_path = _tmp_path(path)
+    os.link(object_path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def objects_path(root_path, conf=None):
+    """
+    :returns: default directory of copies of deduplicated outputs, next to the destination directory
+    """
+    destination = os.path.join(root_path, config.resolve(conf).paths.destination)
+    return os.path.normpath(destination) + const.OBJECTS_SUFFIX
+
+
+def prune_objects(objects_path):
+    """
+    Removes copies in a directory of `save_file_linked` which no file links to anymore.
+
+    :returns: number of removed copies
+    """
+    removed = 0
+    for dirpath, _, filenames in os.walk(objects_path):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            # temporary files are copies being written by a concurrent build
+            if not filename.endswith('.tmp') and os.stat(path).st_nlink == 1:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
 def delete_file(*path_parts):
     """
     Helper for deleting files
@@ -146,21 +275,23 @@ def delete_file(*path_parts):
     os.remove(path)
 
 
-def save_email(root_path, content, email_name, locale):
-    pattern = config.pattern.replace('{locale}', locale)
+def save_email(root_path, content, email_name, locale, conf=None):
+    conf = config.resolve(conf)
+    pattern = conf.pattern.replace('{locale}', locale)
     pattern = pattern.replace('{name}', email_name)
-    path = os.path.join(root_path, config.paths.source, pattern)
+    path = os.path.join(root_path, conf.paths.source, pattern)
     save_file(content, path)
     return path
 
 
-def save_template(root_path, template_filename, template_type, template_content):
-    path = os.path.join(root_path, config.paths.templates, template_type.value, template_filename)
+def save_template(root_path, template_filename, template_type, template_content, conf=None):
+    path = os.path.join(root_path, config.resolve(conf).paths.templates, template_type.value, template_filename)
     written = save_file(template_content, path)
     return path, written
 
 
-def save_parsed_email(root_path, email, subject, text, html):
+def save_parsed_email(root_path, email, subject, text, html, conf=None, dedupe=False, compressed=None,
+                      objects_dir=None):
     """
     Saves an email. The locale and name are taken from email tuple.
 
@@ -168,17 +299,46 @@ def save_parsed_email(root_path, email, subject, text, html):
     :param subject: email's subject
     :param text: email's body as text
     :param html: email's body as html
-    :param dest_dir: root destination directory
+    :param conf: optional Config with the destination directory
+    :param dedupe: hardlink files to single copies of their content, see `save_file_linked`
+    :param compressed: optional dict of tuples of compressed text and html by encoding, saved next to them
+    :param objects_dir: directory of copies of deduplicated outputs on the destination's filesystem, see `objects_path`
+                        for the default
     """
     locale = email.locale or const.DEFAULT_LOCALE
-    folder = os.path.join(root_path, config.paths.destination, locale)
+    destination = os.path.join(root_path, config.resolve(conf).paths.destination)
+    folder = os.path.join(destination, locale)
     os.makedirs(folder, exist_ok=True)
-    save_file(subject, folder, email.name + const.SUBJECT_EXTENSION)
-    save_file(text, folder, email.name + const.TEXT_EXTENSION)
-    save_file(html, folder, email.name + const.HTML_EXTENSION)
+    files = [(subject, const.SUBJECT_EXTENSION), (text, const.TEXT_EXTENSION), (html, const.HTML_EXTENSION)]
+    for encoding, (compressed_text, compressed_html) in (compressed or {}).items():
+        compression_extension = const.COMPRESSION_EXTENSIONS[encoding]
+        files.append((compressed_text, const.TEXT_EXTENSION + compression_extension))
+        files.append((compressed_html, const.HTML_EXTENSION + compression_extension))
+    for content, extension in files:
+        if dedupe:
+            save_file_linked(content, objects_dir or objects_path(root_path, conf), folder, email.name + extension)
+        else:
+            # outputs of deduplicated builds are hardlinks, they are replaced so their other links aren't changed
+            save_file_atomic(content, folder, email.name + extension)
+
+
+def delete_parsed_email(root_path, email, conf=None):
+    """
+    Deletes rendered files of an email, missing files are ignored.
+    """
+    locale = email.locale or const.DEFAULT_LOCALE
+    folder = os.path.join(root_path, config.resolve(conf).paths.destination, locale)
+    extensions = [const.SUBJECT_EXTENSION, const.TEXT_EXTENSION, const.HTML_EXTENSION]
+    for compression_extension in const.COMPRESSION_EXTENSIONS.values():
+        extensions.extend((const.TEXT_EXTENSION + compression_extension, const.HTML_EXTENSION + compression_extension))
+    for extension in extensions:
+        try:
+            delete_file(folder, email.name + extension)
+        except FileNotFoundError:
+            pass
 
 
-def resources(root_path):
+def resources(root_path, conf=None):
     """
     TODO: separate styles and templates
     Returns a tuple of lists: html templates list and css styles list
@@ -187,7 +347,7 @@ def resources(root_path):
     """
     templates = {}
     styles = []
-    templates_path = os.path.join(root_path, config.paths.templates)
+    templates_path = os.path.join(root_path, config.resolve(conf).paths.templates)
     css_glob = Path(templates_path).glob('*' + const.CSS_EXTENSION)
     css_files = sorted(css_glob, key=lambda p: str(p))
     styles.extend(map(lambda p: p.name, css_files))
@@ -204,11 +364,17 @@ def resources(root_path):
     return templates, styles
 
 
-def get_html_sections_map(root_path):
-    html_sections = {}
-    html_sections_path = os.path.join(root_path, config.paths.sections)
+def html_sections(root_path, conf=None):
+    """
+    :returns: sorted list of paths of html sections
+    """
+    html_sections_path = os.path.join(root_path, config.resolve(conf).paths.sections)
     html_sections_glob = Path(html_sections_path).glob('*' + const.HTML_EXTENSION)
-    html_sections_files = sorted(html_sections_glob, key=lambda p: str(p))
-    for html_sections_path in html_sections_files:
+    return sorted(html_sections_glob, key=lambda p: str(p))
+
+
+def get_html_sections_map(root_path, conf=None):
+    html_sections = {}
+    for html_sections_path in html_sections(root_path, conf):
         html_sections[html_sections_path.name] = read_file(*html_sections_path.parts)
     return html_sections
@@ -1,10 +1,34 @@
-import requests
+"""
+Shortens links used in text emails.
+
+Links are shortened in batches: emails of a build (or a `Parser.render_many` call) are rendered once with links
+missing in the cache marked, all unique marked links are sent concurrently over a pooled HTTP session and the marks
+are replaced by the results. Results are kept in a persistent cache so every link is shortened only once.
+"""
+
+import json
+import logging
+import os
+import re
+from urllib.parse import urlparse
+
+from . import const, fs, utils
+
+asyncio = utils.lazy_import('asyncio')
+concurrent_futures = utils.lazy_import('concurrent.futures')
+requests = utils.lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+# XML sources can't contain NUL, rendered texts never have one besides marks
+_MARK = '\x00%s\x00'
+_MARKED = re.compile('\x00([^\x00]*)\x00')
 
 
 class NullShortener(object):
     name = 'null'
 
-    def __init__(self, config):
+    def __init__(self, url=None, pool_size=None):
         pass
 
     def shorten(self, link):
@@ -15,15 +39,192 @@ class KsShortener(object):
     name = 'keepsafe'
     url = 'http://4uon.ly/url/'
 
-    def __init__(self, config):
-        pass
+    def __init__(self, url=None, pool_size=const.DEFAULT_SHORTENER_POOL):
+        self.url = url or self.url
+        self.pool_size = pool_size
+        self._session = None
+
+    def __getstate__(self):
+        # sessions can't be pickled, every process opens its own pool
+        state = dict(self.__dict__)
+        state['_session'] = None
+        return state
+
+    @property
+    def session(self):
+        if self._session is None:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            self._session = requests.Session()
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+        return self._session
 
     def shorten(self, link):
         # TODO needs auth
         # TODO needs perm links
-        res = requests.post(self.url, data={'url': link})
-        return res.text
+        res = self.session.post(self.url, data={'url': link})
+        res.raise_for_status()
+        return res.text.strip()
+
+
+def shortener(url=None):
+    if url:
+        return KsShortener(url)
+    return NullShortener()
+
+
+def is_shortenable(link):
+    """
+    Only absolute http links are shortened, deep links and links with runtime placeholders are left as they are.
+    """
+    if not link or '{{' in link or '%7B%7B' in link:
+        return False
+    return urlparse(link).scheme in ('http', 'https')
+
+
+class LinkCache(object):
+    """
+    Persistent mapping of original links to their shortened versions stored as json.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._links = None
+        self._dirty = False
+
+    def __getstate__(self):
+        # only the path is sent to worker processes, they load the file on first use
+        return {'path': self.path, '_links': None, '_dirty': False}
+
+    @property
+    def links(self):
+        if self._links is None:
+            try:
+                self._links = json.loads(fs.read_file(self.path))
+            except FileNotFoundError:
+                self._links = {}
+            except ValueError:
+                logger.warning('links cache %s is corrupted, starting with an empty one', self.path)
+                self._links = {}
+        return self._links
+
+    def __contains__(self, link):
+        return link in self.links
+
+    def get(self, link, default=None):
+        return self.links.get(link, default)
+
+    def update(self, links):
+        if links:
+            self.links.update(links)
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        fs.save_file_atomic(json.dumps(self.links, sort_keys=True, indent=const.JSON_INDENT), self.path)
+        self._dirty = False
+
+
+class MarkedLinks(object):
+    """
+    Mapping of links used for rendering texts before their links are shortened. Cached links are shortened right
+    away, others are marked and replaced by `unmark` once they are shortened.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, link, default=None):
+        short = self.cache.get(link)
+        if short is not None:
+            return short
+        return _MARK % link if is_shortenable(link) else default
+
+
+def marked_links(text):
+    """
+    :returns: set of links marked in a rendered text
+    """
+    return set(_MARKED.findall(text))
+
+
+def unmark(text, links):
+    """
+    :param links: mapping of links to their shortened versions, links missing in it are left as they are
+    """
+    return _MARKED.sub(lambda match: links.get(match.group(1)) or match.group(1), text)
+
+
+class LinkShortener(object):
+    """
+    Shortens batches of links concurrently and memoizes results in a LinkCache.
+    """
+
+    def __init__(self, shortener, cache, max_workers=const.DEFAULT_SHORTENER_POOL):
+        self.shortener = shortener
+        self.cache = cache
+        self.max_workers = max_workers
+        # links missing in the cache are marked instead, see MarkedLinks
+        self.deferred = False
+
+    @property
+    def enabled(self):
+        return not isinstance(self.shortener, NullShortener)
+
+    @property
+    def links(self):
+        """
+        :returns: mapping of links to their shortened versions used for rendering
+        """
+        return MarkedLinks(self.cache) if self.deferred else self.cache
+
+    def _shorten_one(self, link):
+        try:
+            return link, self.shortener.shorten(link)
+        except Exception as ex:
+            logger.warning('cannot shorten link %s: %s', link, ex)
+            return link, None
+
+    async def shorten_async(self, links, loop):
+        """
+        Shortens links missing in the cache.
+
+        :param links: iterable of links
+        :param loop: event loop running the requests
+        :returns: dict of newly shortened links
+        """
+        missing = sorted(set(link for link in links if is_shortenable(link) and link not in self.cache))
+        if not missing:
+            return {}
+        logger.debug('shortening %s links', len(missing))
+        with concurrent_futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            tasks = [loop.run_in_executor(executor, self._shorten_one, link) for link in missing]
+            results = await asyncio.gather(*tasks)
+        shortened = {link: short for link, short in results if short}
+        self.cache.update(shortened)
+        return shortened
+
+    def shorten(self, links, save=True):
+        """
+        Blocking version of `shorten_async` running on its own event loop.
+
+        :param links: iterable of links
+        :param save: persist the cache right away, worker processes leave it to the main process
+        :returns: dict of newly shortened links
+        """
+        if not self.enabled:
+            return {}
+        loop = asyncio.new_event_loop()
+        try:
+            shortened = loop.run_until_complete(self.shorten_async(links, loop))
+        finally:
+            loop.close()
+        if save:
+            self.cache.save()
+        return shortened
 
 
-def shortener(config):
-    return NullShortener(config)
+def link_shortener(root_path, source_path, url=None):
+    cache = LinkCache(os.path.join(root_path, source_path, const.LINKS_CACHE_FILENAME))
+    return LinkShortener(shortener(url), cache)
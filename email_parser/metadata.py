@@ -0,0 +1,128 @@
+"""
+Persistent index of emails' metadata: template, styles, email type, placeholders' types and variants.
+
+Queries which need only this information are served from the index. Source files are parsed again only when their
+mtime differs from the one the entry was built from. The index is kept in memory and written to a cache directory, out
+of the source tree, after listing emails and when the parser is closed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from . import fs, reader, const
+from .model import *
+
+logger = logging.getLogger(__name__)
+
+# malformed emails are indexed too so they aren't parsed again until they change, placeholders are None for them
+_MALFORMED = (None, None, [], None, [])
+
+
+def _key(email_name, locale):
+    return '%s/%s' % (locale, email_name)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (FileNotFoundError, TypeError):
+        return None
+
+
+class MetadataIndex(object):
+    def __init__(self, root_path, conf=None, cache_dir=None):
+        """
+        :param cache_dir: optional directory the index is persisted in, without it the index lives in memory only
+        """
+        self.root_path = root_path
+        self.conf = conf
+        self.cache_dir = cache_dir
+        self.path = None
+        if cache_dir:
+            digest = hashlib.sha1(os.path.realpath(root_path).encode('utf-8')).hexdigest()[:16]
+            self.path = os.path.join(cache_dir, const.METADATA_INDEX_FILENAME % digest)
+        self._entries = None
+        self._dirty = False
+        # I/O threads of AsyncParser share the index
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        # the index is loaded again from disk by worker processes
+        return {'root_path': self.root_path, 'conf': self.conf, 'cache_dir': self.cache_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['root_path'], state['conf'], state['cache_dir'])
+
+    @property
+    def entries(self):
+        if self._entries is None and self.path is None:
+            self._entries = {}
+        elif self._entries is None:
+            try:
+                self._entries = {key: EmailMetadata(**entry)
+                                 for key, entry in json.loads(fs.read_file(self.path)).items()}
+            except FileNotFoundError:
+                self._entries = {}
+            except (ValueError, TypeError):
+                logger.warning('metadata index %s is corrupted, building a new one', self.path)
+                self._entries = {}
+        return self._entries
+
+    def _entry(self, email):
+        key = _key(email.name, email.locale)
+        mtime = _mtime(email.path)
+        entry = self.entries.get(key)
+        if mtime is None:
+            if entry:
+                del self.entries[key]
+                self._dirty = True
+            return None
+        if entry is None or entry.mtime != mtime:
+            metadata = reader.read_metadata(email.path) or _MALFORMED
+            entry = EmailMetadata(email.name, email.locale, mtime, *metadata)
+            self.entries[key] = entry
+            self._dirty = True
+        return entry if entry.placeholders is not None else None
+
+    def get(self, email):
+        """
+        :param email: Email tuple
+        :returns: EmailMetadata or None if the email doesn't exist or is malformed
+        """
+        if not email:
+            return None
+        with self._lock:
+            return self._entry(email)
+
+    def refresh(self, locale=None):
+        """
+        Brings the index up to date in one pass over the source directory.
+
+        :param locale: optionally limits the pass to one locale
+        :returns: list of EmailMetadata sorted by locale and name
+        """
+        emails = list(fs.emails(self.root_path, locale=locale, conf=self.conf))
+        existing = set(_key(email.name, email.locale) for email in emails)
+        with self._lock:
+            for key, entry in list(self.entries.items()):
+                if (locale is None or entry.locale == locale) and key not in existing:
+                    del self.entries[key]
+                    self._dirty = True
+            results = [self._entry(email) for email in emails]
+            self.save()
+        return sorted((entry for entry in results if entry), key=lambda entry: (entry.locale, entry.name))
+
+    def save(self):
+        """
+        Writes the index if it changed since it was read.
+        """
+        with self._lock:
+            if not self._dirty or self.path is None:
+                return
+            entries = {key: entry._asdict() for key, entry in self.entries.items()}
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fs.save_file_atomic(json.dumps(entries, sort_keys=True, indent=const.JSON_INDENT), self.path)
+            self._dirty = False
@@ -0,0 +1,43 @@
+"""
+Minification of rendered html which is safe for email clients.
+
+Comments are dropped except conditional comments read by Outlook. Whitespace in text and between tags is collapsed to
+a single space, or to a single new line if it had one so lines stay as short as email transports require. Tags and
+contents of pre, textarea, script and style elements are left as they are.
+"""
+
+import re
+
+_TOKENS = re.compile(r'<!--.*?-->|<(pre|textarea|script|style)\b.*?</\1\s*>|<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>',
+                     re.DOTALL | re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _is_conditional_comment(comment):
+    body = comment[4:-3].strip()
+    return body.startswith('[if') or body.startswith('<![endif]') or body.endswith('<![endif]')
+
+
+def _collapse(text):
+    return _WHITESPACE.sub(lambda match: '\n' if '\n' in match.group(0) else ' ', text)
+
+
+def minify_html(html):
+    """
+    :param html: rendered html
+    :returns: minified html
+    """
+    parts, text, position = [], [], 0
+    for match in _TOKENS.finditer(html):
+        text.append(html[position:match.start()])
+        position = match.end()
+        token = match.group(0)
+        if token.startswith('<!--') and not _is_conditional_comment(token):
+            # text around a dropped comment is collapsed as one
+            continue
+        parts.append(_collapse(''.join(text)))
+        parts.append(token)
+        text = []
+    text.append(html[position:])
+    parts.append(_collapse(''.join(text)))
+    return ''.join(parts).strip()
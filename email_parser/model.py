@@ -1,4 +1,4 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from enum import Enum
 import string
 import json
@@ -17,21 +17,43 @@ class EmailType(Enum):
     transactional = 'transactional'
 
 
+class ResultStatus(Enum):
+    ok = 'ok'
+    warning = 'warning'
+    error = 'error'
+
+
 Email = namedtuple('Email', ['name', 'locale', 'path'])
 Template = namedtuple('Template', ['name', 'styles_names', 'styles', 'content', 'placeholders', 'type'])
+EmailMetadata = namedtuple('EmailMetadata', ['name', 'locale', 'mtime', 'template', 'email_type', 'styles_names',
+                                             'placeholders', 'variants'])
+PlaceholdersValidation = namedtuple('PlaceholdersValidation',
+                                    ['name', 'locale', 'missing', 'extra', 'diff_number', 'error'])
+CompiledEmail = namedtuple('CompiledEmail', ['template', 'email_type', 'styles_names', 'placeholders'])
+ParseFailure = namedtuple('ParseFailure', ['path', 'message', 'segment_id'])
+EmailResult = namedtuple('EmailResult',
+                         ['name', 'locale', 'status', 'error_type', 'message', 'segment_id', 'duration'])
+OutputOptions = namedtuple('OutputOptions', ['variants', 'minify', 'compress'])
 
 
 class MetaPlaceholder:
+    __slots__ = ('name', 'type', 'attributes')
+
     def __init__(self, name, my_type=PlaceholderType.text, attributes=None):
         self.name = name
         self.type = my_type
         self.attributes = attributes
 
     def __getstate__(self):
-        state = dict(self.__dict__)
+        state = {k: getattr(self, k) for k in self.__slots__}
         state['type'] = state['type'].value
         return state
 
+    def __setstate__(self, state):
+        self.name = state['name']
+        self.type = PlaceholderType(state['type'])
+        self.attributes = state['attributes']
+
     def __eq__(self, other):
         try:
             my_state = self.__getstate__()
@@ -42,6 +64,10 @@ class MetaPlaceholder:
 
 
 class Placeholder:
+    __slots__ = ('name', 'is_global', 'type', '_content', 'variants', '_opt_attr')
+    # attributes in the order they are serialized
+    _fields = __slots__
+
     def __init__(self, name, content, is_global=False, p_type=PlaceholderType.text, variants=None, opt_attr=None):
         self.name = name
         self.is_global = is_global
@@ -51,15 +77,15 @@ class Placeholder:
         self._opt_attr = opt_attr
 
     def __iter__(self):
-        attributes = dict(self.__dict__)
+        attributes = OrderedDict((k, getattr(self, k)) for k in self._fields)
         if self._opt_attr:
             attributes.update(self._opt_attr)
         for k, v in attributes.items():
-            if k is 'type':
+            if k == 'type':
                 yield k, self.type.value
-            elif k is '_content':
+            elif k == '_content':
                 yield 'content', v
-            elif k is '_opt_attr':
+            elif k == '_opt_attr':
                 continue
             else:
                 yield k, v
@@ -88,6 +114,9 @@ class ModelJsonEncoder(json.JSONEncoder):
 
 
 class BitmapPlaceholder(Placeholder):
+    __slots__ = ('id', 'src', 'alt')
+    _fields = ('name', 'id', 'src', 'alt', 'is_global', 'type', 'variants', '_opt_attr')
+
     def __init__(self, name, bitmap_id, src, alt=None, is_global=False, variants=None, **opt_attr):
         self.name = name
         self.id = bitmap_id
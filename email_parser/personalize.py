@@ -0,0 +1,131 @@
+"""
+Send-time personalization of rendered emails.
+
+Rendered emails still contain runtime placeholders like `{{unsubscribe_link}}`, the same ones placeholders validation
+counts. Contents are split at them once and every recipient's email is joined from the literal segments and the
+recipient's values in a single pass, instead of replacing every placeholder in the whole html for every recipient.
+"""
+
+import re
+
+from . import const
+
+_RUNTIME_PLACEHOLDER = re.compile(const.RUNTIME_PLACEHOLDER_REGEX)
+
+
+class PersonalizationError(KeyError):
+    def __init__(self, missing):
+        super().__init__('no values for runtime placeholders %s' % ', '.join(sorted(missing)))
+        self.missing = missing
+
+
+def tokens(content):
+    """
+    :param content: rendered str
+    :returns: list of (start, end, name) of runtime placeholders in the content
+    """
+    return [(match.start(), match.end(), match.group(1)) for match in _RUNTIME_PLACEHOLDER.finditer(content)]
+
+
+def encoded_tokens(content):
+    """
+    :returns: tuple of the utf-8 content and list of (start, end, name) of its runtime placeholders in bytes
+    """
+    encoded, spans, position, offset = [], [], 0, 0
+    for start, end, name in tokens(content):
+        literal = content[position:start].encode('utf-8')
+        token = content[start:end].encode('utf-8')
+        encoded.extend((literal, token))
+        offset += len(literal)
+        spans.append((offset, offset + len(token), name))
+        offset += len(token)
+        position = end
+    encoded.append(content[position:].encode('utf-8'))
+    return b''.join(encoded), spans
+
+
+class Segments(object):
+    """
+    Content split at runtime placeholders, str or bytes.
+    """
+
+    __slots__ = ('literals', 'names', 'tokens', '_empty')
+
+    def __init__(self, content, spans=None):
+        """
+        :param content: str, bytes or memoryview
+        :param spans: optional list of (start, end, name) of runtime placeholders, found in str content without them
+        """
+        spans = tokens(content) if spans is None else spans
+        literals, names, originals, position = [], [], {}, 0
+        for start, end, name in spans:
+            literals.append(content[position:start])
+            names.append(name)
+            originals[name] = content[start:end]
+            position = end
+        literals.append(content[position:])
+        self.literals = literals
+        self.names = names
+        # placeholders without values are left as they are
+        self.tokens = originals
+        self._empty = '' if isinstance(content, str) else b''
+
+    def render(self, values):
+        """
+        :param values: dict of values by placeholder name, of the type of the content
+        """
+        literals = self.literals
+        parts = [literals[0]]
+        for index, name in enumerate(self.names, 1):
+            parts.append(values[name])
+            parts.append(literals[index])
+        return self._empty.join(parts)
+
+
+class PrebuiltEmail(object):
+    """
+    Subject, text and html of a rendered email personalized for many recipients.
+
+    Values are str, emails are returned as str for str contents and as utf-8 bytes for bytes contents, e.g. slices of
+    a bundle.
+    """
+
+    def __init__(self, subject, text, html, spans=None):
+        """
+        :param spans: optional tuple of lists of (start, end, name) of runtime placeholders of the subject, text and
+                      html, e.g. recorded in a bundle. Str contents are searched without them
+        """
+        spans = spans or (None, None, None)
+        self.parts = tuple(Segments(content, part_spans) for content, part_spans in zip((subject, text, html), spans))
+        self.binary = not isinstance(subject, str)
+        self.names = frozenset(name for part in self.parts for name in part.names)
+
+    def _values(self, values, strict):
+        missing = self.names.difference(values)
+        if missing and strict:
+            raise PersonalizationError(missing)
+        values = {name: str(values[name]) for name in self.names if name not in missing}
+        if self.binary:
+            values = {name: value.encode('utf-8') for name, value in values.items()}
+        for name in missing:
+            values[name] = next(part.tokens[name] for part in self.parts if name in part.tokens)
+        return values
+
+    def render(self, values, strict=False):
+        """
+        :param values: dict of values of runtime placeholders, converted to str
+        :param strict: raise PersonalizationError for placeholders without values instead of leaving them
+        :returns: tuple of subject, text and html
+        """
+        values = self._values(values, strict)
+        return tuple(part.render(values) for part in self.parts)
+
+    def render_many(self, recipients, strict=False):
+        """
+        :param recipients: iterable of dicts of values
+        :returns: generator of tuples of subject, text and html in the order of recipients
+        """
+        subject, text, html = self.parts
+        for values in recipients:
+            values = self._values(values, strict)
+            yield subject.render(values), text.render(values), html.render(values)
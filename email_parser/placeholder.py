@@ -1,33 +1,44 @@
 from collections import Counter
-from functools import lru_cache
+import os
 import re
 import json
 import logging
 
-from . import reader, fs, const
+from . import reader, fs, const, config, utils, cache as caches
+from .model import *
 
 logger = logging.getLogger(__name__)
 
 
 def _extract_placeholders(text):
-    return Counter(m.group(1) for m in re.finditer(r'\{\{(\w+)\}\}', text))
+    return Counter(m.group(1) for m in re.finditer(const.RUNTIME_PLACEHOLDER_REGEX, text))
 
 
-@lru_cache(maxsize=None)
-def expected_placeholders_file(root_path):
-    content = fs.read_file(root_path, const.REPO_SRC_PATH, const.PLACEHOLDERS_FILENAME)
-    return json.loads(content)
+def _read_placeholders_file(path):
+    return json.loads(fs.read_file(path))
 
 
-def _email_placeholders(root_path, email):
-    _, contents = reader.read(root_path, email)
+def expected_placeholders_file(root_path, cache=None):
+    """
+    :param cache: optional CacheManager, the file is read again only after it changes
+    """
+    path = os.path.join(root_path, const.REPO_SRC_PATH, const.PLACEHOLDERS_FILENAME)
+    if cache is None:
+        return _read_placeholders_file(path)
+    return cache.config.get(const.PLACEHOLDERS_FILENAME, [path], lambda: _read_placeholders_file(path))
+
+
+def _contents_placeholders(contents):
     content = ''.join(map(lambda c: c.get_content(), contents.values()))
     return _extract_placeholders(content)
 
 
-def get_email_validation(root_path, email):
-    email_placeholders = _email_placeholders(root_path, email)
-    expected_placeholders = expected_placeholders_file(root_path).get(email.name, {})
+def _email_placeholders(root_path, email, cache=None, conf=None):
+    _, contents = reader.read(root_path, email, cache=cache, conf=conf)
+    return _contents_placeholders(contents)
+
+
+def _compare(email_placeholders, expected_placeholders):
     missing_placeholders = set(expected_placeholders) - set(email_placeholders)
     extra_placeholders = set(email_placeholders) - set(expected_placeholders)
     diff_number = []
@@ -35,6 +46,13 @@ def get_email_validation(root_path, email):
         email_count = email_placeholders.get(expected_name)
         if email_count and expected_count != email_count:
             diff_number.append({'placeholder': expected_name, 'expected_count': expected_count, 'count': email_count})
+    return missing_placeholders, extra_placeholders, diff_number
+
+
+def get_email_validation(root_path, email, cache=None, conf=None):
+    email_placeholders = _email_placeholders(root_path, email, cache, conf)
+    expected_placeholders = expected_placeholders_file(root_path, cache).get(email.name, {})
+    missing_placeholders, extra_placeholders, diff_number = _compare(email_placeholders, expected_placeholders)
 
     valid = not missing_placeholders and not extra_placeholders and not diff_number
     if not valid:
@@ -49,7 +67,131 @@ def get_email_validation(root_path, email):
     return {'valid': valid, 'errors': errors}
 
 
-def generate_config(root_path):
-    emails = fs.emails(root_path, locale=const.DEFAULT_LOCALE)
-    placeholders = {email.name: _email_placeholders(root_path, email) for email in emails}
+def validate_email(root_path, email, expected_placeholders, cache=None, conf=None):
+    """
+    Unlike rendering, an email which can't be parsed is reported instead of falling back to the default locale.
+
+    :param expected_placeholders: dict of placeholder name to expected count
+    :returns: PlaceholdersValidation
+    """
+    failures = []
+    try:
+        _, contents = reader.read(root_path, email, failures, cache, conf)
+        if failures:
+            raise ValueError(failures[0].message)
+        email_placeholders = _contents_placeholders(contents)
+    except Exception as ex:
+        return PlaceholdersValidation(email.name, email.locale, [], [], [], '%s: %s' % (type(ex).__name__, ex))
+    missing, extra, diff_number = _compare(email_placeholders, expected_placeholders)
+    diff_number.sort(key=lambda diff: diff['placeholder'])
+    return PlaceholdersValidation(email.name, email.locale, sorted(missing), sorted(extra), diff_number, None)
+
+
+def _validate_batch(emails, root_path, placeholders_config, conf=None):
+    # emails in a batch share one locale mostly so globals and templates are parsed once per batch
+    cache = caches.CacheManager()
+    return [validate_email(root_path, email, placeholders_config.get(email.name, {}), cache, conf) for email in emails]
+
+
+def validation_report(results):
+    """
+    :param results: collection of PlaceholdersValidation
+    :returns: dict with the number of validated and invalid emails and results of invalid ones
+    """
+    invalid = [r for r in results if r.error or r.missing or r.extra or r.diff_number]
+    return {
+        'emails': len(results),
+        'invalid': len(invalid),
+        'results': [r._asdict() for r in invalid]
+    }
+
+
+def validate_emails(root_path, emails=None, cache=None, batch_size=const.VALIDATION_BATCH,
+                    max_workers=const.DEFAULT_WORKER_POOL, conf=None):
+    """
+    Validates placeholders of many emails against the placeholders config. Emails are split into batches validated
+    by a pool of processes, a single batch is validated in the current process.
+
+    :param emails: collection of emails, all emails in all locales by default
+    :param cache: optional CacheManager used when validating in the current process
+    :param conf: optional Config, module defaults are used without it
+    :returns: report, see `validation_report`
+    """
+    conf = config.resolve(conf)
+    emails = fs.emails(root_path, conf=conf) if emails is None else emails
+    emails = sorted(emails, key=lambda email: (email.locale, email.name))
+    placeholders_config = expected_placeholders_file(root_path, cache)
+    if len(emails) > batch_size:
+        results = utils.map_batches(_validate_batch, emails, batch_size, max_workers, root_path, placeholders_config,
+                                    conf)
+    else:
+        cache = cache or caches.CacheManager()
+        results = [validate_email(root_path, email, placeholders_config.get(email.name, {}), cache, conf)
+                   for email in emails]
+    return validation_report(results)
+
+
+def generate_config(root_path, cache=None, conf=None):
+    emails = fs.emails(root_path, locale=const.DEFAULT_LOCALE, conf=conf)
+    placeholders = {email.name: _email_placeholders(root_path, email, cache, conf) for email in emails}
     return placeholders
+
+
+class PlaceholdersConfig(object):
+    """
+    Keeps placeholders_config.json up to date email by email.
+
+    Only emails in the default locale are counted. Changes are collected until `flush` so a burst of saves is read
+    and written once, the file isn't written at all if counts didn't change.
+    """
+
+    def __init__(self, root_path, cache=None, conf=None):
+        self.root_path = root_path
+        self.cache = cache
+        self.conf = conf
+        self.path = os.path.join(root_path, const.REPO_SRC_PATH, const.PLACEHOLDERS_FILENAME)
+        self._pending = {}
+
+    def update(self, email):
+        """
+        :param email: saved Email, emails in other than default locale are ignored
+        """
+        if email.locale == const.DEFAULT_LOCALE:
+            self._pending[email.name] = email
+
+    def remove(self, email_name):
+        self._pending[email_name] = None
+
+    def save(self, placeholders_config):
+        fs.save_file_atomic(json.dumps(placeholders_config, sort_keys=True, indent=const.JSON_INDENT), self.path)
+        if self.cache is not None:
+            self.cache.config.invalidate(self.path)
+
+    def flush(self):
+        """
+        Writes pending changes.
+
+        :returns: True if the file was written
+        """
+        if not self._pending:
+            return False
+        pending, self._pending = self._pending, {}
+        try:
+            placeholders_config = dict(expected_placeholders_file(self.root_path, self.cache))
+        except FileNotFoundError:
+            placeholders_config = generate_config(self.root_path, self.cache, self.conf)
+            self.save(placeholders_config)
+            return True
+        changed = False
+        for email_name, email in pending.items():
+            if email is None:
+                changed = placeholders_config.pop(email_name, None) is not None or changed
+                continue
+            email_placeholders = _email_placeholders(self.root_path, email, self.cache, self.conf)
+            if placeholders_config.get(email_name) != email_placeholders:
+                placeholders_config[email_name] = email_placeholders
+                changed = True
+        if changed:
+            logger.debug('updating %s for %s', self.path, sorted(pending))
+            self.save(placeholders_config)
+        return changed
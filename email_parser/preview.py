@@ -0,0 +1,47 @@
+"""
+Memoized rendering of email content for editor previews.
+
+The editor sends the whole email XML on every change. A session keeps the parsed content of
+the last previews by its hash. Templates, styles, globals and rendered placeholders come from the Parser's cache, so
+only placeholders which changed since the last call are rendered again.
+"""
+
+import hashlib
+
+from . import reader, renderer, config, cache as caches
+from .model import *
+
+
+class PreviewSession(object):
+    parsed_limit = 8
+
+    def __init__(self, root_path, cache=None, conf=None):
+        """
+        :param cache: CacheManager shared with the Parser for templates, styles, globals and rendered fragments
+        :param conf: Config of the Parser, module defaults are used without it
+        """
+        self.root_path = root_path
+        self.cache = cache or caches.CacheManager()
+        self.conf = config.resolve(conf)
+        self._parsed = caches.LruDict(self.parsed_limit)
+
+    def read(self, content, locale):
+        """
+        :returns: tuple of email template, a collection of placeholders or (None, None) if content is malformed
+        """
+        digest = hashlib.sha1(content.encode('utf-8') if isinstance(content, str) else content).hexdigest()
+        email_xml = self._parsed.get(digest)
+        if email_xml is None:
+            email_xml = reader._read_xml_from_content(content)
+            if email_xml is None:
+                return None, None
+            self._parsed[digest] = email_xml
+        template = reader.get_template(self.root_path, *reader.template_attributes(email_xml), cache=self.cache,
+                                       conf=self.conf)
+        global_placeholders = reader.get_global_placeholders(self.root_path, locale, cache=self.cache, conf=self.conf)
+        return template, reader.merge_placeholders(template, global_placeholders, email_xml)
+
+    def render(self, content, locale, variant=None, highlight=None):
+        template, placeholders = self.read(content, locale)
+        return renderer.render(locale, template, placeholders, variant=variant, highlight=highlight,
+                               fragments=self.cache.fragments, conf=self.conf)
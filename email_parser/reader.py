@@ -2,17 +2,24 @@
 Extracts email information from an email file.
 """
 
+import hashlib
 import logging
+import os
 import re
+import threading
 from collections import OrderedDict
 
-from lxml import etree
-
-from . import fs, const, config
+from . import fs, const, config, utils, cache as caches
 from .model import *
 
+etree = utils.lazy_import('lxml.etree')
+
 logger = logging.getLogger(__name__)
 
+_parsers = threading.local()
+# templates shared by readers without a Parser's cache, see get_template
+_shared_templates = caches.FileCache(const.CACHE_LIMITS['templates'])
+
 
 def parse_placeholder(placeholder_str):
     args = {}
@@ -79,7 +86,7 @@ def _placeholders(tree, prefix=''):
     return result
 
 
-def get_template_parts(root_path, template_filename, template_type):
+def get_template_parts(root_path, template_filename, template_type, conf=None):
     content = None
     placeholders = OrderedDict()
 
@@ -89,13 +96,13 @@ def get_template_parts(root_path, template_filename, template_type):
         template_type = None
 
     if template_type:
-        template_path = str(fs.get_template_filepath(root_path, template_filename, template_type.value))
+        template_path = str(fs.get_template_filepath(root_path, template_filename, template_type.value, conf))
         content = fs.read_file(template_path)
     else:
         logger.warning('FIXME: no email_type set for: %s, trying all types..', template_filename)
         for email_type in EmailType:
             try:
-                template_path = str(fs.get_template_filepath(root_path, template_filename, email_type.value))
+                template_path = str(fs.get_template_filepath(root_path, template_filename, email_type.value, conf))
                 content = fs.read_file(template_path)
                 break
             except FileNotFoundError:
@@ -116,92 +123,202 @@ def get_template_parts(root_path, template_filename, template_type):
     return content, placeholders
 
 
-def get_inline_style(root_path, styles_names):
-    if not len(styles_names):
-        return ''
-    css = [fs.read_file(root_path, config.paths.templates, f) or ' ' for f in styles_names]
+def _inline_style(root_path, styles_names, conf=None):
+    css = [fs.read_file(root_path, config.resolve(conf).paths.templates, f) or ' ' for f in styles_names]
     styles = '\n'.join(css)
     return '<style>%s</style>' % styles
 
 
-def _template(root_path, tree):
-    styles = ''
-    styles_names = []
+def get_inline_style(root_path, styles_names, cache=None, conf=None):
+    """
+    :param cache: optional CacheManager
+    :param conf: optional Config, module defaults are used without it
+    """
+    if not len(styles_names):
+        return ''
+    if cache is None:
+        return _inline_style(root_path, styles_names, conf)
+    paths = [os.path.join(root_path, config.resolve(conf).paths.templates, f) for f in styles_names]
+    return cache.styles.get(tuple(styles_names), paths, lambda: _inline_style(root_path, styles_names, conf))
 
-    template_filename = tree.getroot().get('template')
-    email_type = tree.getroot().get('email_type')
-    content, placeholders = get_template_parts(root_path, template_filename, email_type)
-    style_element = tree.getroot().get('style')
 
-    if style_element:
-        styles_names = style_element.split(',')
-        styles = get_inline_style(root_path, styles_names)
+def template_attributes(tree):
+    """
+    :returns: tuple of template filename, email type and list of styles names defined in email's root element
+    """
+    root = tree.getroot()
+    style_element = root.get('style')
+    styles_names = style_element.split(',') if style_element else []
+    return root.get('template'), root.get('email_type'), styles_names
 
-    # TODO either read all or leave just names for content and styles
-    return Template(template_filename, styles_names, styles, content, placeholders, email_type)
 
+def read_template_attributes(path):
+    """
+    Reads template attributes of an email's root element. The whole file is parsed, without logging errors, because
+    malformed emails are rendered from the default locale and depend on its files instead.
+
+    :returns: tuple of template filename, email type and list of styles names or None if the file is malformed
+    """
+    attributes = None
+    try:
+        for _, element in etree.iterparse(path, events=('start',)):
+            if attributes is None:
+                attributes = template_attributes(element.getroottree())
+    except (etree.ParseError, OSError):
+        return None
+    return attributes
 
-def _handle_xml_parse_error(file_path, exception):
+
+def read_metadata(path):
+    """
+    Reads everything about an email which doesn't need its template: root attributes, placeholders and variants.
+
+    :returns: tuple of template filename, email type, list of styles names, OrderedDict of placeholders' types
+              by name and sorted list of variants or None if the file is malformed
+    """
+    email_xml = _read_xml(path)
+    if email_xml is None:
+        return None
+    template_filename, email_type, styles_names = template_attributes(email_xml)
+    placeholders = OrderedDict()
+    variants = set()
+    for element in email_xml.xpath('./string | ./string-array | bitmap | ./array'):
+        placeholders[element.get('name')] = element.get('type', PlaceholderType.text.value)
+        variants.update(item.get('variant') for item in element.findall('./item[@variant]'))
+    return template_filename, email_type, styles_names, placeholders, sorted(variants)
+
+
+def template_paths(root_path, template_filename, email_type, styles_names, conf=None):
+    """
+    :returns: list of paths the template is read from, all types are searched for a template without email type
+    """
+    conf = config.resolve(conf)
+    types = [email_type] if email_type else [t.value for t in EmailType]
+    paths = [fs.get_template_filepath(root_path, template_filename, t, conf) for t in types]
+    paths.extend(os.path.join(root_path, conf.paths.templates, f) for f in styles_names)
+    return paths
+
+
+def get_template(root_path, template_filename, email_type, styles_names, cache=None, conf=None):
+    """
+    Emails using the same template file, type and styles share one Template instance until one of its files changes,
+    its content, styles and placeholders must not be modified.
+
+    :param cache: optional CacheManager, templates are shared within the module without it
+    :param conf: optional Config, module defaults are used without it
+    """
+    conf = config.resolve(conf)
+
+    def build():
+        content, placeholders = get_template_parts(root_path, template_filename, email_type, conf)
+        styles = get_inline_style(root_path, styles_names, cache, conf)
+        # TODO either read all or leave just names for content and styles
+        return Template(template_filename, styles_names, styles, content, placeholders, email_type)
+
+    key = (root_path, conf.paths.templates, template_filename, email_type, tuple(styles_names))
+    paths = template_paths(root_path, template_filename, email_type, styles_names, conf) if template_filename else ()
+    templates = cache.templates if cache is not None else _shared_templates
+    return templates.get(key, paths, build)
+
+
+def _template(root_path, tree, cache=None, conf=None):
+    return get_template(root_path, *template_attributes(tree), cache=cache, conf=conf)
+
+
+def _handle_xml_parse_error(file_path, exception, content):
+    """
+    Logs a readable parse error and returns the name of the segment the error happened in.
+
+    :param file_path: path of the parsed file, used for reporting
+    :param exception: lxml parse error
+    :param content: source that failed to parse as str or bytes
+    :returns: segment id or None if it cannot be determined
+    """
     pos = exception.position
-    with open(file_path) as f:
-        lines = f.read().splitlines()
-        error_line = lines[pos[0] - 1]
-        node_matches = re.findall(const.SEGMENT_REGEX, error_line[:pos[1]])
-        segment_id = None
-
-        if not len(node_matches):
-            prev_line = pos[0] - 1
-            search_part = ''.join(lines[:prev_line])
-            node_matches = re.findall(const.SEGMENT_REGEX, search_part)
-
-        if len(node_matches):
-            name_matches = re.findall(const.SEGMENT_NAME_REGEX, node_matches[-1])
-            if len(name_matches):
-                segment_id = name_matches[-1]
+    if not isinstance(content, str):
+        content = content.decode('utf-8', 'replace')
+    lines = content.splitlines()
+    error_line = lines[pos[0] - 1] if 0 < pos[0] <= len(lines) else ''
+    node_matches = re.findall(const.SEGMENT_REGEX, error_line[:pos[1]])
+    segment_id = None
+
+    if not len(node_matches):
+        prev_line = pos[0] - 1
+        search_part = ''.join(lines[:prev_line])
+        node_matches = re.findall(const.SEGMENT_REGEX, search_part)
+
+    if len(node_matches):
+        name_matches = re.findall(const.SEGMENT_NAME_REGEX, node_matches[-1])
+        if len(name_matches):
+            segment_id = name_matches[-1]
     logger.exception('Unable to read content from %s\n%s\nSegment ID: %s\n_______________\n%s\n%s\n', file_path,
                      exception, segment_id, error_line.replace('\t', '  '), " " * exception.position[1] + "^")
+    return segment_id
 
 
-def _read_xml(path):
-    if not path:
-        return None
-    try:
+def _xml_parser():
+    """
+    lxml parsers are expensive to create but can't be shared between threads, every thread reuses its own.
+    """
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
         parser = etree.XMLParser(encoding='utf-8')
-        return etree.parse(path, parser=parser)
-    except etree.ParseError as e:
-        _handle_xml_parse_error(path, e)
+        _parsers.parser = parser
+    return parser
+
+
+def _parse_xml(content):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return etree.ElementTree(etree.fromstring(content, parser=_xml_parser()))
+
+
+def _read_xml(path, errors=None, trees=None):
+    """
+    :param trees: optional FileCache of parsed files
+    """
+    if not path:
         return None
+    if trees is not None:
+        return trees.get(path, [path], lambda: _read_xml_from_content(fs.read_bytes(path), path, errors))
+    return _read_xml_from_content(fs.read_bytes(path), path, errors)
 
 
-def _read_xml_from_content(content):
+def _read_xml_from_content(content, path=None, errors=None):
+    """
+    :param content: XML as str or bytes
+    :param path: path the content was read from, used for error reporting
+    :param errors: optional list collecting ParseFailure
+    :returns: ElementTree or None if the content is empty or malformed
+    """
     if not content:
         return None
     try:
-        parser = etree.XMLParser(encoding='utf-8')
-        root = etree.fromstring(content.encode('utf-8'), parser=parser)
-        return etree.ElementTree(root)
+        return _parse_xml(content)
     except etree.ParseError as e:
-        logger.exception('Unable to parse XML content %s %s', content, e)
+        segment_id = _handle_xml_parse_error(path or '<content>', e, content)
+        if errors is not None:
+            errors.append(ParseFailure(path, str(e), segment_id))
         return None
     except TypeError:
         # got None? no results
         return None
 
 
-def _sort_from_template(root_path, template_filename, template_type, placeholders):
-    _, placeholders_ordered = get_template_parts(root_path, template_filename, template_type)
+def _sort_from_template(root_path, template_filename, template_type, placeholders, conf=None):
+    _, placeholders_ordered = get_template_parts(root_path, template_filename, template_type, conf)
     ordered_placeholders_names = list(placeholders_ordered.keys())
     placeholders.sort(
         key=lambda item: ordered_placeholders_names.index(item.name) if item.name in ordered_placeholders_names else 99)
 
 
-def create_email_content(root_path, template_name, styles, placeholders, email_type):
+def create_email_content(root_path, template_name, styles, placeholders, email_type, conf=None):
     root = etree.Element('resources')
     root.set('template', template_name)
     root.set('style', ','.join(styles))
     if email_type:
         root.set('email_type', email_type.value)
-    _sort_from_template(root_path, template_name, email_type, placeholders)
+    _sort_from_template(root_path, template_name, email_type, placeholders, conf)
     for placeholder in placeholders:
         if placeholder.variants:
             new_content_tag = etree.SubElement(root, 'string-array', {
@@ -237,8 +354,8 @@ def create_email_content(root_path, template_name, styles, placeholders, email_t
     return xml_as_str.decode('utf-8')
 
 
-def get_global_placeholders(root_path, locale):
-    globals_xml = _read_xml(fs.global_email(root_path, locale).path)
+def get_global_placeholders(root_path, locale, errors=None, cache=None, conf=None):
+    globals_xml = _read_xml(fs.global_email(root_path, locale, conf).path, errors, cache.globals if cache else None)
     return _placeholders(globals_xml, const.GLOBALS_PLACEHOLDER_PREFIX)
 
 
@@ -252,42 +369,119 @@ def get_inferred_placeholders(meta_placeholders, placeholders):
     return inferred_placeholders
 
 
-def read_from_content(root_path, email_content, locale):
-    email_xml = _read_xml_from_content(email_content)
-    if not email_xml:
+def compile_email(tree):
+    """
+    :returns: CompiledEmail with everything read from a parsed email source
+    """
+    template_filename, email_type, styles_names = template_attributes(tree)
+    return CompiledEmail(template_filename, email_type, styles_names, _placeholders(tree))
+
+
+def _read_compiled(path, errors=None, cache=None):
+    """
+    Reads a compiled email from the cache's SourceCache by the hash of its source, the source is parsed and compiled
+    only if it changed. Without a SourceCache parsed trees are cached in memory.
+
+    :returns: CompiledEmail or None if the source is empty or malformed
+    """
+    sources = cache.sources if cache is not None else None
+    if sources is None:
+        email_xml = _read_xml(path, errors, cache.emails if cache is not None else None)
+        return compile_email(email_xml) if email_xml is not None else None
+    content = fs.read_bytes(path)
+    digest = hashlib.sha256(content).hexdigest()
+    compiled = sources.get(digest)
+    if compiled is None:
+        email_xml = _read_xml_from_content(content, path, errors)
+        if email_xml is None:
+            return None
+        compiled = compile_email(email_xml)
+        sources.set(digest, compiled)
+    return compiled
+
+
+def _compile_batch(paths, sources_path):
+    cache = caches.CacheManager(sources_path=sources_path)
+    return [path for path in paths if _read_compiled(path, cache=cache) is None]
+
+
+def compile_sources(paths, sources_path, batch_size=const.VALIDATION_BATCH, max_workers=const.DEFAULT_WORKER_POOL):
+    """
+    Compiles email sources into a SourceCache directory ahead of reading them, unchanged sources are skipped.
+
+    :param paths: paths of email sources
+    :param sources_path: SourceCache directory
+    :returns: list of paths of empty or malformed sources
+    """
+    paths = list(paths)
+    if len(paths) > batch_size:
+        return utils.map_batches(_compile_batch, paths, batch_size, max_workers, sources_path)
+    return _compile_batch(paths, sources_path)
+
+
+def _read_email(root_path, compiled, locale, errors=None, cache=None, conf=None):
+    if not compiled:
         return None, None
-    template = _template(root_path, email_xml)
+    template = get_template(root_path, compiled.template, compiled.email_type, compiled.styles_names, cache, conf)
     if not template.name:
         logger.error('no HTML template name defined for given content')
-    global_placeholders = get_global_placeholders(root_path, locale)
+    global_placeholders = get_global_placeholders(root_path, locale, errors, cache, conf)
+    return template, _merge_placeholders(template, global_placeholders, compiled.placeholders)
+
+
+def read_from_content(root_path, email_content, locale, path=None, errors=None, cache=None, conf=None):
+    """
+    Reads an email from its XML content.
+
+    :param root_path: root path of repository
+    :param email_content: email XML as str or bytes
+    :param locale: locale used to pick global placeholders
+    :param path: path the content was read from, used for error reporting
+    :param errors: optional list collecting ParseFailure for malformed XML
+    :param cache: optional CacheManager for templates, styles and globals
+    :param conf: optional Config, module defaults are used without it
+    :returns: tuple of email template, a collection of placeholders
+    """
+    email_xml = _read_xml_from_content(email_content, path, errors)
+    compiled = compile_email(email_xml) if email_xml is not None else None
+    return _read_email(root_path, compiled, locale, errors, cache, conf)
+
+
+def merge_placeholders(template, global_placeholders, email_xml):
+    """
+    :returns: email's placeholders together with the global ones used by the template
+    """
+    return _merge_placeholders(template, global_placeholders, _placeholders(email_xml))
+
+
+def _merge_placeholders(template, global_placeholders, email_placeholders):
     placeholders = OrderedDict({name: content for name, content
                                 in global_placeholders.items()
                                 if name in template.placeholders})
-    placeholders.update(_placeholders(email_xml).items())
-    inferred_placeholders = get_inferred_placeholders(template.placeholders, placeholders)
-
-    return template, inferred_placeholders
+    placeholders.update(email_placeholders.items())
+    return get_inferred_placeholders(template.placeholders, placeholders)
 
 
-def read(root_path, email):
+def read(root_path, email, errors=None, cache=None, conf=None):
     """
     Reads an email from a path.
 
     :param root_path: root path of repository
     :param email: instance of Email namedtuple
+    :param errors: optional list collecting ParseFailure for malformed XML, including the ones recovered by fallback
+    :param cache: optional CacheManager, parsed sources are taken from it until they change
+    :param conf: optional Config, module defaults are used without it
     :returns: tuple of email template, a collection of placeholders
     """
-    email_content = fs.read_file(email.path)
-    results = read_from_content(root_path, email_content, email.locale)
+    results = _read_email(root_path, _read_compiled(email.path, errors, cache), email.locale, errors, cache, conf)
     if not results[0] and email.locale != const.DEFAULT_LOCALE:
-        email = fs.email(root_path, email.name, const.DEFAULT_LOCALE)
-        email_content = fs.read_file(email.path)
-        results = read_from_content(root_path, email_content, email.locale)
+        email = fs.locale_email(root_path, email.name, const.DEFAULT_LOCALE, conf)
+        results = _read_email(root_path, _read_compiled(email.path, errors, cache), email.locale, errors, cache,
+                              conf)
 
     return results
 
 
 def get_email_type(root_path, email):
-    email_content = fs.read_file(email.path)
-    email_xml = _read_xml_from_content(email_content)
+    email_xml = _read_xml_from_content(fs.read_bytes(email.path), email.path)
     return email_xml.getroot().get('email_type')
@@ -0,0 +1,117 @@
+"""
+Persistent cache of rendered emails shared between runs, processes and machines.
+
+Entries are addressed by a hash of everything rendering depends on: bytes of the email, its globals, template and
+styles, the variant, rendering config and the library version. Paths are hashed relative to the repository root so
+checkouts in different directories share entries, e.g. build agents mounting the same cache directory.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from . import fs, config, dependencies
+
+logger = logging.getLogger(__name__)
+
+
+class RenderKeys(object):
+    """
+    Computes keys of rendered emails, digests of files are reused until their modification time changes.
+    """
+
+    def __init__(self, version):
+        """
+        :param version: library version, part of every key
+        """
+        self.version = version
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # digests are validated by mtimes of this machine, worker processes hash files again
+        return {'version': self.version}
+
+    def __setstate__(self, state):
+        self.__init__(state['version'])
+
+    def _file_digest(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return 'missing'
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'rb') as fp:
+            digest = hashlib.sha256(fp.read()).hexdigest()
+        with self._lock:
+            self._digests[path] = (mtime, digest)
+        return digest
+
+    def key(self, root_path, email, variant=None, conf=None):
+        """
+        :param conf: Config the email is rendered with, module defaults are used without it
+        :returns: hex digest of all inputs of the rendered email
+        """
+        conf = config.resolve(conf)
+        root_path = os.path.realpath(root_path)
+        inputs = {
+            'version': self.version,
+            'locale': email.locale,
+            'variant': variant,
+            'config': [conf.base_img_path, conf.rtl_locales, conf.lang_mappings],
+            'files': {os.path.relpath(path, root_path): self._file_digest(path)
+                      for path in dependencies.email_dependencies(root_path, email, conf)}
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RenderCache(RenderKeys):
+    """
+    Stores (subject, text, html) of whole emails as json files in a directory.
+
+    Writes are atomic so concurrent builds never read partial entries, a broken entry is treated as a miss.
+    """
+
+    def __init__(self, path, version):
+        """
+        :param path: cache directory, created on first write
+        :param version: library version, entries of other versions are never used
+        """
+        super().__init__(version)
+        self.path = path
+
+    def __getstate__(self):
+        return {'path': self.path, 'version': self.version}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['version'])
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+        :returns: tuple of subject, text and html or None
+        """
+        try:
+            subject, text, html = json.loads(fs.read_file(self._entry_path(key)))
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning('render cache entry %s is corrupted, rendering again', key)
+            return None
+        return subject, text, html
+
+    def set(self, key, result):
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fs.save_file_atomic(json.dumps(list(result)), path)
+        except OSError as ex:
+            # a read-only or full shared volume shouldn't break the build
+            logger.warning('cannot write render cache entry %s: %s', key, ex)
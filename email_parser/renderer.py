@@ -6,14 +6,14 @@ import logging
 import re
 import xml.etree.ElementTree as ET
 
-import bs4
-import inlinestyler.utils as inline_styler
-import markdown
-import pystache
-
-from . import markdown_ext, const, utils, config
+from . import const, utils, config
 from .model import *
-from .reader import parse_placeholder
+
+bs4 = utils.lazy_import('bs4')
+inline_styler = utils.lazy_import('inlinestyler.utils')
+markdown = utils.lazy_import('markdown')
+pystache = utils.lazy_import('pystache')
+markdown_ext = utils.lazy_import('email_parser.markdown_ext')
 
 logger = logging.getLogger(__name__)
 
@@ -35,14 +35,34 @@ def _transform_extended_tags(content):
     return re.sub(regex, lambda match: '{{%s}}' % match.group(2), content)
 
 
+def _memoized(fragments, slot, key, render):
+    """
+    Renders a fragment unless it was already rendered from the same inputs.
+
+    :param fragments: mapping of (slot, key) to rendered fragments kept between renders, e.g. cache.LruDict,
+                      or None to always render
+    :param slot: fragment identifier, usually kind and placeholder name
+    :param key: all inputs the fragment depends on
+    :param render: function rendering the fragment
+    """
+    if fragments is None:
+        return render()
+    value = fragments.get((slot, key))
+    if value is None:
+        value = render()
+        fragments[(slot, key)] = value
+    return value
+
+
 class HtmlRenderer(object):
     """
     Renders email' body as html.
     """
 
-    def __init__(self, template, email_locale):
+    def __init__(self, template, email_locale, conf=None):
         self.template = template
-        self.locale = utils.normalize_locale(email_locale)
+        self.conf = config.resolve(conf)
+        self.locale = utils.normalize_locale(email_locale, self.conf)
 
     def _inline_css(self, html, css):
         # an empty style will cause an error in inline_styler so we use a space instead
@@ -62,7 +82,7 @@ class HtmlRenderer(object):
         return body.strip()
 
     def _wrap_with_text_direction(self, html):
-        if self.locale in config.rtl_locales:
+        if self.locale in self.conf.rtl_locales:
             soup = bs4.BeautifulSoup(html, 'html.parser')
             for element in soup.contents:
                 try:
@@ -83,6 +103,10 @@ class HtmlRenderer(object):
         tag.insert(0, soup)
         return tag.prettify()
 
+    def _is_highlighted(self, placeholder, variant, highlight):
+        return bool(highlight) and highlight.get('placeholder') == placeholder.name \
+            and highlight.get('variant') == variant
+
     def _render_placeholder(self, placeholder, variant=None, highlight=None):
         content = placeholder.get_content(variant)
         if not content.strip():
@@ -91,15 +115,23 @@ class HtmlRenderer(object):
         if placeholder.type == PlaceholderType.raw:
             return content
         else:
-            html = _md_to_html(content, config.base_img_path)
+            html = _md_to_html(content, self.conf.base_img_path)
             html = self._inline_css(html, self.template.styles)
-            if highlight and highlight.get('placeholder') == placeholder.name and highlight.get('variant') == variant:
+            if self._is_highlighted(placeholder, variant, highlight):
                 html = self._wrap_with_highlight(html, highlight)
             return html
 
+    def _render_fragment(self, placeholder, variant, highlight, fragments):
+        highlighted = self._is_highlighted(placeholder, variant, highlight)
+        highlight_key = (highlight.get('id'), highlight.get('style')) if highlighted else None
+        key = (placeholder.type, placeholder.get_content(variant), highlight_key, self.locale, self.template.styles,
+               self.conf.base_img_path)
+        return _memoized(fragments, ('html', placeholder.name), key,
+                         lambda: self._render_placeholder(placeholder, variant, highlight))
+
     def _concat_parts(self, subject, parts, variant):
         subject = subject.get_content(variant) if subject is not None else ''
-        placeholders = dict(parts.items() | {'subject': subject, 'base_url': config.base_img_path}.items())
+        placeholders = dict(parts.items() | {'subject': subject, 'base_url': self.conf.base_img_path}.items())
         try:
             # pystache escapes html by default, we pass escape option to disable this
             renderer = pystache.Renderer(escape=lambda u: u, missing_tags='strict')
@@ -110,9 +142,13 @@ class HtmlRenderer(object):
             message = 'template %s for locale %s has missing placeholders: %s' % (self.template.name, self.locale, e)
             raise MissingTemplatePlaceholderError(message) from e
 
-    def render(self, placeholders, variant=None, highlight=None):
+    def render(self, placeholders, variant=None, highlight=None, fragments=None):
+        """
+        :param fragments: optional mapping kept between renders, placeholders rendered before from the same inputs
+                          are taken from it instead of being rendered again
+        """
         subject, contents = _split_subject(placeholders)
-        parts = {k: self._render_placeholder(v, variant, highlight) for k, v in contents.items()}
+        parts = {k: self._render_fragment(v, variant, highlight, fragments) for k, v in contents.items()}
         html = self._concat_parts(subject, parts, variant)
         html = self._wrap_with_text_direction(html)
         return html
@@ -123,10 +159,20 @@ class TextRenderer(object):
     Renders email's body as text.
     """
 
-    def __init__(self, template, email_locale):
-        # self.shortener = link_shortener.shortener(settings.shortener)
+    def __init__(self, template, email_locale, links=None, conf=None):
+        """
+        :param links: optional mapping of links to their shortened versions, see link_shortener.LinkCache
+        :param conf: optional Config, module defaults are used without it
+        """
         self.template = template
-        self.locale = utils.normalize_locale(email_locale)
+        self.locale = utils.normalize_locale(email_locale, conf)
+        self.links = links
+        self.conf = config.resolve(conf)
+
+    def _shorten(self, href):
+        if self.links is None:
+            return href
+        return self.links.get(href, href)
 
     def _html_to_text(self, html):
         soup = bs4.BeautifulSoup(html, const.HTML_PARSER)
@@ -136,11 +182,10 @@ class TextRenderer(object):
         for anchor in anchors:
             text = anchor.string or ''
             href = anchor.get('href') or text
-            # href = self.shortener.shorten(href)
             if href != text:
-                anchor.replace_with('{} ({})'.format(text, href))
+                anchor.replace_with('{} ({})'.format(text, self._shorten(href)))
             elif href:
-                anchor.replace_with(href)
+                anchor.replace_with(self._shorten(href))
 
         # add prefix to lists, it wont be added automatically
         unordered_lists = soup('ul')
@@ -159,13 +204,33 @@ class TextRenderer(object):
         html = _md_to_html(text, base_url)
         return self._html_to_text(html)
 
-    def render(self, placeholders, variant=None):
+    def _text_contents(self, placeholders, variant):
         _, contents = _split_subject(placeholders)
-        parts = [
-            self._md_to_text(contents[p].get_content(variant).replace(const.LOCALE_PLACEHOLDER, self.locale))
-            for p in self.template.placeholders if p in contents if contents[p].type != PlaceholderType.attribute]
+        return [(p, contents[p].get_content(variant).replace(const.LOCALE_PLACEHOLDER, self.locale))
+                for p in self.template.placeholders if p in contents if contents[p].type != PlaceholderType.attribute]
+
+    def render(self, placeholders, variant=None, fragments=None):
+        """
+        :param fragments: optional mapping kept between renders, texts with shortened links aren't memoized because
+                          they depend on the links shortened so far
+        """
+        if self.links is not None:
+            fragments = None
+        parts = [_memoized(fragments, ('text', name), (content, self.conf.base_img_path),
+                           lambda: self._md_to_text(content))
+                 for name, content in self._text_contents(placeholders, variant)]
         return const.TEXT_EMAIL_PLACEHOLDER_SEPARATOR.join(v for v in filter(bool, parts))
 
+    def links_to_shorten(self, placeholders, variant=None):
+        """
+        :returns: set of links which will show up in the text email
+        """
+        links = set()
+        for _, content in self._text_contents(placeholders, variant):
+            soup = bs4.BeautifulSoup(_md_to_html(content), const.HTML_PARSER)
+            links.update(anchor.get('href') for anchor in soup.find_all('a') if anchor.get('href'))
+        return links
+
 
 class SubjectRenderer(object):
     """
@@ -179,16 +244,20 @@ class SubjectRenderer(object):
         return subject.get_content(variant)
 
 
-def render(email_locale, template, placeholders, variant=None, highlight=None):
+def links_to_shorten(email_locale, template, placeholders, variant=None, conf=None):
+    return TextRenderer(template, email_locale, conf=conf).links_to_shorten(placeholders, variant)
+
+
+def render(email_locale, template, placeholders, variant=None, highlight=None, links=None, fragments=None, conf=None):
     subject_renderer = SubjectRenderer()
     subject = subject_renderer.render(placeholders, variant)
 
-    text_renderer = TextRenderer(template, email_locale)
-    text = text_renderer.render(placeholders, variant)
+    text_renderer = TextRenderer(template, email_locale, links, conf)
+    text = text_renderer.render(placeholders, variant, fragments)
 
-    html_renderer = HtmlRenderer(template, email_locale)
+    html_renderer = HtmlRenderer(template, email_locale, conf)
     try:
-        html = html_renderer.render(placeholders, variant, highlight)
+        html = html_renderer.render(placeholders, variant, highlight, fragments)
     except MissingTemplatePlaceholderError as e:
         message = 'failed to generate html content for locale: {} with message: {}'.format(email_locale, e)
         raise RenderingError(message) from e
@@ -0,0 +1,109 @@
+"""
+Cached listing of templates, styles and html sections.
+
+The listing is kept until the modification time of one of the templates directories changes, i.e. a file was added,
+removed or renamed there. Templates' placeholders and sections' content are cached by their files' modification time,
+files missing in the cache are read in parallel.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from . import fs, reader, const, config, utils
+from .model import *
+
+concurrent_futures = utils.lazy_import('concurrent.futures')
+
+
+class ResourcesCache(object):
+    def __init__(self, root_path, max_workers=const.DEFAULT_READER_POOL, conf=None):
+        self.root_path = root_path
+        self.max_workers = max_workers
+        self.conf = config.resolve(conf)
+        self._lock = threading.RLock()
+        self.invalidate()
+
+    def __getstate__(self):
+        # nothing cached is sent to worker processes
+        return {'root_path': self.root_path, 'max_workers': self.max_workers, 'conf': self.conf}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self.invalidate()
+
+    def invalidate(self, path=None):
+        """
+        Forgets the listing and the cached content of a file or all files if path is None.
+        """
+        with self._lock:
+            self._listing = None
+            if path is None:
+                self._files = {}
+            else:
+                self._files.pop(str(path), None)
+
+    def _directories(self):
+        templates_path = os.path.join(self.root_path, self.conf.paths.templates)
+        directories = [templates_path, os.path.join(self.root_path, self.conf.paths.sections)]
+        directories.extend(os.path.join(templates_path, email_type.value) for email_type in EmailType)
+        return directories
+
+    def _list(self):
+        snapshot = fs.mtimes(self._directories())
+        if self._listing is None or self._listing[0] != snapshot:
+            templates, styles = fs.resources(self.root_path, self.conf)
+            self._listing = (snapshot, templates, styles, fs.html_sections(self.root_path, self.conf))
+        return self._listing[1:]
+
+    def _read(self, loaders):
+        """
+        :param loaders: OrderedDict of functions reading a file by the file's path
+        :returns: dict of loaded values by path
+        """
+        paths = list(loaders)
+        mtimes = dict(zip(paths, fs.mtimes(paths)))
+        stale = [path for path in paths if path not in self._files or self._files[path][0] != mtimes[path]]
+        if len(stale) > 1:
+            with concurrent_futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                values = list(executor.map(lambda path: loaders[path](), stale))
+        else:
+            values = [loaders[path]() for path in stale]
+        for path, value in zip(stale, values):
+            self._files[path] = (mtimes[path], value)
+        # forget deleted files
+        self._files = {path: self._files[path] for path in paths}
+        return {path: cached[1] for path, cached in self._files.items()}
+
+    def _template_placeholders(self, template_filename, template_type):
+        _, placeholders = reader.get_template_parts(self.root_path, template_filename, template_type, self.conf)
+        return placeholders
+
+    def get(self):
+        """
+        :returns: tuple of templates' placeholders by type and name, list of styles and sections' content by name
+        """
+        with self._lock:
+            return self._get()
+
+    def _get(self):
+        templates, styles, sections = self._list()
+        loaders = OrderedDict()
+        for template_type, templates_names in templates.items():
+            for template_filename in templates_names:
+                path = str(fs.get_template_filepath(self.root_path, template_filename, template_type, self.conf))
+                loaders[path] = partial(self._template_placeholders, template_filename, template_type)
+        for path in sections:
+            loaders[str(path)] = partial(fs.read_file, str(path))
+        values = self._read(loaders)
+
+        templates_view = {}
+        for template_type, templates_names in templates.items():
+            templates_view_type = templates_view.setdefault(template_type, {})
+            for template_filename in templates_names:
+                path = str(fs.get_template_filepath(self.root_path, template_filename, template_type, self.conf))
+                templates_view_type[template_filename] = OrderedDict(values[path])
+        sections_map = {path.name: values[str(path)] for path in sections}
+        return templates_view, list(styles), sections_map
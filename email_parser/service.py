@@ -0,0 +1,132 @@
+"""
+HTTP service rendering emails for editors.
+
+`GET /render/<locale>/<email name>?variant=<variant>` responds with json of the subject, text and html. Concurrent
+requests of the same email share one rendering, see AsyncParser. Every response has an ETag of everything the email is
+rendered from, a request with a matching If-None-Match gets 304 without the email being rendered.
+"""
+
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from . import const
+
+logger = logging.getLogger(__name__)
+
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+
+
+def _etag(key):
+    return '"%s"' % key
+
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses weak comparison
+    tags = (tag.strip() for tag in if_none_match.split(','))
+    return etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+
+def _json_response(status, content, headers=None):
+    headers = dict(headers or {}, **{'Content-Type': 'application/json; charset=utf-8'})
+    return Response(status, headers, json.dumps(content, sort_keys=True).encode('utf-8'))
+
+
+def _error(status, message, error_type=None):
+    return _json_response(status, {'error': error_type or HTTPStatus(status).phrase, 'message': message})
+
+
+class RenderService(object):
+    def __init__(self, parser):
+        """
+        :param parser: AsyncParser
+        """
+        self.parser = parser
+
+    async def render(self, email_name, locale, variant=None, if_none_match=None):
+        """
+        :param if_none_match: optional value of the If-None-Match header
+        :returns: Response
+        """
+        try:
+            if if_none_match:
+                key = await self.parser.render_key(email_name, locale, variant)
+                if key is not None and _etag_matches(if_none_match, _etag(key)):
+                    return Response(HTTPStatus.NOT_MODIFIED, {'ETag': _etag(key)}, b'')
+            key, result = await self.parser.render_with_key(email_name, locale, variant)
+        except Exception as ex:
+            return _error(HTTPStatus.UNPROCESSABLE_ENTITY, str(ex), type(ex).__name__)
+        if not result:
+            return _error(HTTPStatus.NOT_FOUND, 'email %s (%s) does not exist or is empty' % (email_name, locale))
+        subject, text, html = result
+        # clients revalidate every time, unchanged emails cost a 304
+        headers = {'Cache-Control': 'no-cache'}
+        if key is not None:
+            headers['ETag'] = _etag(key)
+        return _json_response(HTTPStatus.OK, {'subject': subject, 'text': text, 'html': html}, headers)
+
+    async def handle(self, method, target, headers):
+        """
+        :param target: request target, path and query
+        :param headers: dict of request headers with lower case names
+        :returns: Response
+        """
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        if len(parts) != 3 or parts[0] != 'render' or not all(parts):
+            return _error(HTTPStatus.NOT_FOUND, 'use /render/<locale>/<email name>')
+        if method != 'GET':
+            response = _error(HTTPStatus.METHOD_NOT_ALLOWED, 'only GET is supported')
+            return response._replace(headers=dict(response.headers, Allow='GET'))
+        _, locale, email_name = parts
+        variant = parse_qs(url.query).get('variant', [None])[0]
+        return await self.render(email_name, locale, variant, headers.get('if-none-match'))
+
+    async def _read_request(self, reader):
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return method, target, headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            try:
+                method, target, headers = await self._read_request(reader)
+            except ValueError:
+                response = _error(HTTPStatus.BAD_REQUEST, 'malformed request')
+            else:
+                try:
+                    response = await self.handle(method, target, headers)
+                except Exception as ex:
+                    logger.exception('%s %s failed', method, target)
+                    response = _error(HTTPStatus.INTERNAL_SERVER_ERROR, str(ex), type(ex).__name__)
+                logger.debug('%s %s %s', method, target, response.status)
+            status = HTTPStatus(response.status)
+            head = ['HTTP/1.1 %s %s' % (status.value, status.phrase)]
+            head.extend('%s: %s' % header for header in sorted(response.headers.items()))
+            if status != HTTPStatus.NOT_MODIFIED:
+                head.append('Content-Length: %s' % len(response.body))
+            head.extend(['Connection: close', '', ''])
+            writer.write('\r\n'.join(head).encode('latin-1') + response.body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=const.SERVICE_HOST, port=const.SERVICE_PORT):
+        """
+        Starts listening, requests are served while the event loop runs.
+
+        :returns: asyncio Server
+        """
+        return await asyncio.start_server(self._handle_connection, host, port)
@@ -0,0 +1,297 @@
+"""
+Outputs of a build.
+
+The directory sink writes subject, text and html files of every email into the destination directory, other sinks
+stream all emails into a single tar or zip archive, NDJSON records or a bundle, to a file or stdout, e.g. for a deploy
+step consuming one sequential stream.
+
+Sinks are closed after a successful build and aborted after a failed one. Files are written next to the output and
+moved over it when they are complete, aborted streams to stdout end without the end of the archive or the index, so
+consumers can tell them from complete ones.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+
+from . import fs, const, config, bundle
+
+logger = logging.getLogger(__name__)
+
+
+class DirectorySink(object):
+    """
+    Files in the destination directory, `<locale>/<name>.html` etc.
+    """
+
+    # files are written by worker processes as soon as an email is rendered
+    in_workers = True
+    # only default contents of emails are written
+    variants = False
+    supports_dedupe = True
+    # compressed text and html are written next to them
+    supports_compression = True
+
+    def __init__(self, root_path, conf=None, dedupe=False, objects_dir=None):
+        """
+        :param dedupe: files with the same content are hardlinks of a single copy in the objects directory
+        :param objects_dir: optional objects directory on the destination's filesystem, next to the destination by
+                            default
+        """
+        self.root_path = root_path
+        self.conf = config.resolve(conf)
+        self.dedupe = dedupe
+        self.objects_dir = objects_dir or fs.objects_path(root_path, self.conf)
+
+    def open(self, full_build=False):
+        """
+        :param full_build: True if all emails are rendered, outputs of previous builds are removed
+        """
+        if full_build:
+            shutil.rmtree(os.path.join(self.root_path, self.conf.paths.destination), ignore_errors=True)
+
+    def write(self, email, subject, text, html, variant=None, compressed=None):
+        """
+        :param variant: variant of the content or None for the default one
+        :param compressed: optional dict of tuples of compressed text and html by encoding
+        """
+        fs.save_parsed_email(self.root_path, email, subject, text, html, self.conf, self.dedupe, compressed,
+                             self.objects_dir)
+
+    def close(self):
+        # copies of outputs replaced or removed by this build, also by builds without deduplication
+        removed = fs.prune_objects(self.objects_dir)
+        if removed:
+            logger.debug('removed %s unused copies from %s', removed, self.objects_dir)
+
+    def abort(self):
+        pass
+
+
+class _Output(object):
+    """
+    File object of a stream sink, nothing is written after the sink is aborted, e.g. the end of a gzipped tar stream
+    written when the stream object is garbage collected.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.aborted = False
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+    def write(self, content):
+        if self.aborted:
+            return len(content)
+        return self.fp.write(content)
+
+
+class StreamSink(object):
+    """
+    Base of sinks writing all emails into one file, emails are written by the building process in order.
+    """
+
+    in_workers = False
+    variants = False
+    supports_dedupe = False
+    supports_compression = False
+
+    def __init__(self, path, dedupe=False):
+        """
+        :param path: output file or '-' for stdout
+        :param dedupe: store identical contents once if the sink supports it
+        """
+        self.path = path
+        self.dedupe = dedupe
+        self._fp = None
+
+    @property
+    def _stdout(self):
+        return self.path == const.STDOUT_PATH
+
+    @property
+    def _tmp_path(self):
+        return '%s.tmp' % self.path
+
+    def open(self, full_build=False):
+        if self._stdout:
+            self._fp = _Output(sys.stdout.buffer)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._fp = _Output(open(self._tmp_path, 'wb'))
+
+    def write(self, email, subject, text, html, variant=None, compressed=None):
+        raise NotImplementedError()
+
+    def _finish(self):
+        """
+        Writes the end of the output, e.g. the end of an archive.
+        """
+        pass
+
+    def _detach(self):
+        """
+        Detaches the writer of an aborted output so that it doesn't finish the output once garbage collected.
+        """
+        pass
+
+    def close(self):
+        self._finish()
+        if self._stdout:
+            self._fp.flush()
+        else:
+            self._fp.close()
+            os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """
+        Stops writing without finishing the output, a previous output file is left as it was.
+        """
+        self._detach()
+        self._fp.aborted = True
+        if self._stdout:
+            self._fp.fp.flush()
+        else:
+            self._fp.fp.close()
+            os.remove(self._tmp_path)
+
+
+def _members(email, subject, text, html, compressed=None):
+    """
+    :returns: generator of archive paths, contents and whether the content is compressed
+    """
+    locale = email.locale or const.DEFAULT_LOCALE
+    for extension, content in ((const.SUBJECT_EXTENSION, subject), (const.TEXT_EXTENSION, text),
+                               (const.HTML_EXTENSION, html)):
+        yield '%s/%s%s' % (locale, email.name, extension), content.encode('utf-8'), False
+    for encoding, (compressed_text, compressed_html) in sorted((compressed or {}).items()):
+        compression_extension = const.COMPRESSION_EXTENSIONS[encoding]
+        for extension, content in ((const.TEXT_EXTENSION, compressed_text), (const.HTML_EXTENSION, compressed_html)):
+            yield '%s/%s%s%s' % (locale, email.name, extension, compression_extension), content, True
+
+
+class TarSink(StreamSink):
+    """
+    Tar archive with the layout of the destination directory, gzipped if the path ends with .gz or .tgz. Deduplicated
+    archives store identical files once, the others are hardlinks of the first one.
+    """
+
+    supports_dedupe = True
+    supports_compression = True
+
+    def open(self, full_build=False):
+        super().open(full_build)
+        mode = 'w|gz' if self.path.endswith(('.gz', '.tgz')) else 'w|'
+        self._tar = tarfile.open(fileobj=self._fp, mode=mode)
+        self._mtime = int(time.time())
+        self._members = {}
+
+    def write(self, email, subject, text, html, variant=None, compressed=None):
+        for name, content, _ in _members(email, subject, text, html, compressed):
+            info = tarfile.TarInfo(name)
+            info.mtime = self._mtime
+            digest = hashlib.sha256(content).digest() if self.dedupe else None
+            if digest in self._members:
+                info.type = tarfile.LNKTYPE
+                info.linkname = self._members[digest]
+                self._tar.addfile(info)
+                continue
+            if digest:
+                self._members[digest] = name
+            info.size = len(content)
+            self._tar.addfile(info, io.BytesIO(content))
+
+    def _finish(self):
+        self._tar.close()
+
+    def _detach(self):
+        self._tar.closed = True
+
+
+class ZipSink(StreamSink):
+    """
+    Zip archive with the layout of the destination directory.
+    """
+
+    supports_compression = True
+
+    def open(self, full_build=False):
+        super().open(full_build)
+        self._zip = zipfile.ZipFile(self._fp, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, email, subject, text, html, variant=None, compressed=None):
+        for name, content, is_compressed in _members(email, subject, text, html, compressed):
+            # compressed copies don't get smaller by deflating them again
+            self._zip.writestr(name, content, zipfile.ZIP_STORED if is_compressed else zipfile.ZIP_DEFLATED)
+
+    def _finish(self):
+        self._zip.close()
+
+    def _detach(self):
+        # ZipFile.close, also called by ZipFile.__del__, does nothing without a file
+        self._zip.fp = None
+
+
+class NdjsonSink(StreamSink):
+    """
+    One json record per line with name, locale, variant, subject, text and html of an email and each of its variants.
+    """
+
+    variants = True
+
+    def write(self, email, subject, text, html, variant=None, compressed=None):
+        record = {'name': email.name, 'locale': email.locale, 'variant': variant, 'subject': subject, 'text': text,
+                  'html': html}
+        self._fp.write(json.dumps(record, sort_keys=True).encode('utf-8') + b'\n')
+
+
+class BundleSink(StreamSink):
+    """
+    Indexed bundle of all emails and their variants read by `bundle.Bundle`, identical contents are always stored once.
+    """
+
+    variants = True
+    supports_dedupe = True
+    supports_compression = True
+
+    def open(self, full_build=False):
+        super().open(full_build)
+        self._writer = bundle.BundleWriter(self._fp)
+
+    def write(self, email, subject, text, html, variant=None, compressed=None):
+        self._writer.add(email.name, email.locale, variant, subject, text, html, compressed)
+
+    def _finish(self):
+        self._writer.finish()
+
+
+_STREAM_SINKS = {'tar': TarSink, 'zip': ZipSink, 'ndjson': NdjsonSink, 'bundle': BundleSink}
+SINKS = ('directory',) + tuple(sorted(_STREAM_SINKS))
+
+
+def create(kind, root_path, path=None, conf=None, dedupe=False, objects_dir=None):
+    """
+    :param kind: one of SINKS
+    :param path: output file or '-' for stdout, needed by all sinks except directory
+    :param dedupe: store identical outputs once, ignored with a warning by sinks which can't reference other outputs
+    :param objects_dir: optional objects directory of the directory sink, see `DirectorySink`
+    :returns: sink
+    """
+    if kind == 'directory':
+        return DirectorySink(root_path, conf, dedupe, objects_dir)
+    if kind not in _STREAM_SINKS:
+        raise ValueError('unknown sink %s, use one of %s' % (kind, ', '.join(SINKS)))
+    if not path:
+        raise ValueError('%s sink needs an output path' % kind)
+    sink_class = _STREAM_SINKS[kind]
+    if dedupe and not sink_class.supports_dedupe:
+        logger.warning('%s sink cannot deduplicate outputs, writing every copy', kind)
+    return sink_class(path, dedupe)
@@ -1,7 +1,44 @@
+import importlib
+import types
+from itertools import chain
+
 from . import config
 
 
-def normalize_locale(locale):
-    if locale in config.lang_mappings:
-        return config.lang_mappings[locale]
-    return locale
+def normalize_locale(locale, conf=None):
+    return dict(config.resolve(conf).lang_mappings).get(locale, locale)
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module and imports it on first attribute access.
+
+    Heavy dependencies (lxml, markdown, bs4, inlinestyler...) are only needed when an email is actually read
+    or rendered, commands like `--version` should not pay for importing them.
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # copy the module namespace so following lookups don't go through __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(module_name):
+    return LazyModule(module_name)
+
+
+concurrent_futures = lazy_import('concurrent.futures')
+
+
+def map_batches(function, items, batch_size, max_workers, *args):
+    """
+    Calls `function(batch, *args)` for consecutive batches of items in a pool of processes.
+
+    :returns: list of all batches' results concatenated in order
+    """
+    items = list(items)
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    with concurrent_futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(function, batch, *args) for batch in batches]
+        return list(chain.from_iterable(future.result() for future in futures))
@@ -0,0 +1,66 @@
+"""
+Detects changed files in a repository and resolves which emails have to be rendered again.
+
+Files are polled by their mtime so no OS specific notification API is needed.
+"""
+
+import logging
+import os
+
+from . import fs, config, dependencies
+
+logger = logging.getLogger(__name__)
+
+
+class Watcher(object):
+    """
+    Keeps a snapshot of files' mtimes and the dependency graph of the repository.
+    """
+
+    def __init__(self, root_path, conf=None):
+        self.root_path = root_path
+        self.conf = config.resolve(conf)
+        self.snapshot = self._snapshot()
+        self.graph = dependencies.DependencyGraph(root_path, self.conf).build()
+
+    def _snapshot(self):
+        snapshot = {}
+        for directory in (self.conf.paths.source, self.conf.paths.templates):
+            for dir_path, _, filenames in os.walk(os.path.realpath(os.path.join(self.root_path, directory))):
+                for filename in filenames:
+                    path = os.path.join(dir_path, filename)
+                    try:
+                        snapshot[path] = os.stat(path).st_mtime_ns
+                    except FileNotFoundError:
+                        continue
+        return snapshot
+
+    def changed_files(self):
+        """
+        :returns: set of paths created, modified or deleted since the last call
+        """
+        snapshot = self._snapshot()
+        changed = {path for path in set(snapshot) | set(self.snapshot) if snapshot.get(path) != self.snapshot.get(path)}
+        self.snapshot = snapshot
+        return changed
+
+    def poll(self):
+        """
+        :returns: tuple of list of emails to render again and list of emails whose source was deleted
+        """
+        changed = self.changed_files()
+        if not changed:
+            return [], []
+        logger.debug('changed files: %s', sorted(changed))
+        emails = {(email.name, email.locale): email for email in fs.emails(self.root_path, conf=self.conf)}
+        removed = sorted(email for key, email in self.graph.emails.items() if key not in emails)
+        for email in removed:
+            self.graph.remove(email.name, email.locale)
+
+        affected = set((email.name, email.locale) for path in changed for email in self.graph.get_dependents(path))
+        affected.update(key for key in emails if key not in self.graph.emails)
+        affected = sorted(key for key in affected if key in emails)
+        for key in affected:
+            # template or styles might have changed too
+            self.graph.add(emails[key])
+        return [emails[key] for key in affected], removed
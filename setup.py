@@ -1,13 +1,16 @@
 import os
+import re
 from setuptools import setup, find_packages
 
-version = '0.3.0'
-
 
 def read(f):
     return open(os.path.join(os.path.dirname(__file__), f)).read().strip()
 
 
+# read the version without importing the package and its dependencies
+version = re.search(r"^__version__ = '(.+)'$", read('email_parser/__init__.py'), re.M).group(1)
+
+
 with open('requirements.txt', 'r') as f:
     install_reqs = [
         s for s in [
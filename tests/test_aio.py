@@ -0,0 +1,163 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import email_parser
+from email_parser import config, fs
+from email_parser.aio import AsyncParser
+from tests.utils import copy_repository
+
+
+class TestAsyncParser(TestCase):
+    render_workers = 0
+
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.previous_loop = asyncio.get_event_loop()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.parser = email_parser.Parser(self.root_path)
+        self.async_parser = AsyncParser(self.root_path, render_workers=self.render_workers)
+
+    def tearDown(self):
+        self.async_parser.close()
+        self.loop.close()
+        asyncio.set_event_loop(self.previous_loop)
+        shutil.rmtree(self.root_path)
+
+    def _run(self, *coroutines):
+        results = self.loop.run_until_complete(asyncio.gather(*coroutines))
+        return results[0] if len(results) == 1 else results
+
+    def test_render(self):
+        self.assertEqual(self.parser.render('email', 'en'), self._run(self.async_parser.render('email', 'en')))
+
+    def test_render_email(self):
+        email = fs.email(self.root_path, 'fallback', 'fr')
+        expected_errors, errors = [], []
+        expected = self.parser.render_email(email, errors=expected_errors)
+        self.assertEqual(expected, self._run(self.async_parser.render_email(email, errors=errors)))
+        self.assertEqual(expected_errors, errors)
+
+    def test_render_email_content(self):
+        content = self.parser.get_email('email', 'en')
+        expected = self.parser.render_email_content(content, session='editor')
+        self.assertEqual(expected, self._run(self.async_parser.render_email_content(content, session='editor')))
+
+    def test_reads(self):
+        self.assertEqual(self.parser.get_email_components('email', 'en'),
+                         self._run(self.async_parser.get_email_components('email', 'en')))
+        self.assertEqual(list(self.parser.get_emails('fr')), self._run(self.async_parser.get_emails('fr')))
+
+    def test_save_email(self):
+        content = self.parser.get_email('email', 'en').replace('Dummy', 'Saved')
+        self._run(self.async_parser.save_email('email', 'en', content))
+        self.assertEqual(content, self._run(self.async_parser.get_email('email', 'en')))
+
+    def test_concurrent_reads(self):
+        source = os.path.join(self.root_path, config.paths.source, 'en')
+        names = ['email_%s' % i for i in range(100)]
+        for name in names:
+            shutil.copy(os.path.join(source, 'email.xml'), os.path.join(source, '%s.xml' % name))
+        content = self.parser.get_email('email', 'en')
+        template = os.path.join(config.paths.templates, 'basic_template.css')
+        calls = []
+        for name in names:
+            calls.extend((self.async_parser.get_email_type(name, 'en'), self.async_parser.get_dependents(template),
+                          self.async_parser.render_email_content(content, session=name)))
+        results = self._run(*calls)
+        self.assertEqual([self.parser.get_email_type('email', 'en')] * 100, results[::3])
+        self.assertEqual(self.parser.get_dependents(template), results[1])
+        self.assertEqual(self.parser.render('email', 'en'), results[2])
+
+
+class TestAsyncParserProcesses(TestAsyncParser):
+    render_workers = 2
+
+
+class TestSharedCalls(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.previous_loop = asyncio.get_event_loop()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.async_parser = AsyncParser(self.root_path, render_workers=0)
+        self.calls = 0
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.async_parser.close()
+        self.loop.close()
+        asyncio.set_event_loop(self.previous_loop)
+        shutil.rmtree(self.root_path)
+
+    def _slow(self, result):
+        def call(*args):
+            self.calls += 1
+            self.release.wait(5)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        return call
+
+    def _gather(self, *coroutines):
+        async def release_later():
+            await asyncio.sleep(0.05)
+            self.release.set()
+
+        results = self.loop.run_until_complete(
+            asyncio.gather(release_later(), *coroutines, return_exceptions=True))
+        return results[1:]
+
+    def test_identical_calls_shared(self):
+        with patch.object(self.async_parser.parser, 'get_email', self._slow('content')):
+            results = self._gather(*(self.async_parser.get_email('email', 'en') for _ in range(5)))
+        self.assertEqual(['content'] * 5, results)
+        self.assertEqual(1, self.calls)
+
+    def test_different_calls_not_shared(self):
+        with patch.object(self.async_parser.parser, 'get_email', self._slow('content')):
+            self._gather(self.async_parser.get_email('email', 'en'), self.async_parser.get_email('email', 'fr'))
+        self.assertEqual(2, self.calls)
+
+    def test_error_shared(self):
+        with patch.object(self.async_parser.parser, 'get_email', self._slow(ValueError('broken'))):
+            results = self._gather(*(self.async_parser.get_email('email', 'en') for _ in range(3)))
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(1, self.calls)
+
+    def test_not_shared_after_completion(self):
+        self.release.set()
+        with patch.object(self.async_parser.parser, 'get_email', self._slow('content')):
+            self._gather(self.async_parser.get_email('email', 'en'))
+            self._gather(self.async_parser.get_email('email', 'en'))
+        self.assertEqual(2, self.calls)
+
+    def test_not_shared_across_writes(self):
+        async def read_save_read():
+            first = asyncio.ensure_future(self.async_parser.get_email('email', 'en'))
+            await asyncio.sleep(0.01)
+            await self.async_parser.invalidate()
+            return await asyncio.gather(first, self.async_parser.get_email('email', 'en'))
+
+        with patch.object(self.async_parser.parser, 'get_email', self._slow('content')):
+            self._gather(read_save_read())
+        self.assertEqual(2, self.calls)
+
+    def test_loop_not_blocked(self):
+        ticks = []
+
+        async def tick():
+            while not self.release.is_set():
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.005)
+
+        with patch.object(self.async_parser.parser, 'get_email', self._slow('content')):
+            self._gather(tick(), self.async_parser.get_email('email', 'en'))
+        self.assertGreater(len(ticks), 2)
@@ -0,0 +1,114 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import email_parser
+from email_parser import bundle, cmd, fs
+from tests.utils import copy_repository
+
+
+class TestBundle(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root_path = copy_repository()
+        cls.bundle_path = os.path.join(cls.root_path, 'emails.bundle')
+        cmd.parse_emails(cls.root_path, sink='bundle', output_path=cls.bundle_path)
+        cls.parser = email_parser.Parser(cls.root_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root_path)
+
+    def setUp(self):
+        self.bundle = bundle.Bundle(self.bundle_path)
+
+    def tearDown(self):
+        self.bundle.close()
+
+    def test_all_emails(self):
+        emails = {(email.name, email.locale, None) for email in fs.emails(self.root_path)}
+        self.assertTrue(emails <= set(self.bundle.keys()))
+
+    def test_content(self):
+        self.assertEqual(self.parser.render('email', 'en'), self.bundle.get_str('email', 'en'))
+        self.assertEqual(self.parser.render('email', 'ar'), self.bundle.get_str('email', 'ar'))
+
+    def test_variant(self):
+        self.assertIn(('email', 'en', 'B'), self.bundle)
+        self.assertEqual(self.parser.render('email', 'en', 'B'), self.bundle.get_str('email', 'en', 'B'))
+
+    def test_zero_copy(self):
+        subject, text, html = self.bundle.get('email', 'en')
+        self.assertIsInstance(html, memoryview)
+        self.assertEqual(self.parser.render('email', 'en')[2].encode('utf-8'), html.tobytes())
+        for part in (subject, text, html):
+            part.release()
+
+    def test_close_with_slices_held(self):
+        emails = bundle.Bundle(self.bundle_path)
+        subject, text, html = emails.get('email', 'en')
+        prebuilt = emails.prebuilt('email', 'en')
+        emails.close()
+        self.assertEqual(self.parser.render('email', 'en')[2].encode('utf-8'), html.tobytes())
+        self.assertEqual(subject.tobytes(), prebuilt.render({})[0])
+        with self.assertRaises(ValueError):
+            emails.get('email', 'en')
+
+    def test_missing(self):
+        self.assertIsNone(self.bundle.get('missing', 'en'))
+        self.assertIsNone(self.bundle.get_str('email', 'en', 'missing'))
+
+
+class TestBundleFormat(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'emails.bundle')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, content):
+        with open(self.path, 'wb') as fp:
+            fp.write(content)
+
+    def test_roundtrip(self):
+        fp = io.BytesIO()
+        writer = bundle.BundleWriter(fp)
+        writer.add('welcome', 'ja', None, 'ようこそ', '', '<p>ようこそ</p>')
+        writer.add('welcome', 'ja', 'B', 'subject', 'text', 'html')
+        writer.finish()
+        self._write(fp.getvalue())
+        with bundle.Bundle(self.path) as emails:
+            self.assertEqual(2, len(emails))
+            self.assertEqual(('ようこそ', '', '<p>ようこそ</p>'), emails.get_str('welcome', 'ja'))
+            self.assertEqual(('subject', 'text', 'html'), emails.get_str('welcome', 'ja', 'B'))
+
+    def test_identical_contents_stored_once(self):
+        sizes = []
+        for locales in (['en'], ['en', 'pt']):
+            fp = io.BytesIO()
+            writer = bundle.BundleWriter(fp)
+            for locale in locales:
+                writer.add('welcome', locale, None, 'subject', 'text', '<p>%s</p>' % ('html' * 100))
+            writer.finish()
+            sizes.append(len(fp.getvalue()))
+        self.assertLess(sizes[1] - sizes[0], 100)
+        self._write(fp.getvalue())
+        with bundle.Bundle(self.path) as emails:
+            self.assertEqual(emails.get_str('welcome', 'en'), emails.get_str('welcome', 'pt'))
+
+    def test_empty_file(self):
+        self._write(b'')
+        with self.assertRaises(bundle.BundleError):
+            bundle.Bundle(self.path)
+
+    def test_truncated(self):
+        fp = io.BytesIO()
+        writer = bundle.BundleWriter(fp)
+        writer.add('welcome', 'en', None, 'subject', 'text', 'html')
+        writer.finish()
+        self._write(fp.getvalue()[:-3])
+        with self.assertRaises(bundle.BundleError):
+            bundle.Bundle(self.path)
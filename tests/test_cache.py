@@ -0,0 +1,140 @@
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import email_parser
+from email_parser import cache, config, fs, reader, const
+from tests.utils import copy_repository
+
+
+class TestLruDict(TestCase):
+    def test_limit(self):
+        items = cache.LruDict(2)
+        items['a'] = 1
+        items['b'] = 2
+        items.get('a')
+        items['c'] = 3
+        self.assertEqual(['a', 'c'], items.keys())
+        self.assertIsNone(items.get('b'))
+
+    def test_pickled_empty(self):
+        items = cache.LruDict(2)
+        items['a'] = 1
+        actual = pickle.loads(pickle.dumps(items))
+        self.assertEqual(0, len(actual))
+        self.assertEqual(2, actual.limit)
+
+
+class TestFileCache(TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.root_path, 'file.txt')
+        fs.save_file('a', self.path)
+        self.cache = cache.FileCache(10)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+
+    def _get(self):
+        return self.cache.get('key', [self.path], lambda: fs.read_file(self.path))
+
+    def _save_keeping_mtime(self, content):
+        stat = os.stat(self.path)
+        fs.save_file(content, self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        return stat
+
+    def test_validated_by_mtime(self):
+        self.assertEqual('a', self._get())
+        stat = self._save_keeping_mtime('b')
+        self.assertEqual('a', self._get())
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertEqual('b', self._get())
+
+    def test_invalidate(self):
+        self._get()
+        self._save_keeping_mtime('b')
+        self.cache.invalidate(os.path.join(self.root_path, '.', 'file.txt'))
+        self.assertEqual('b', self._get())
+
+    def test_missing_files_not_cached(self):
+        self.cache.get('key', [os.path.join(self.root_path, 'missing')], lambda: 'a')
+        self.assertEqual(0, len(self.cache))
+
+
+class TestParserCache(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.parser = email_parser.Parser(self.root_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        config.init()
+
+    def _touch(self, *path_parts):
+        path = os.path.join(self.root_path, *path_parts)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    def _render_reads(self, *args):
+        with patch('email_parser.reader._read_xml_from_content',
+                   side_effect=reader._read_xml_from_content) as mock_read:
+            result = self.parser.render(*args)
+        return result, mock_read.call_count
+
+    def test_render_reuses_parsed_files(self):
+        expected, reads = self._render_reads('email', 'en')
+        self.assertEqual(2, reads)
+        actual, reads = self._render_reads('email', 'en')
+        self.assertEqual(0, reads)
+        self.assertEqual(expected, actual)
+
+    def test_external_change(self):
+        self.parser.render('email', 'en')
+        path = (config.paths.source, 'en', 'email.xml')
+        fs.save_file(fs.read_file(self.root_path, *path).replace('Dummy subject', 'Other subject'),
+                     self.root_path, *path)
+        self._touch(*path)
+        (subject, _, _), reads = self._render_reads('email', 'en')
+        self.assertEqual(1, reads)
+        self.assertEqual('Other subject', subject)
+
+    def test_invalidate(self):
+        self.parser.render('email', 'en')
+        self.parser.invalidate(os.path.join(config.paths.source, 'en', 'global.xml'))
+        _, reads = self._render_reads('email', 'en')
+        self.assertEqual(1, reads)
+        self.parser.invalidate()
+        _, reads = self._render_reads('email', 'en')
+        self.assertEqual(2, reads)
+
+    def test_save_email_invalidates(self):
+        self.parser.render('email', 'en')
+        content = self.parser.get_email('email', 'en').replace('Dummy subject', 'Saved subject')
+        with patch('email_parser.fs.mtimes', return_value=(1,)):
+            self.parser.render('email', 'en')
+            self.parser.save_email('email', 'en', content)
+            subject, _, _ = self.parser.render('email', 'en')
+        self.assertEqual('Saved subject', subject)
+
+    def test_placeholders_config_external_change(self):
+        self.assertIn('email', self.parser.get_email_placeholders())
+        fs.save_file('{"other": {}}', self.root_path, const.REPO_SRC_PATH, const.PLACEHOLDERS_FILENAME)
+        self._touch(const.REPO_SRC_PATH, const.PLACEHOLDERS_FILENAME)
+        self.assertEqual({'other': []}, self.parser.get_email_placeholders())
+
+    def test_cache_limits(self):
+        parser = email_parser.Parser(self.root_path, cache_limits={'emails': 1})
+        parser.render('email', 'en')
+        parser.render('email_order', 'en')
+        self.assertEqual(1, len(parser.cache.emails))
+
+    def test_pickled_with_empty_cache(self):
+        self.parser.render('email', 'en')
+        self.parser.render_email_content(self.parser.get_email('email', 'en'), session='s1')
+        parser = pickle.loads(pickle.dumps(self.parser))
+        self.assertEqual(0, len(parser.cache.emails))
+        self.assertEqual(self.parser.render('email', 'en'), parser.render('email', 'en'))
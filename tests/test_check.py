@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+from unittest import TestCase
+from unittest.mock import patch
+
+from email_parser import check, cmd, config, fs
+from email_parser.model import *
+from tests.utils import copy_repository
+
+
+def _email(template='basic_template.html', style='basic_template.css', email_type='transactional', body=None):
+    body = body or '<string name="subject">Dummy subject</string>\n<string name="content">Dummy content</string>'
+    return """<?xml version="1.0" encoding="UTF-8" ?>
+<resources template="%s" style="%s" email_type="%s">
+%s
+</resources>
+""" % (template, style, email_type, body)
+
+
+class TestCheck(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root_path = copy_repository()
+        broken = {
+            'malformed': _email(body='<string name="subject">Dummy subject</string>\n'
+                                     '<string name="content">a <b</string>'),
+            'no_template': _email(template='missing.html'),
+            'no_style': _email(style='missing.css'),
+            'no_subject': _email(body='<string name="content">Dummy content</string>'),
+            'no_content': _email(body='<string name="subject">Dummy subject</string>'),
+            'bad_type': _email(body='<string name="subject">Dummy subject</string>\n'
+                                    '<string name="content" type="wrong">Dummy content</string>'),
+        }
+        for name, content in broken.items():
+            fs.save_file(content, cls.root_path, config.paths.source, 'en', name + '.xml')
+        fs.save_file('{{content}} {{wrong:broken:}}', cls.root_path, config.paths.templates, 'transactional',
+                     'broken_template.html')
+        fs.save_file(_email(template='broken_template.html'), cls.root_path, config.paths.source, 'en',
+                     'bad_template_type.xml')
+        cls.results = {(r.name, r.locale): r for r in check.check_emails(cls.root_path)}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root_path)
+
+    def _assert_error(self, name, error_type, segment_id=None):
+        result = self.results[(name, 'en')]
+        self.assertEqual(ResultStatus.error, result.status)
+        self.assertEqual(error_type, result.error_type)
+        self.assertEqual(segment_id, result.segment_id)
+
+    def test_valid_emails(self):
+        self.assertEqual(ResultStatus.ok, self.results[('email', 'en')].status)
+        self.assertEqual(ResultStatus.ok, self.results[('email_globale', 'en')].status)
+
+    def test_malformed(self):
+        self._assert_error('malformed', 'ParseError', 'content')
+
+    def test_malformed_with_fallback(self):
+        result = self.results[('fallback', 'fr')]
+        self.assertEqual(ResultStatus.warning, result.status)
+        self.assertEqual('color', result.segment_id)
+
+    def test_missing_template(self):
+        self._assert_error('no_template', 'TemplateNotFound')
+
+    def test_missing_style(self):
+        self._assert_error('no_style', 'StyleNotFound')
+
+    def test_missing_subject(self):
+        self._assert_error('no_subject', 'MissingSubjectError', 'subject')
+
+    def test_missing_template_placeholder(self):
+        self._assert_error('no_content', 'MissingTemplatePlaceholderError', 'color')
+
+    def test_invalid_placeholder_type(self):
+        self._assert_error('bad_type', 'InvalidPlaceholderType', 'content')
+
+    def test_invalid_template_placeholder_type(self):
+        self._assert_error('bad_template_type', 'InvalidPlaceholderType')
+
+    def test_parallel(self):
+        results = check.check_emails(self.root_path, batch_size=4, max_workers=2)
+        without_duration = {key: result._replace(duration=None) for key, result in self.results.items()}
+        self.assertEqual(without_duration, {(r.name, r.locale): r._replace(duration=None) for r in results})
+
+    def test_nothing_rendered(self):
+        with patch('email_parser.fs.save_file') as mock_save:
+            check.check_emails(self.root_path)
+        mock_save.assert_not_called()
+        self.assertFalse(os.path.exists(os.path.join(self.root_path, config.paths.destination)))
+
+    def test_cmd(self):
+        report_path = os.path.join(self.root_path, 'report.json')
+        self.assertFalse(cmd.check_emails(self.root_path, report_path=report_path))
+        report = json.loads(fs.read_file(report_path))
+        self.assertEqual(7, report['errors'])
+        self.assertEqual(1, report['warnings'])
+
+    def test_cmd_locale(self):
+        self.assertTrue(cmd.check_emails(self.root_path, locale='ar'))
@@ -1,9 +1,16 @@
+import json
 import os
+import subprocess
+import sys
 import tempfile
 import shutil
 from unittest import TestCase
+from unittest.mock import Mock, call
 
+import email_parser
 from email_parser import fs, cmd, config
+from email_parser.model import Email, OutputOptions, ParseFailure, ResultStatus
+from tests.utils import copy_repository
 
 
 def read_fixture(filename):
@@ -16,10 +23,7 @@ class TestParser(TestCase):
 
     @classmethod
     def setUpClass(cls):
-        cls.root_path = tempfile.mkdtemp()
-        shutil.copytree(os.path.join('./tests', config.paths.source), os.path.join(cls.root_path, config.paths.source))
-        shutil.copytree(
-            os.path.join('./tests', config.paths.templates), os.path.join(cls.root_path, config.paths.templates))
+        cls.root_path = copy_repository()
         cmd.parse_emails(cls.root_path)
 
     @classmethod
@@ -54,3 +58,160 @@ class TestParser(TestCase):
         expected = fs.read_file(TestParser.root_path, config.paths.destination, 'en', 'fallback.html').strip()
         actual = fs.read_file(TestParser.root_path, config.paths.destination, 'fr', 'fallback.html').strip()
         self.assertEqual(expected, actual)
+
+
+class TestErrorReport(TestCase):
+    malformed_email = """<?xml version="1.0" encoding="UTF-8" ?>
+<resources template="basic_template.html" style="basic_template.css">
+    <string name="subject">Dummy subject</string>
+    <string name="content">Dummy <content</string>
+</resources>
+"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root_path = copy_repository()
+        fs.save_file(cls.malformed_email, cls.root_path, config.paths.source, 'fr', 'placeholder.xml')
+        fs.save_file(cls.malformed_email, cls.root_path, config.paths.source, 'en', 'broken.xml')
+        cls.report_path = os.path.join(cls.root_path, 'report.json')
+        cls.result = cmd.parse_emails(cls.root_path, cls.report_path)
+        cls.report = json.loads(fs.read_file(cls.report_path))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root_path)
+
+    def _report_entry(self, name, locale):
+        return next(r for r in self.report['results'] if r['name'] == name and r['locale'] == locale)
+
+    def test_fails_on_errors(self):
+        self.assertFalse(self.result)
+        self.assertEqual(1, self.report['errors'])
+
+    def test_error_without_fallback(self):
+        entry = self._report_entry('broken', 'en')
+        self.assertEqual('error', entry['status'])
+        self.assertEqual('ParseError', entry['error_type'])
+        self.assertEqual('content', entry['segment_id'])
+
+    def test_warning_on_fallback(self):
+        entry = self._report_entry('placeholder', 'fr')
+        self.assertEqual('warning', entry['status'])
+        self.assertEqual('content', entry['segment_id'])
+        output_path = os.path.join(self.root_path, config.paths.destination, 'fr', 'placeholder.html')
+        self.assertTrue(os.path.exists(output_path))
+
+    def test_successful_emails_not_reported(self):
+        names = [(r['name'], r['locale']) for r in self.report['results']]
+        self.assertNotIn(('email', 'en'), names)
+        self.assertGreater(self.report['emails'], len(names))
+
+
+class TestVariantErrors(TestCase):
+    def setUp(self):
+        self.email = Email('email', 'en', 'path')
+        self.parser = Mock()
+        self.parser.get_email_variants.return_value = ['B']
+        self.sink = Mock()
+        self.options = OutputOptions(variants=True, minify=False, compress=())
+
+    def _render_email(self, email, variant=None, errors=None):
+        if variant:
+            errors.append(ParseFailure('path', 'variant content', 'content'))
+            return None
+        return 'subject', 'text', 'html'
+
+    def test_variant_parse_error(self):
+        self.parser.render_email.side_effect = self._render_email
+        result = cmd._parse_and_save(self.email, self.parser, self.sink, [], self.options)
+        self.assertEqual(ResultStatus.error, result.status)
+        self.assertEqual('ParseError', result.error_type)
+        self.assertEqual('variant: variant content', result.message)
+        self.assertEqual('content', result.segment_id)
+        self.sink.write.assert_not_called()
+
+    def test_variants_written(self):
+        self.parser.render_email.return_value = ('subject', 'text', 'html')
+        result = cmd._parse_and_save(self.email, self.parser, self.sink, [], self.options)
+        self.assertEqual(ResultStatus.ok, result.status)
+        self.assertEqual([call(self.email, 'subject', 'text', 'html', None, None),
+                          call(self.email, 'subject', 'text', 'html', 'B', None)], self.sink.write.call_args_list)
+
+
+class TestSelectiveBuild(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+
+    def _select(self, *args, **kwargs):
+        return sorted((email.name, email.locale) for email in cmd.select_emails(self.root_path, *args, **kwargs))
+
+    def _write_list(self, *paths):
+        list_path = os.path.join(self.root_path, 'changed.txt')
+        fs.save_file('\n'.join(paths) + '\n', list_path)
+        return list_path
+
+    def test_no_filters(self):
+        self.assertIsNone(cmd.select_emails(self.root_path))
+
+    def test_email_and_locale(self):
+        self.assertEqual([('email', 'ar'), ('email', 'en'), ('email', 'fr')], self._select('email'))
+        self.assertEqual([('email_globale', 'en'), ('email_order', 'en')], self._select('email_[go]*', 'e?'))
+
+    def test_template(self):
+        expected = [('email_render_with_inference', 'en')]
+        self.assertEqual(expected, self._select(template='email_render_with_inference.html'))
+        # malformed fr/fallback.xml is rendered with the template of the default locale
+        self.assertIn(('fallback', 'fr'), self._select(template='basic_*'))
+
+    def test_from_list(self):
+        list_path = self._write_list('src/en/email.xml', 'src/fr/global.xml', 'src/en/deleted.xml')
+        selected = self._select(list_path=list_path)
+        self.assertIn(('email', 'en'), selected)
+        self.assertIn(('placeholder', 'fr'), selected)
+        self.assertNotIn(('placeholder', 'en'), selected)
+        self.assertEqual([('email', 'en')], self._select(email_name='email', locale='en', list_path=list_path))
+
+    def test_from_list_template(self):
+        list_path = self._write_list(
+            os.path.join(config.paths.templates, 'transactional', 'email_render_with_inference.html'))
+        self.assertEqual([('email_render_with_inference', 'en')], self._select(list_path=list_path))
+
+    def test_other_outputs_untouched(self):
+        stale_path = os.path.join(self.root_path, config.paths.destination, 'en', 'stale.html')
+        os.makedirs(os.path.dirname(stale_path))
+        fs.save_file('stale', stale_path)
+        self.assertTrue(cmd.parse_emails(self.root_path, emails=cmd.select_emails(self.root_path, 'email', 'en')))
+        self.assertEqual('stale', fs.read_file(stale_path))
+        rendered = sorted(os.listdir(os.path.join(self.root_path, config.paths.destination, 'en')))
+        self.assertEqual(['email.html', 'email.subject', 'email.text', 'stale.html'], rendered)
+
+
+class TestValidate(TestCase):
+    def test_report(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            self.assertFalse(cmd.validate_placeholders('./tests', output_path=output.name))
+            report = json.loads(fs.read_file(output.name))
+        self.assertGreater(report['invalid'], 0)
+        self.assertIn(('email', 'en'), [(r['name'], r['locale']) for r in report['results']])
+
+
+class TestStartup(TestCase):
+    heavy_modules = ['lxml', 'bs4', 'markdown', 'pystache', 'inlinestyler', 'cssutils', 'requests', 'pkg_resources']
+
+    def _run(self, code):
+        return subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).strip()
+
+    def test_import_does_not_load_heavy_dependencies(self):
+        code = 'import sys, email_parser.cmd; print(",".join(m for m in %r if m in sys.modules))' % self.heavy_modules
+        self.assertEqual('', self._run(code))
+
+    def test_dependencies_loaded_on_first_use(self):
+        code = 'import sys; from email_parser import reader; reader.etree.XMLParser; print("lxml" in sys.modules)'
+        self.assertEqual('True', self._run(code))
+
+    def test_version(self):
+        code = 'from email_parser import cmd; cmd.print_version()'
+        self.assertEqual(email_parser.__version__, self._run(code))
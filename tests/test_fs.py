@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch
 from email_parser import fs
@@ -60,6 +63,18 @@ class TestFs(TestCase):
         actual = list(fs.emails('.'))
         self.assertEqual(1, len(actual))
 
+    def test_emails_filters_pushed_to_glob(self):
+        self.mock_path.return_value.glob.return_value = [MockPath('locale1/name1.xml')]
+        list(fs.emails('.', 'name*', 'locale1'))
+        self.mock_path.return_value.glob.assert_called_once_with('locale1/name*.xml')
+
+    def test_emails_filters(self):
+        self.mock_path.return_value.glob.return_value = [
+            MockPath('locale1/name1.xml'), MockPath('locale1/other.xml'), MockPath('locale2/name2.xml')
+        ]
+        actual = list(fs.emails('.', 'name*', 'locale?'))
+        self.assertEqual(['name1', 'name2'], [email.name for email in actual])
+
     def test_email_locale(self):
         self.mock_path.return_value.glob.return_value = [
             MockPath('locale1/name1.xml'), MockPath('locale1/name2.xml'), MockPath('locale2/name2.xml')
@@ -101,3 +116,35 @@ class TestFs(TestCase):
         expected = 'src/en/email.xml'
         actual = fs.get_email_filepath('email', 'en')
         self.assertEqual(expected, actual)
+
+
+class TestReadBytes(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_small_file(self):
+        fs.save_file('<resources/>', self.tmp_dir, 'email.xml')
+        self.assertEqual(b'<resources/>', fs.read_bytes(self.tmp_dir, 'email.xml'))
+
+    def test_large_file(self):
+        content = b'<resources>%s</resources>' % (b' ' * 2 * 1024 * 1024)
+        fs.save_file(content, self.tmp_dir, 'email.xml')
+        actual = fs.read_bytes(self.tmp_dir, 'email.xml')
+        self.assertIsInstance(actual, bytes)
+        self.assertEqual(content, actual)
+
+    def test_source_email(self):
+        expected = Email('email', 'en', os.path.join(os.path.realpath(self.tmp_dir), 'src', 'en', 'email.xml'))
+        self.assertEqual(expected, fs.source_email(self.tmp_dir, 'src/en/email.xml'))
+        self.assertEqual(expected, fs.source_email(self.tmp_dir, expected.path))
+
+    def test_source_email_ignores_other_files(self):
+        self.assertIsNone(fs.source_email(self.tmp_dir, 'src/en/global.xml'))
+        self.assertIsNone(fs.source_email(self.tmp_dir, 'templates_html/basic_template.css'))
+
+    def test_locale_email(self):
+        actual = fs.locale_email(self.tmp_dir, 'email', 'en')
+        self.assertEqual(Email('email', 'en', os.path.join(self.tmp_dir, 'src', 'en', 'email.xml')), actual)
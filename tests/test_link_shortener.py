@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase
+from urllib.parse import parse_qs
+
+import email_parser
+from email_parser import link_shortener, renderer, config, fs, cmd, const
+from email_parser.model import *
+from tests.utils import copy_repository
+
+
+class ShortenerHandler(BaseHTTPRequestHandler):
+    requested = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        link = parse_qs(body)['url'][0]
+        self.requested.append(link)
+        short = 'http://short.ly/%s' % len(self.requested)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(short)))
+        self.end_headers()
+        self.wfile.write(short.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+class ShortenerServerTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), ShortenerHandler)
+        cls.url = 'http://127.0.0.1:%s/url/' % cls.server.server_address[1]
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        ShortenerHandler.requested = []
+        self.root_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+
+
+class TestLinkShortener(ShortenerServerTestCase):
+    def _shortener(self):
+        cache = link_shortener.LinkCache(os.path.join(self.root_path, 'links.json'))
+        return link_shortener.LinkShortener(link_shortener.KsShortener(self.url), cache)
+
+    def test_shorten_unique_links(self):
+        shortener = self._shortener()
+        actual = shortener.shorten(['http://a.com', 'http://b.com', 'http://a.com'])
+        self.assertEqual({'http://a.com', 'http://b.com'}, set(actual))
+        self.assertCountEqual(['http://a.com', 'http://b.com'], ShortenerHandler.requested)
+
+    def test_cache_persisted_between_runs(self):
+        self._shortener().shorten(['http://a.com'])
+        shortener = self._shortener()
+        actual = shortener.shorten(['http://a.com', 'http://b.com'])
+        self.assertEqual({'http://b.com'}, set(actual))
+        self.assertEqual('http://short.ly/1', shortener.cache.get('http://a.com'))
+        self.assertEqual(['http://a.com', 'http://b.com'], ShortenerHandler.requested)
+
+    def test_skip_deep_links_and_runtime_placeholders(self):
+        self._shortener().shorten(['keepsafe://open', 'http://a.com/?u={{user}}', '{{url}}'])
+        self.assertEqual([], ShortenerHandler.requested)
+
+    def test_disabled_without_url(self):
+        cache = link_shortener.LinkCache(os.path.join(self.root_path, 'links.json'))
+        shortener = link_shortener.LinkShortener(link_shortener.shortener(None), cache)
+        self.assertFalse(shortener.enabled)
+        self.assertEqual({}, shortener.shorten(['http://a.com']))
+        self.assertFalse(os.path.exists(cache.path))
+
+
+class TestTextRendererLinks(TestCase):
+    def setUp(self):
+        self.template = Template('dummy', [], '', '<body>{{content}}</body>', ['content'], None)
+        self.placeholders = {'content': Placeholder('content', 'dummy [link_text](http://link_url) content')}
+
+    def test_links_to_shorten(self):
+        links = renderer.links_to_shorten('en', self.template, self.placeholders)
+        self.assertEqual({'http://link_url'}, links)
+
+    def test_use_shortened_links(self):
+        r = renderer.TextRenderer(self.template, 'en', {'http://link_url': 'http://short'})
+        actual = r.render(self.placeholders)
+        self.assertEqual('dummy link_text (http://short) content', actual)
+
+    def test_marked_links(self):
+        cache = link_shortener.LinkCache(None)
+        cache._links = {}
+        text = renderer.TextRenderer(self.template, 'en', link_shortener.MarkedLinks(cache)).render(self.placeholders)
+        self.assertEqual({'http://link_url'}, link_shortener.marked_links(text))
+        self.assertEqual('dummy link_text (http://short) content',
+                         link_shortener.unmark(text, {'http://link_url': 'http://short'}))
+        self.assertEqual('dummy link_text (http://link_url) content', link_shortener.unmark(text, {}))
+
+
+class TestParserRenderMany(ShortenerServerTestCase):
+    def setUp(self):
+        super().setUp()
+        copy_repository(self.root_path)
+        content = fs.read_file(self.root_path, config.paths.source, 'en', 'email.xml')
+        content = content.replace('Dummy content', '[Dummy content](http://link_url)')
+        fs.save_file(content, self.root_path, config.paths.source, 'en', 'email.xml')
+
+    def tearDown(self):
+        super().tearDown()
+        config.init()
+
+    def test_render_many_shortens_links_once(self):
+        parser = email_parser.Parser(self.root_path, _shortener_url=self.url)
+        emails = [fs.email(self.root_path, 'email', 'en'), fs.email(self.root_path, 'email_globale', 'en')]
+        results = parser.render_many(emails)
+        _, text, _ = results[0]
+        self.assertIn('Dummy content (http://short.ly/1)', text)
+        self.assertEqual(['http://link_url'], ShortenerHandler.requested)
+        parser.render_many(emails)
+        self.assertEqual(['http://link_url'], ShortenerHandler.requested)
+
+    def test_build_writes_links_cache(self):
+        for email in fs.emails(self.root_path):
+            content = fs.read_file(email.path).replace('Dummy content', '[Dummy content](http://link_url)')
+            fs.save_file(content, email.path)
+        cmd.parse_emails(self.root_path, shortener_url=self.url)
+        # the link is used by emails of all batches
+        self.assertEqual(['http://link_url'], ShortenerHandler.requested)
+        cache = link_shortener.LinkCache(os.path.join(self.root_path, config.paths.source, const.LINKS_CACHE_FILENAME))
+        self.assertEqual('http://short.ly/1', cache.get('http://link_url'))
+        text = fs.read_file(self.root_path, config.paths.destination, 'en', 'email.text')
+        self.assertIn('(http://short.ly/1)', text)
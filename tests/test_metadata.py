@@ -0,0 +1,99 @@
+import os
+import shutil
+from unittest import TestCase
+from unittest.mock import patch
+
+import email_parser
+from email_parser import metadata, config, fs, reader
+from tests.utils import copy_repository
+
+
+class TestMetadataIndex(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.cache_dir = os.path.join(self.root_path, 'cache')
+        self.parser = email_parser.Parser(self.root_path, metadata_cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        config.init()
+
+    def _touch(self, *path_parts):
+        path = os.path.join(self.root_path, *path_parts)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    def test_email_metadata(self):
+        actual = self.parser.get_email_metadata('email', 'en')
+        self.assertEqual('basic_template.html', actual.template)
+        self.assertEqual('transactional', actual.email_type)
+        self.assertEqual(['basic_template.css'], actual.styles_names)
+        self.assertEqual('attribute', actual.placeholders['color'])
+        self.assertEqual('raw', actual.placeholders['inline'])
+        self.assertEqual(['B'], actual.variants)
+
+    def test_header_queries(self):
+        self.assertEqual('transactional', self.parser.get_email_type('email', 'en'))
+        self.assertEqual(['B'], self.parser.get_email_variants('email'))
+        self.assertEqual([], self.parser.get_email_variants('email_order'))
+
+    def test_global_placeholder_variants(self):
+        fs.save_file("""<?xml version="1.0" encoding="UTF-8" ?>
+<resources>
+    <string-array name="unsubscribe">
+      <item>Unsubscribe</item>
+      <item variant="C">Stop these emails</item>
+    </string-array>
+</resources>
+""", self.root_path, config.paths.source, 'en', 'global.xml')
+        self.assertEqual(['C'], self.parser.get_email_variants('email_globale'))
+        # globals the template doesn't use aren't part of the email
+        self.assertEqual(['B'], self.parser.get_email_variants('email'))
+
+    def test_persisted(self):
+        list(self.parser.get_emails_metadata(None))
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+        index = metadata.MetadataIndex(self.root_path, cache_dir=self.cache_dir)
+        with patch('email_parser.reader.read_metadata') as mock_read:
+            emails = list(index.refresh())
+            self.assertFalse(mock_read.called)
+        self.assertIn(('email', 'fr'), [(e.name, e.locale) for e in emails])
+
+    def test_saved_once(self):
+        with patch('email_parser.fs.save_file_atomic', wraps=fs.save_file_atomic) as mock_save:
+            for email in fs.emails(self.root_path):
+                self.parser.get_email_metadata(email.name, email.locale)
+            self.assertFalse(mock_save.called)
+            self.parser.close()
+            self.assertEqual(1, mock_save.call_count)
+            self.parser.close()
+            self.assertEqual(1, mock_save.call_count)
+
+    def test_source_tree_untouched(self):
+        parser = email_parser.Parser(self.root_path)
+        sources = sorted(os.listdir(os.path.join(self.root_path, config.paths.source)))
+        list(parser.get_emails_metadata(None))
+        parser.close()
+        self.assertEqual(sources, sorted(os.listdir(os.path.join(self.root_path, config.paths.source))))
+        self.assertEqual('transactional', parser.get_email_type('email', 'en'))
+
+    def test_changed_email_is_read_again(self):
+        self.parser.get_email_variants('email')
+        path = os.path.join(config.paths.source, 'en', 'email.xml')
+        fs.save_file(fs.read_file(self.root_path, path).replace('variant="B"', 'variant="C"'), self.root_path, path)
+        self._touch(path)
+        with patch('email_parser.reader.read_metadata', wraps=reader.read_metadata) as mock_read:
+            self.assertEqual(['C'], self.parser.get_email_variants('email'))
+            self.assertEqual(1, mock_read.call_count)
+
+    def test_refresh_drops_deleted_emails(self):
+        self.assertTrue(list(self.parser.get_emails_metadata()))
+        self.parser.delete_email('email_order')
+        names = [email['name'] for email in self.parser.get_emails_metadata()]
+        self.assertNotIn('email_order', names)
+        self.assertIn('email', names)
+
+    def test_malformed_email(self):
+        fs.save_file('<resources><string name="subject"', self.root_path, config.paths.source, 'fr', 'email.xml')
+        self.assertIsNone(self.parser.get_email_metadata('email', 'fr'))
+        self.assertIsNone(self.parser.get_email_type('email', 'fr'))
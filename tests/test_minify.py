@@ -0,0 +1,117 @@
+import gzip
+import os
+import shutil
+import tarfile
+import zipfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from email_parser import bundle, cmd, compression, config, fs, minify
+from tests.utils import copy_repository
+
+
+class TestMinify(TestCase):
+    def test_whitespace_collapsed(self):
+        html = '<table>\n    <tr>  <td>Hello   world</td>\n\n  </tr>\n</table>\n'
+        self.assertEqual('<table>\n<tr> <td>Hello world</td>\n</tr>\n</table>', minify.minify_html(html))
+
+    def test_comments_dropped(self):
+        self.assertEqual('<p>a b</p>', minify.minify_html('<p>a <!-- note --> b</p>'))
+
+    def test_conditional_comments_kept(self):
+        html = '<!--[if mso]><table><tr><td><![endif]--><p>x</p><!--[if mso]></td></tr></table><![endif]-->'
+        self.assertEqual(html, minify.minify_html(html))
+
+    def test_preformatted_kept(self):
+        html = '<pre>  a\n    b</pre>\n  <style>\n  p  { color: red; }\n</style>'
+        self.assertEqual(html.replace('\n  <style>', '\n<style>'), minify.minify_html(html))
+
+    def test_attributes_kept(self):
+        html = '<a title="a  >  b"   href="x">link</a>'
+        self.assertEqual(html, minify.minify_html(html))
+
+
+class TestCompression(TestCase):
+    def test_gzip(self):
+        compressed = compression.compress('ünsubscribe', 'gzip')
+        self.assertEqual('ünsubscribe', gzip.decompress(compressed).decode('utf-8'))
+
+    def test_deterministic(self):
+        self.assertEqual(compression.compress_email('text', 'html', ['gzip']),
+                         compression.compress_email('text', 'html', ['gzip']))
+
+    def test_check(self):
+        compression.check(['gzip'])
+        with self.assertRaises(ValueError):
+            compression.check(['zstd'])
+
+    def test_brotli_missing(self):
+        def missing(name):
+            raise ImportError(name)
+
+        with patch('email_parser.compression.brotli') as brotli:
+            type(brotli).compress = property(missing)
+            with self.assertRaises(ValueError):
+                compression.check(['br'])
+
+
+class TestCompressedOutputs(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.destination = os.path.join(self.root_path, config.paths.destination)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+
+    def _gunzip(self, locale, filename):
+        with open(os.path.join(self.destination, locale, filename), 'rb') as fp:
+            return gzip.decompress(fp.read()).decode('utf-8')
+
+    def test_directory(self):
+        cmd.parse_emails(self.root_path, minify_html=True, compress=['gzip'])
+        self.assertEqual(fs.read_file(self.destination, 'en', 'email.html'), self._gunzip('en', 'email.html.gz'))
+        self.assertEqual(fs.read_file(self.destination, 'en', 'email.text'), self._gunzip('en', 'email.text.gz'))
+        self.assertFalse(os.path.exists(os.path.join(self.destination, 'en', 'email.subject.gz')))
+
+    def test_minified_smaller(self):
+        cmd.parse_emails(self.root_path)
+        html = fs.read_file(self.destination, 'en', 'email.html')
+        cmd.parse_emails(self.root_path, minify_html=True)
+        minified = fs.read_file(self.destination, 'en', 'email.html')
+        self.assertLess(len(minified), len(html))
+        self.assertEqual(minify.minify_html(html), minified)
+
+    def test_dedupe(self):
+        cmd.parse_emails(self.root_path, dedupe=True, compress=['gzip'])
+        self.assertEqual(fs.read_file(self.destination, 'en', 'email.html'), self._gunzip('en', 'email.html.gz'))
+
+    def test_archives(self):
+        tar_path = os.path.join(self.root_path, 'emails.tar')
+        cmd.parse_emails(self.root_path, sink='tar', output_path=tar_path, compress=['gzip'])
+        with tarfile.open(tar_path) as tar:
+            html = tar.extractfile('en/email.html').read()
+            self.assertEqual(html, gzip.decompress(tar.extractfile('en/email.html.gz').read()))
+        zip_path = os.path.join(self.root_path, 'emails.zip')
+        cmd.parse_emails(self.root_path, sink='zip', output_path=zip_path, compress=['gzip'])
+        with zipfile.ZipFile(zip_path) as archive:
+            self.assertEqual(zipfile.ZIP_STORED, archive.getinfo('en/email.html.gz').compress_type)
+            self.assertEqual(archive.read('en/email.html'), gzip.decompress(archive.read('en/email.html.gz')))
+
+    def test_bundle(self):
+        bundle_path = os.path.join(self.root_path, 'emails.bundle')
+        cmd.parse_emails(self.root_path, sink='bundle', output_path=bundle_path, compress=['gzip'])
+        with bundle.Bundle(bundle_path) as emails:
+            text, html = emails.get_compressed('email', 'en', 'B')
+            subject, expected_text, expected_html = emails.get('email', 'en', 'B')
+            self.assertEqual(expected_text.tobytes(), gzip.decompress(text.tobytes()))
+            self.assertEqual(expected_html.tobytes(), gzip.decompress(html.tobytes()))
+            self.assertIsNone(emails.get_compressed('email', 'en', encoding='br'))
+            for part in (text, html, subject, expected_text, expected_html):
+                part.release()
+
+    def test_not_supported(self):
+        output_path = os.path.join(self.root_path, 'emails.ndjson')
+        with patch('email_parser.cmd.logger.warning') as mock_warning:
+            self.assertTrue(cmd.parse_emails(self.root_path, sink='ndjson', output_path=output_path,
+                                             compress=['gzip']))
+        mock_warning.assert_any_call('%s sink cannot store compressed outputs, writing them uncompressed', 'ndjson')
@@ -1,9 +1,12 @@
 import os
+import pickle
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch
 
 import email_parser
-from email_parser import config
+from email_parser import config, fs, renderer
 from email_parser.model import EmailType
 
 
@@ -204,15 +207,17 @@ class TestParser(TestCase):
         actual = self.parser.get_email_variants('email')
         self.assertEqual(actual, ['B'])
 
+    @patch('email_parser.fs.save_file_atomic')
     @patch('email_parser.fs.save_file')
-    def test_save_email_variant_default_content(self, mock_save):
+    def test_save_email_variant_default_content(self, mock_save, _):
         expected = read_fixture('email_en_default.xml')
         self.parser.save_email_variant_as_default('email', ['en'], None)
         content, _ = mock_save.call_args[0]
         self.assertMultiLineEqual(content.strip(), expected.strip())
 
+    @patch('email_parser.fs.save_file_atomic')
     @patch('email_parser.fs.save_file')
-    def test_save_email_variant_b_content(self, mock_save):
+    def test_save_email_variant_b_content(self, mock_save, _):
         expected = read_fixture('email_en_b.xml')
         self.parser.save_email_variant_as_default('email', ['en'], 'B')
         content, _ = mock_save.call_args[0]
@@ -231,3 +236,80 @@ class TestParser(TestCase):
     def test_parse_email_with_inference(self):
         subject, text, html = self.parser.render('email_render_with_inference', 'en')
         self.assertEqual(html, read_fixture('email_render_with_inference.html'))
+
+
+class TestParserConfig(TestCase):
+    def setUp(self):
+        # the same repository with renamed directories
+        self.root_path = tempfile.mkdtemp()
+        shutil.copytree(os.path.join('./tests', config.paths.source), os.path.join(self.root_path, 'content'))
+        shutil.copytree(os.path.join('./tests', config.paths.templates), os.path.join(self.root_path, 'layouts'))
+        self.paths = config.Paths('content', 'out', 'layouts', 'layouts/img', 'layouts/sections')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        config.init()
+
+    def test_parsers_side_by_side(self):
+        default_parser = email_parser.Parser('./tests')
+        parser = email_parser.Parser(self.root_path, _paths=self.paths, _base_img_path='images_base')
+        _, _, expected_html = default_parser.render('email', 'en')
+        _, _, html = parser.render('email', 'en')
+        self.assertIn('email', parser.get_email_names())
+        self.assertIn('images_base', html)
+        self.assertNotIn('images_base', expected_html)
+        self.assertEqual(config.current(), default_parser.config)
+
+    def test_module_defaults(self):
+        config.init(_paths=self.paths)
+        parser = email_parser.Parser(self.root_path)
+        self.assertEqual(self.paths, parser.config.paths)
+        self.assertTrue(fs.email(self.root_path, 'email', 'en'))
+        config.init()
+        self.assertEqual(self.paths, parser.config.paths)
+        self.assertFalse(fs.email(self.root_path, 'email', 'en'))
+
+    def test_pickled_with_parser(self):
+        parser = email_parser.Parser(self.root_path, _paths=self.paths, _base_img_path='images_base')
+        self.assertEqual(parser.config, pickle.loads(pickle.dumps(parser)).config)
+
+
+class TestPreviewSession(TestCase):
+    def setUp(self):
+        self.parser = email_parser.Parser('./tests')
+        self.content = read_fixture('../src/en/email.xml')
+        self.highlight = {'placeholder': 'image', 'variant': None, 'id': 'hl', 'style': 'color: red'}
+
+    def tearDown(self):
+        config.init()
+
+    def test_same_result_as_without_session(self):
+        expected = self.parser.render_email_content(self.content, highlight=self.highlight)
+        actual = self.parser.render_email_content(self.content, highlight=self.highlight, session='s1')
+        self.assertEqual(expected, actual)
+
+    def test_render_only_changed_placeholders(self):
+        self.parser.render_email_content(self.content, session='s1')
+        changed = self.content.replace('/path/to/img.jpg', '/path/to/other.jpg')
+        with patch.object(renderer.HtmlRenderer, '_render_placeholder',
+                          autospec=True, side_effect=renderer.HtmlRenderer._render_placeholder) as mock_render:
+            _, _, html = self.parser.render_email_content(changed, session='s1')
+        self.assertEqual(['image'], [c[0][1].name for c in mock_render.call_args_list])
+        self.assertIn('other.jpg', html)
+        self.assertEqual(self.parser.render_email_content(changed)[2], html)
+
+    def test_highlight_change_renders_affected_placeholders(self):
+        self.parser.render_email_content(self.content, highlight=self.highlight, session='s1')
+        highlight = dict(self.highlight, placeholder='image_absolute')
+        with patch.object(renderer.HtmlRenderer, '_render_placeholder',
+                          autospec=True, side_effect=renderer.HtmlRenderer._render_placeholder) as mock_render:
+            self.parser.render_email_content(self.content, highlight=highlight, session='s1')
+        self.assertCountEqual(['image', 'image_absolute'], [c[0][1].name for c in mock_render.call_args_list])
+
+    def test_reuse_parsed_content(self):
+        self.parser.render_email_content(self.content, session='s1')
+        with patch('email_parser.preview.reader._read_xml_from_content') as mock_read, \
+                patch('email_parser.preview.reader.get_template_parts') as mock_template:
+            self.parser.render_email_content(self.content, variant='B', session='s1')
+        self.assertFalse(mock_read.called)
+        self.assertFalse(mock_template.called)
@@ -0,0 +1,75 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from email_parser import bundle, personalize
+
+
+class TestPersonalize(TestCase):
+    def setUp(self):
+        self.email = personalize.PrebuiltEmail('Hi {{name}}', 'Hi {{name}}, unsubscribe: {{link}}',
+                                               '<p>Hi {{name}}</p><a href="{{link}}">ünsubscribe</a>')
+
+    def test_render(self):
+        expected = ('Hi Ann', 'Hi Ann, unsubscribe: u/1', '<p>Hi Ann</p><a href="u/1">ünsubscribe</a>')
+        self.assertEqual(expected, self.email.render({'name': 'Ann', 'link': 'u/1'}))
+
+    def test_same_as_replace(self):
+        values = {'name': '{{link}}', 'link': 'u/1'}
+        _, text, _ = self.email.render(values)
+        self.assertEqual('Hi {{link}}, unsubscribe: u/1', text)
+
+    def test_missing_values_left(self):
+        self.assertEqual('Hi {{name}}, unsubscribe: u/1', self.email.render({'link': 'u/1'})[1])
+
+    def test_strict(self):
+        with self.assertRaises(personalize.PersonalizationError) as context:
+            self.email.render({'link': 'u/1'}, strict=True)
+        self.assertEqual({'name'}, context.exception.missing)
+
+    def test_render_many(self):
+        recipients = [{'name': 'Ann', 'link': 1}, {'name': 'Bob', 'link': 2}]
+        subjects = [subject for subject, _, _ in self.email.render_many(recipients)]
+        self.assertEqual(['Hi Ann', 'Hi Bob'], subjects)
+
+    def test_without_placeholders(self):
+        email = personalize.PrebuiltEmail('subject', 'text', 'html')
+        self.assertEqual(frozenset(), email.names)
+        self.assertEqual(('subject', 'text', 'html'), email.render({}))
+
+    def test_only_word_placeholders(self):
+        self.assertEqual([(0, 7, 'a_1')], personalize.tokens('{{a_1}} {{b:c:d}} {{ e }}'))
+
+
+class TestBundlePersonalize(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'emails.bundle')
+        fp = io.BytesIO()
+        writer = bundle.BundleWriter(fp)
+        writer.add('welcome', 'ja', None, '{{name}}さん', 'ようこそ {{name}}', '<p>ようこそ</p><a href="{{link}}">x</a>')
+        writer.finish()
+        with open(self.path, 'wb') as output:
+            output.write(fp.getvalue())
+        self.bundle = bundle.Bundle(self.path)
+
+    def tearDown(self):
+        self.bundle.close()
+        shutil.rmtree(self.directory)
+
+    def test_render(self):
+        email = self.bundle.prebuilt('welcome', 'ja')
+        self.assertTrue(email.binary)
+        subject, text, html = email.render({'name': '太郎', 'link': 'u/1'})
+        self.assertEqual('太郎さん'.encode('utf-8'), subject)
+        self.assertEqual('ようこそ 太郎'.encode('utf-8'), text)
+        self.assertEqual('<p>ようこそ</p><a href="u/1">x</a>'.encode('utf-8'), html)
+
+    def test_missing_values_left(self):
+        self.assertEqual('{{name}}さん'.encode('utf-8'), self.bundle.prebuilt('welcome', 'ja').render({})[0])
+
+    def test_reused(self):
+        self.assertIs(self.bundle.prebuilt('welcome', 'ja'), self.bundle.prebuilt('welcome', 'ja'))
+        self.assertIsNone(self.bundle.prebuilt('welcome', 'en'))
@@ -1,9 +1,13 @@
+import json
+import shutil
 from unittest import TestCase
 from unittest.mock import patch
 from collections import Counter
 
-from email_parser import placeholder, fs
+import email_parser
+from email_parser import placeholder, fs, config, const
 from email_parser.model import *
+from tests.utils import copy_repository
 
 
 class TestGenerator(TestCase):
@@ -37,7 +41,6 @@ class TestGenerator(TestCase):
 class TestValidate(TestCase):
     def setUp(self):
         self.email = fs.Email('test_name', 'en', 'path')
-        placeholder.expected_placeholders_file.cache_clear()
 
         self.patch_reader = patch('email_parser.placeholder.reader')
         self.mock_reader = self.patch_reader.start()
@@ -50,6 +53,7 @@ class TestValidate(TestCase):
     def tearDown(self):
         super().tearDown()
         self.patch_reader.stop()
+        self.patch_config.stop()
 
     def test_happy_path(self):
         actual = placeholder.get_email_validation('.', self.email, )
@@ -81,3 +85,92 @@ class TestValidate(TestCase):
             }
         }
         self.assertEqual(expected, actual)
+
+
+class TestPlaceholdersConfig(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.parser = email_parser.Parser(self.root_path)
+        self.content = self.parser.get_email('email', 'en').replace('Dummy content', 'Dummy {{name}} content')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        config.init()
+
+    def _config(self):
+        return json.loads(fs.read_file(self.root_path, const.REPO_SRC_PATH, const.PLACEHOLDERS_FILENAME))
+
+    def test_save_updates_only_saved_email(self):
+        expected = self._config()
+        expected['email'] = {'name': 1}
+        with patch('email_parser.placeholder._email_placeholders',
+                   side_effect=placeholder._email_placeholders) as mock_placeholders:
+            self.parser.save_email('email', 'en', self.content)
+        self.assertEqual(1, mock_placeholders.call_count)
+        self.assertEqual(expected, self._config())
+
+    def test_save_other_locale_not_written(self):
+        with patch('email_parser.fs.save_file_atomic') as mock_save:
+            self.parser.save_email('email', 'fr', self.content)
+        self.assertFalse(mock_save.called)
+
+    def test_delete(self):
+        self.parser.delete_email('email')
+        self.assertNotIn('email', self._config())
+        self.assertIn('placeholder', self._config())
+
+    def test_batch_written_once(self):
+        with patch('email_parser.fs.save_file_atomic', side_effect=fs.save_file_atomic) as mock_save:
+            with self.parser.batch():
+                self.parser.save_email('email', 'en', self.content)
+                self.parser.save_email('email_order', 'en', self.parser.get_email('email_order', 'en'))
+                self.parser.delete_email('placeholder')
+                self.assertFalse(mock_save.called)
+        self.assertEqual(1, mock_save.call_count)
+        actual = self._config()
+        self.assertEqual({'name': 1}, actual['email'])
+        self.assertEqual({}, actual['email_order'])
+        self.assertNotIn('placeholder', actual)
+
+    def test_variant_as_default_written_once(self):
+        with patch('email_parser.fs.save_file_atomic', side_effect=fs.save_file_atomic) as mock_save:
+            self.parser.save_email_variant_as_default('email', ['en', 'fr'], 'B')
+        self.assertEqual(1, mock_save.call_count)
+
+    def test_missing_config_generated(self):
+        fs.delete_file(self.root_path, const.REPO_SRC_PATH, const.PLACEHOLDERS_FILENAME)
+        self.parser.save_email('email', 'en', self.content)
+        actual = self._config()
+        self.assertEqual({'name': 1}, actual['email'])
+        self.assertEqual({'placeholder': 1}, actual['placeholder'])
+
+
+class TestValidateEmails(TestCase):
+    def setUp(self):
+        self.parser = email_parser.Parser('./tests')
+
+    def tearDown(self):
+        config.init()
+
+    def _result(self, report, name, locale):
+        return next(r for r in report['results'] if r['name'] == name and r['locale'] == locale)
+
+    def test_report(self):
+        report = self.parser.validate_placeholders()
+        self.assertEqual(len(list(fs.emails('./tests'))), report['emails'])
+        self.assertEqual(['unsubscribe_link'], self._result(report, 'email', 'en')['missing'])
+        self.assertEqual(['unsubscribe_link'], self._result(report, 'email', 'ar')['missing'])
+        self.assertEqual(len(report['results']), report['invalid'])
+
+    def test_malformed_email_reported(self):
+        result = self._result(self.parser.validate_placeholders(), 'fallback', 'fr')
+        self.assertIn('attributes construct error', result['error'])
+
+    def test_locale(self):
+        report = self.parser.validate_placeholders('fr')
+        self.assertEqual({'fr'}, set(r['locale'] for r in report['results']))
+
+    def test_parallel_same_as_serial(self):
+        expected = self.parser.validate_placeholders()
+        actual = self.parser.validate_placeholders(batch_size=3, max_workers=2)
+        self.assertEqual(json.dumps(expected), json.dumps(actual))
@@ -1,11 +1,16 @@
 import os.path
+import pickle
+import shutil
+import tempfile
+import threading
 from unittest import TestCase
 from unittest.mock import patch
 
 from lxml import etree
 
-from email_parser import reader
+from email_parser import reader, fs, config, cache as caches
 from email_parser.model import *
+from tests.utils import copy_repository
 
 
 def read_fixture(filename):
@@ -28,29 +33,26 @@ class TestReader(TestCase):
             </string-array>
         </resources>
         """
-        self.globals_xml = etree.fromstring("""
+        self.globals_content = b"""
         <resources>
             <string name="content">dummy global</string>
             <string name="order" type="attribute">asc</string>
         </resources>
-        """)
+        """
         self.template_str = '<html><head></head><body>{{content}}{{global_content}}</body></html>'
 
-        self.patch_parse = patch('email_parser.reader.etree.parse')
-        self.mock_parse = self.patch_parse.start()
-        self.mock_parse.return_value = etree.ElementTree(self.globals_xml).getroot()
-
         self.patch_fs = patch('email_parser.reader.fs')
         self.mock_fs = self.patch_fs.start()
         self.mock_fs.read_file.return_value = 'test'
+        self.mock_fs.read_bytes.return_value = self.globals_content
 
     def tearDown(self):
         super().tearDown()
         self.patch_fs.stop()
-        self.patch_parse.stop()
 
     def test_template(self):
-        self.mock_fs.read_file.side_effect = iter([self.email_content, self.template_str, 'test'])
+        self.mock_fs.read_bytes.side_effect = iter([self.email_content.encode('utf-8'), self.globals_content])
+        self.mock_fs.read_file.side_effect = iter([self.template_str, 'test'])
         expected_placeholders = {
             'content': MetaPlaceholder('content'),
             'global_content': MetaPlaceholder('global_content')
@@ -66,7 +68,8 @@ class TestReader(TestCase):
         self.assertEqual(content, self.template_str)
 
     def test_placeholders(self):
-        self.mock_fs.read_file.side_effect = iter([self.email_content, self.template_str, 'test'])
+        self.mock_fs.read_bytes.side_effect = iter([self.email_content.encode('utf-8'), self.globals_content])
+        self.mock_fs.read_file.side_effect = iter([self.template_str, 'test'])
         expected = {
             'subject': Placeholder('subject', 'dummy subject'),
             'content': Placeholder('content', 'dummy content'),
@@ -75,6 +78,7 @@ class TestReader(TestCase):
         }
         _, placeholders = reader.read('.', self.email)
         self.assertEqual(expected.keys(), placeholders.keys())
+        self.assertEqual('dummy global', placeholders['global_content'].get_content())
 
     def test_template_with_multiple_styles(self):
         email_content = """
@@ -109,9 +113,9 @@ class TestReader(TestCase):
         self.assertEqual(template.name, 'dummy_template.html')
 
     def test_on_missing_content_return_fallback(self):
-        self.mock_fs.read_file.return_value = None
+        self.mock_fs.read_bytes.return_value = None
         template, _ = reader.read('.', self.email)
-        self.assertEqual(self.mock_fs.read_file.call_count, 2)
+        self.assertEqual(self.mock_fs.read_bytes.call_count, 2)
 
     def test_on_malformed_content_return_fallback(self):
         malformed_email_content = """
@@ -120,12 +124,16 @@ class TestReader(TestCase):
             <string name="subject"dummy subject</string>
         </resources>
         """
-        self.mock_fs.read_file.side_effect = iter([malformed_email_content,
-                                                   self.email_content,
-                                                   self.template_str,
-                                                   'test'])
-        template, _ = reader.read('.', self.email)
-        self.assertEqual(self.mock_fs.read_file.call_count, 4)
+        self.mock_fs.read_bytes.side_effect = iter([malformed_email_content.encode('utf-8'),
+                                                    self.email_content.encode('utf-8'),
+                                                    self.globals_content])
+        self.mock_fs.read_file.side_effect = iter([self.template_str, 'test'])
+        errors = []
+        template, _ = reader.read('.', self.email, errors)
+        self.assertEqual(self.mock_fs.read_bytes.call_count, 3)
+        self.assertEqual(template.name, 'dummy_template.html')
+        self.assertEqual(1, len(errors))
+        self.assertEqual('dummy', errors[0].path)
 
 
 class TestWriter(TestCase):
@@ -193,3 +201,110 @@ class TestParsing(TestCase):
         expected = MetaPlaceholder('name')
         result = reader.parse_placeholder(placeholder_str)
         self.assertEqual(result, expected)
+
+
+class TestXmlIngest(TestCase):
+    def test_parser_reused_within_thread(self):
+        self.assertIs(reader._xml_parser(), reader._xml_parser())
+
+    def test_parser_per_thread(self):
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(reader._xml_parser()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(reader._xml_parser(), parsers[0])
+
+    def test_segment_id_from_bytes(self):
+        content = b'<resources>\n<string name="subject">ok</string>\n<string name="content">a <b</string>\n</resources>'
+        errors = []
+        self.assertIsNone(reader._read_xml_from_content(content, 'path', errors))
+        self.assertEqual('content', errors[0].segment_id)
+
+
+class TestSharedTemplates(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+
+    def test_template_shared_between_emails(self):
+        source = os.path.join(self.root_path, config.paths.source, 'en')
+        shutil.copy(os.path.join(source, 'email.xml'), os.path.join(source, 'other.xml'))
+        template, _ = reader.read(self.root_path, fs.email(self.root_path, 'email', 'en'))
+        other_template, _ = reader.read(self.root_path, fs.email(self.root_path, 'other', 'en'))
+        self.assertIs(template, other_template)
+
+    def test_template_read_again_when_changed(self):
+        email = fs.email(self.root_path, 'email', 'en')
+        template, _ = reader.read(self.root_path, email)
+        path = os.path.join(self.root_path, config.paths.templates, 'basic_template.css')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        changed, _ = reader.read(self.root_path, email)
+        self.assertIsNot(template, changed)
+        self.assertEqual(template, changed)
+
+    def test_placeholders_without_dict(self):
+        _, placeholders = reader.read(self.root_path, fs.email(self.root_path, 'email', 'en'))
+        for placeholder in placeholders.values():
+            self.assertFalse(hasattr(placeholder, '__dict__'))
+
+    def test_meta_placeholder_pickled(self):
+        expected = MetaPlaceholder('name', PlaceholderType.raw, {'arg': '1'})
+        actual = pickle.loads(pickle.dumps(expected))
+        self.assertEqual(expected, actual)
+        self.assertEqual(PlaceholderType.raw, actual.type)
+
+
+class TestSourceCache(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.sources_path = tempfile.mkdtemp()
+        self.email = fs.email(self.root_path, 'email', 'en')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        shutil.rmtree(self.sources_path)
+
+    def _read(self):
+        cache = caches.CacheManager(sources_path=self.sources_path)
+        with patch('email_parser.reader._read_xml_from_content', wraps=reader._read_xml_from_content) as mock_parse:
+            result = reader.read(self.root_path, self.email, cache=cache)
+        # globals are parsed anyway
+        return result, self.email.path in [call[0][1] for call in mock_parse.call_args_list]
+
+    def test_compiled_once(self):
+        expected = reader.read(self.root_path, self.email)
+        actual, parsed = self._read()
+        self.assertTrue(parsed)
+        actual, parsed = self._read()
+        self.assertFalse(parsed)
+        self.assertEqual(expected, actual)
+
+    def test_compiled_again_when_changed(self):
+        self._read()
+        with open(self.email.path, 'a') as fp:
+            fp.write('\n')
+        _, parsed = self._read()
+        self.assertTrue(parsed)
+
+    def test_corrupted_entry(self):
+        expected, _ = self._read()
+        for dir_path, _, filenames in os.walk(self.sources_path):
+            for filename in filenames:
+                fs.save_file(b'broken', dir_path, filename)
+        actual, parsed = self._read()
+        self.assertTrue(parsed)
+        self.assertEqual(expected, actual)
+
+    def test_compile_sources(self):
+        paths = [email.path for email in fs.emails(self.root_path)]
+        failed = reader.compile_sources(paths, self.sources_path, batch_size=4, max_workers=2)
+        self.assertEqual([fs.email(self.root_path, 'fallback', 'fr').path], failed)
+        _, parsed = self._read()
+        self.assertFalse(parsed)
+
+    def test_pickled_cache_keeps_sources(self):
+        cache = pickle.loads(pickle.dumps(caches.CacheManager(sources_path=self.sources_path)))
+        self.assertEqual(self.sources_path, cache.sources.path)
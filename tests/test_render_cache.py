@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import email_parser
+from email_parser import cmd, config, fs, renderer
+from tests.utils import copy_repository
+
+
+class TestRenderCache(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.cache_dir = tempfile.mkdtemp()
+        self.parser = email_parser.Parser(self.root_path, render_cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        shutil.rmtree(self.cache_dir)
+        config.init()
+
+    def _render(self, email_name, locale='en', variant=None, root_path=None):
+        parser = email_parser.Parser(root_path or self.root_path, render_cache_dir=self.cache_dir)
+        with patch('email_parser.renderer.render', wraps=renderer.render) as mock_render:
+            result = parser.render(email_name, locale, variant)
+        return result, mock_render.called
+
+    def test_reused_between_parsers(self):
+        expected, rendered = self._render('email')
+        self.assertTrue(rendered)
+        actual, rendered = self._render('email')
+        self.assertFalse(rendered)
+        self.assertEqual(expected, actual)
+
+    def test_shared_between_checkouts(self):
+        self._render('email')
+        other_root = copy_repository()
+        try:
+            _, rendered = self._render('email', root_path=other_root)
+        finally:
+            shutil.rmtree(other_root)
+        self.assertFalse(rendered)
+
+    def test_inputs_in_key(self):
+        email = fs.email(self.root_path, 'email', 'en')
+        render_cache = self.parser.render_cache
+        key = render_cache.key(self.root_path, email)
+        self.assertNotEqual(key, render_cache.key(self.root_path, email, 'B'))
+        self.assertNotEqual(key, render_cache.key(self.root_path, email._replace(locale='ar')))
+        with open(os.path.join(self.root_path, config.paths.templates, 'basic_template.css'), 'a') as fp:
+            fp.write('p {}')
+        self.assertNotEqual(key, render_cache.key(self.root_path, email))
+
+    def test_template_change(self):
+        self._render('email')
+        with open(os.path.join(self.root_path, config.paths.templates, 'basic_template.css'), 'a') as fp:
+            fp.write('p {}')
+        _, rendered = self._render('email')
+        self.assertTrue(rendered)
+
+    def test_fallback_not_cached(self):
+        self._render('fallback', 'fr')
+        _, rendered = self._render('fallback', 'fr')
+        self.assertTrue(rendered)
+
+    def test_corrupted_entry(self):
+        expected, _ = self._render('email')
+        email = fs.email(self.root_path, 'email', 'en')
+        key = self.parser.render_cache.key(self.root_path, email)
+        fs.save_file('{', self.parser.render_cache._entry_path(key))
+        actual, rendered = self._render('email')
+        self.assertTrue(rendered)
+        self.assertEqual(expected, actual)
+
+    def test_cmd(self):
+        email = fs.email(self.root_path, 'email', 'en')
+        self.assertTrue(cmd.parse_emails(self.root_path, render_cache_dir=self.cache_dir, emails=[email]))
+        # emails are rendered in worker processes, the entry is replaced to see it's used
+        self.parser.render_cache.set(self.parser.render_cache.key(self.root_path, email), ('cached', 'text', 'html'))
+        self.assertTrue(cmd.parse_emails(self.root_path, render_cache_dir=self.cache_dir, emails=[email]))
+        self.assertEqual('html', fs.read_file(self.root_path, config.paths.destination, 'en', 'email.html'))
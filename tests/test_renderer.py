@@ -17,6 +17,27 @@ class TestTextRenderer(TestCase):
         actual = self.r.render(placeholders)
         self.assertEqual('dummy content', actual)
 
+    def test_memoized_fragments(self):
+        placeholders = {'content': Placeholder('content', 'dummy content')}
+        fragments = {}
+        self.r.render(placeholders, fragments=fragments)
+        with patch.object(self.r, '_md_to_text') as mock_md_to_text:
+            self.assertEqual('dummy content', self.r.render(placeholders, fragments=fragments))
+        mock_md_to_text.assert_not_called()
+        other_conf = config.create(_base_img_path='http://other/img')
+        renderer.TextRenderer(self.template, self.email_locale, conf=other_conf).render(placeholders,
+                                                                                        fragments=fragments)
+        self.assertEqual(2, len(fragments))
+
+    def test_shortened_links_not_memoized(self):
+        placeholders = {'content': Placeholder('content', '[link](http://link)')}
+        fragments = {}
+        first = renderer.TextRenderer(self.template, self.email_locale, {'http://link': 'http://short/1'})
+        second = renderer.TextRenderer(self.template, self.email_locale, {'http://link': 'http://short/2'})
+        self.assertEqual('link (http://short/1)', first.render(placeholders, fragments=fragments))
+        self.assertEqual('link (http://short/2)', second.render(placeholders, fragments=fragments))
+        self.assertEqual({}, fragments)
+
     def test_render_variant(self):
         placeholders = {'content': Placeholder('content', 'dummy content', variants={'B': 'awesome content'})}
         actual = self.r.render(placeholders, variant='B')
@@ -0,0 +1,75 @@
+import os
+import pickle
+import shutil
+from unittest import TestCase
+from unittest.mock import patch
+
+import email_parser
+from email_parser import config, fs, reader
+from tests.utils import copy_repository
+
+
+class TestResourcesCache(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.parser = email_parser.Parser(self.root_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        config.init()
+
+    def _touch(self, *path_parts):
+        path = os.path.join(self.root_path, *path_parts)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    def _get_resources(self):
+        with patch('email_parser.reader.get_template_parts', wraps=reader.get_template_parts) as mock_parts:
+            result = self.parser.get_resources()
+        return result, [call[0][1] for call in mock_parts.call_args_list]
+
+    def test_cached(self):
+        expected, read = self._get_resources()
+        self.assertEqual(4, len(read))
+        actual, read = self._get_resources()
+        self.assertEqual([], read)
+        self.assertEqual(expected, actual)
+
+    def test_template_changed(self):
+        self._get_resources()
+        self._touch(config.paths.templates, 'marketing', 'globale_template.html')
+        _, read = self._get_resources()
+        self.assertEqual(['globale_template.html'], read)
+
+    def test_template_added_and_removed(self):
+        self._get_resources()
+        self.parser.save_template('new_template.html', 'marketing', '<html>{{subject}} {{content}}</html>')
+        (templates, _, _), read = self._get_resources()
+        self.assertEqual(['new_template.html'], read)
+        self.assertEqual(['subject', 'content'], list(templates['marketing']['new_template.html']))
+        fs.delete_file(self.root_path, config.paths.templates, 'marketing', 'new_template.html')
+        self._touch(config.paths.templates, 'marketing')
+        (templates, _, _), read = self._get_resources()
+        self.assertEqual([], read)
+        self.assertNotIn('new_template.html', templates['marketing'])
+
+    def test_section_changed(self):
+        self.parser.get_resources()
+        fs.save_file('<div>new</div>', self.root_path, config.paths.sections, 'header-with-background.html')
+        self._touch(config.paths.sections, 'header-with-background.html')
+        _, _, sections = self.parser.get_resources()
+        self.assertEqual('<div>new</div>', sections['header-with-background.html'])
+
+    def test_result_is_a_copy(self):
+        templates, styles, _ = self.parser.get_resources()
+        del templates['marketing']['globale_template.html']['subject']
+        styles.append('other.css')
+        templates, styles, _ = self.parser.get_resources()
+        self.assertIn('subject', templates['marketing']['globale_template.html'])
+        self.assertNotIn('other.css', styles)
+
+    def test_pickled_without_cache(self):
+        expected = self.parser.get_resources()
+        parser = pickle.loads(pickle.dumps(self.parser))
+        self.assertIsNone(parser.resources._listing)
+        self.assertEqual(expected, parser.get_resources())
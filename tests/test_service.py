@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from unittest import TestCase
+from unittest.mock import patch
+
+import email_parser
+from email_parser import config, service
+from email_parser.aio import AsyncParser
+from tests.utils import copy_repository
+
+
+class TestRenderService(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.loop = asyncio.new_event_loop()
+        self.async_parser = AsyncParser(self.root_path, render_workers=0)
+        self.server = self.loop.run_until_complete(service.RenderService(self.async_parser).start('127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        self.async_parser.close()
+        shutil.rmtree(self.root_path)
+
+    def _request(self, path, headers=None, method='GET'):
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            connection.request(method, path, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+    def _count_renders(self):
+        return patch.object(self.async_parser.parser, 'render', wraps=self.async_parser.parser.render)
+
+    def test_render(self):
+        status, headers, body = self._request('/render/en/email')
+        self.assertEqual(200, status)
+        subject, text, html = email_parser.Parser(self.root_path).render('email', 'en')
+        self.assertEqual({'subject': subject, 'text': text, 'html': html}, json.loads(body.decode('utf-8')))
+        self.assertTrue(headers['ETag'])
+
+    def test_variant(self):
+        _, headers, _ = self._request('/render/en/email?variant=B')
+        _, default_headers, _ = self._request('/render/en/email')
+        self.assertNotEqual(default_headers['ETag'], headers['ETag'])
+
+    def test_not_modified(self):
+        _, headers, _ = self._request('/render/en/email')
+        with self._count_renders() as mock_render:
+            status, not_modified_headers, body = self._request('/render/en/email',
+                                                               {'If-None-Match': headers['ETag']})
+        self.assertEqual(304, status)
+        self.assertEqual(b'', body)
+        self.assertEqual(headers['ETag'], not_modified_headers['ETag'])
+        mock_render.assert_not_called()
+
+    def test_weak_and_listed_etags(self):
+        _, headers, _ = self._request('/render/en/email')
+        status, _, _ = self._request('/render/en/email', {'If-None-Match': '"other", W/%s' % headers['ETag']})
+        self.assertEqual(304, status)
+
+    def test_changed_sources(self):
+        _, headers, _ = self._request('/render/en/email')
+        with open(os.path.join(self.root_path, config.paths.templates, 'basic_template.css'), 'a') as fp:
+            fp.write('p {}')
+        status, changed_headers, _ = self._request('/render/en/email', {'If-None-Match': headers['ETag']})
+        self.assertEqual(200, status)
+        self.assertNotEqual(headers['ETag'], changed_headers['ETag'])
+
+    def test_changed_default_locale_of_fallback(self):
+        # fr/fallback.xml is malformed and rendered from the en one
+        _, headers, _ = self._request('/render/fr/fallback')
+        path = os.path.join(self.root_path, config.paths.source, 'en', 'fallback.xml')
+        with open(path, encoding='utf-8') as fp:
+            content = fp.read()
+        with open(path, 'w', encoding='utf-8') as fp:
+            fp.write(content.replace('Dummy subject', 'Changed subject'))
+        status, _, body = self._request('/render/fr/fallback', {'If-None-Match': headers['ETag']})
+        self.assertEqual(200, status)
+        self.assertIn('Changed subject', json.loads(body.decode('utf-8'))['subject'])
+
+    def test_render_key_error(self):
+        with patch.object(self.async_parser, 'render_key', side_effect=OSError('unreadable')):
+            status, _, body = self._request('/render/en/email', {'If-None-Match': '"etag"'})
+        self.assertEqual(422, status)
+        self.assertEqual('OSError', json.loads(body.decode('utf-8'))['error'])
+
+    def test_internal_error(self):
+        with patch.object(service.RenderService, 'render', side_effect=RuntimeError('broken')):
+            status, _, body = self._request('/render/en/email')
+        self.assertEqual(500, status)
+        self.assertEqual('broken', json.loads(body.decode('utf-8'))['message'])
+
+    def test_missing_email(self):
+        status, _, body = self._request('/render/en/missing')
+        self.assertEqual(404, status)
+        self.assertIn('missing', json.loads(body.decode('utf-8'))['message'])
+
+    def test_unknown_path(self):
+        self.assertEqual(404, self._request('/emails/en/email')[0])
+
+    def test_method_not_allowed(self):
+        status, headers, _ = self._request('/render/en/email', method='POST')
+        self.assertEqual(405, status)
+        self.assertEqual('GET', headers['Allow'])
+
+    def test_concurrent_requests_coalesced(self):
+        release = threading.Event()
+        render = self.async_parser.parser.render
+
+        def slow_render(*args):
+            release.wait(5)
+            return render(*args)
+
+        with patch.object(self.async_parser.parser, 'render', side_effect=slow_render) as mock_render:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [executor.submit(self._request, '/render/en/email') for _ in range(4)]
+                # the first request is rendering, the others must join it
+                threading.Timer(0.2, release.set).start()
+                responses = [future.result() for future in futures]
+        self.assertEqual(1, mock_render.call_count)
+        self.assertEqual({200}, {status for status, _, _ in responses})
+        self.assertEqual(1, len({body for _, _, body in responses}))
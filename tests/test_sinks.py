@@ -0,0 +1,236 @@
+import gc
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import zipfile
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from email_parser import cmd, config, const, fs, sinks
+from email_parser.model import Email
+from tests.utils import copy_repository
+
+
+def _read_directory(path):
+    files = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            name = os.path.relpath(os.path.join(dirpath, filename), path).replace(os.sep, '/')
+            files[name] = fs.read_file(dirpath, filename)
+    return files
+
+
+class TestSinks(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root_path = copy_repository()
+        cmd.parse_emails(cls.root_path)
+        cls.expected = _read_directory(os.path.join(cls.root_path, config.paths.destination))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root_path)
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _build(self, sink, filename):
+        output_path = os.path.join(self.output_dir, filename)
+        cmd.parse_emails(self.root_path, sink=sink, output_path=output_path)
+        return output_path
+
+    def test_tar(self):
+        with tarfile.open(self._build('tar', 'emails.tar')) as tar:
+            actual = {member.name: tar.extractfile(member).read().decode('utf-8') for member in tar.getmembers()}
+        self.assertEqual(self.expected, actual)
+
+    def test_tar_gz(self):
+        with tarfile.open(self._build('tar', 'emails.tar.gz'), 'r:gz') as tar:
+            self.assertEqual(set(self.expected), set(tar.getnames()))
+
+    def test_zip(self):
+        with zipfile.ZipFile(self._build('zip', 'emails.zip')) as archive:
+            actual = {name: archive.read(name).decode('utf-8') for name in archive.namelist()}
+        self.assertEqual(self.expected, actual)
+
+    def test_ndjson(self):
+        with open(self._build('ndjson', 'emails.ndjson')) as fp:
+            records = [json.loads(line) for line in fp]
+        actual = {}
+        variants = set()
+        for record in records:
+            if record['variant']:
+                variants.add((record['name'], record['locale'], record['variant']))
+                continue
+            for extension in ('subject', 'text', 'html'):
+                actual['%s/%s.%s' % (record['locale'], record['name'], extension)] = record[extension]
+        self.assertEqual(self.expected, actual)
+        self.assertIn(('email', 'en', 'B'), variants)
+
+    def test_ndjson_stdout(self):
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        output = subprocess.run([sys.executable, '-m', 'email_parser.cmd', '--sink', 'ndjson', '--sink-output', '-'],
+                                cwd=self.root_path, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+        records = [json.loads(line) for line in output.decode('utf-8').splitlines()]
+        self.assertEqual(len(self.expected) // 3, len([record for record in records if not record['variant']]))
+
+    def _build_failing(self, sink, filename):
+        output_path = os.path.join(self.output_dir, filename)
+        sink_class = type(sinks.create(sink, self.root_path, output_path))
+        write = sink_class.write
+        writes = []
+
+        def failing_write(self, *args):
+            # fails after some emails are written
+            writes.append(args)
+            if len(writes) > 2:
+                raise RuntimeError('failed')
+            write(self, *args)
+
+        with patch.object(sink_class, 'write', failing_write):
+            with self.assertRaisesRegex(RuntimeError, 'failed'):
+                cmd.parse_emails(self.root_path, sink=sink, output_path=output_path)
+        return output_path
+
+    def test_failed_build_no_output(self):
+        for sink, filename in (('tar', 'emails.tar'), ('zip', 'emails.zip'), ('bundle', 'emails.bundle')):
+            self._build_failing(sink, filename)
+        self.assertEqual([], os.listdir(self.output_dir))
+
+    def test_failed_build_previous_output(self):
+        output_path = self._build('zip', 'emails.zip')
+        with open(output_path, 'rb') as fp:
+            previous = fp.read()
+        self._build_failing('zip', 'emails.zip')
+        with open(output_path, 'rb') as fp:
+            self.assertEqual(previous, fp.read())
+        self.assertEqual(['emails.zip'], os.listdir(self.output_dir))
+
+    def test_failed_build_stdout(self):
+        sink = sinks.create('zip', self.root_path, const.STDOUT_PATH)
+        output = io.BytesIO()
+        with patch('sys.stdout', Mock(buffer=output)):
+            sink.open()
+            sink.write(Email('email', 'en', 'path'), 'subject', 'text', 'html')
+            sink.abort()
+            del sink
+            gc.collect()
+        with self.assertRaises(zipfile.BadZipFile):
+            zipfile.ZipFile(io.BytesIO(output.getvalue()))
+
+    def test_aborted_archive_collected(self):
+        stderr = io.StringIO()
+        with patch('sys.stderr', stderr):
+            for sink, filename in (('tar', 'emails.tar'), ('tar', 'emails.tar.gz'), ('zip', 'emails.zip')):
+                sink = sinks.create(sink, self.root_path, os.path.join(self.output_dir, filename))
+                sink.open()
+                sink.write(Email('email', 'en', 'path'), 'subject', 'text', 'html')
+                sink.abort()
+                del sink
+                gc.collect()
+        self.assertEqual('', stderr.getvalue())
+        self.assertEqual([], os.listdir(self.output_dir))
+
+    def test_tar_dedupe(self):
+        output_path = os.path.join(self.output_dir, 'emails.tar')
+        cmd.parse_emails(self.root_path, sink='tar', output_path=output_path, dedupe=True)
+        with tarfile.open(output_path) as tar:
+            self.assertTrue(any(member.islnk() for member in tar.getmembers()))
+            tar.extractall(os.path.join(self.output_dir, 'extracted'))
+        self.assertEqual(self.expected, _read_directory(os.path.join(self.output_dir, 'extracted')))
+
+    def test_dedupe_not_supported(self):
+        with patch('email_parser.sinks.logger.warning') as mock_warning:
+            sink = sinks.create('zip', self.root_path, 'emails.zip', dedupe=True)
+        self.assertIsInstance(sink, sinks.ZipSink)
+        mock_warning.assert_called_once_with('%s sink cannot deduplicate outputs, writing every copy', 'zip')
+
+    def test_destination_untouched(self):
+        self._build('zip', 'emails.zip')
+        self.assertEqual(self.expected, _read_directory(os.path.join(self.root_path, config.paths.destination)))
+
+    def test_create(self):
+        self.assertIsInstance(sinks.create('directory', self.root_path), sinks.DirectorySink)
+        with self.assertRaises(ValueError):
+            sinks.create('tar', self.root_path)
+        with self.assertRaises(ValueError):
+            sinks.create('rar', self.root_path, 'emails.rar')
+
+    def test_directory_full_build(self):
+        destination = os.path.join(self.output_dir, config.paths.destination)
+        os.makedirs(os.path.join(destination, 'en'))
+        fs.save_file('stale', destination, 'en', 'removed.html')
+        sink = sinks.DirectorySink(self.output_dir)
+        sink.open(full_build=True)
+        sink.write(Email('email', 'en', None), 'subject', 'text', 'html')
+        sink.close()
+        self.assertEqual({'en/email.subject': 'subject', 'en/email.text': 'text', 'en/email.html': 'html'},
+                         _read_directory(destination))
+
+
+class TestDirectoryDedupe(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.destination = os.path.join(self.root_path, config.paths.destination)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+
+    def _inode(self, locale, filename):
+        return os.stat(os.path.join(self.destination, locale, filename)).st_ino
+
+    def test_same_outputs(self):
+        cmd.parse_emails(self.root_path)
+        expected = _read_directory(self.destination)
+        cmd.parse_emails(self.root_path, dedupe=True)
+        self.assertEqual(expected, _read_directory(self.destination))
+
+    def test_identical_files_linked(self):
+        cmd.parse_emails(self.root_path, dedupe=True)
+        # fr content is malformed, it's rendered from en
+        self.assertEqual(self._inode('en', 'fallback.html'), self._inode('fr', 'fallback.html'))
+        self.assertNotEqual(self._inode('en', 'email.html'), self._inode('en', 'fallback.html'))
+
+    def test_links_replaced(self):
+        cmd.parse_emails(self.root_path, dedupe=True)
+        expected = fs.read_file(self.destination, 'en', 'fallback.html')
+        fs.save_parsed_email(self.root_path, fs.email(self.root_path, 'fallback', 'fr'), 'subject', 'text', 'html')
+        self.assertEqual(expected, fs.read_file(self.destination, 'en', 'fallback.html'))
+        self.assertEqual('html', fs.read_file(self.destination, 'fr', 'fallback.html'))
+
+    def _objects(self, objects_dir):
+        return [os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(objects_dir)
+                for filename in filenames]
+
+    def test_objects_outside_destination(self):
+        cmd.parse_emails(self.root_path, dedupe=True)
+        self.assertEqual(self.destination + const.OBJECTS_SUFFIX, fs.objects_path(self.root_path))
+        self.assertTrue(self._objects(fs.objects_path(self.root_path)))
+        # only rendered emails are deployed
+        self.assertEqual(['ar', 'en', 'fr'], sorted(os.listdir(self.destination)))
+
+    def test_objects_dir(self):
+        objects_dir = os.path.join(self.root_path, 'objects')
+        cmd.parse_emails(self.root_path, dedupe=True, objects_dir=objects_dir)
+        self.assertTrue(self._objects(objects_dir))
+        self.assertFalse(os.path.exists(fs.objects_path(self.root_path)))
+
+    def test_unused_objects_pruned(self):
+        content = fs.read_file(self.root_path, config.paths.source, 'en', 'email.xml')
+        extra_path = os.path.join(self.root_path, config.paths.source, 'en', 'extra.xml')
+        fs.save_file(content.replace('Dummy content', 'Extra content'), extra_path)
+        cmd.parse_emails(self.root_path, dedupe=True)
+        objects = self._objects(fs.objects_path(self.root_path))
+        os.remove(extra_path)
+        cmd.parse_emails(self.root_path, dedupe=True)
+        remaining = self._objects(fs.objects_path(self.root_path))
+        self.assertLess(len(remaining), len(objects))
+        self.assertTrue(all(os.stat(path).st_nlink > 1 for path in remaining))
@@ -0,0 +1,179 @@
+import os
+import shutil
+from unittest import TestCase
+from unittest.mock import patch
+
+import email_parser
+from email_parser import watch, config, fs, cmd
+from tests.utils import copy_repository
+
+
+class TestWatcher(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.watcher = watch.Watcher(self.root_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+
+    def _touch(self, *path_parts):
+        path = os.path.join(self.root_path, *path_parts)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    def _poll(self):
+        emails, removed = self.watcher.poll()
+        return [(e.name, e.locale) for e in emails], [(e.name, e.locale) for e in removed]
+
+    def test_no_changes(self):
+        self.assertEqual(([], []), self._poll())
+
+    def test_email_changed(self):
+        self._touch(config.paths.source, 'fr', 'email.xml')
+        self.assertEqual(([('email', 'fr')], []), self._poll())
+        self.assertEqual(([], []), self._poll())
+
+    def test_css_changed(self):
+        self._touch(config.paths.templates, 'basic_template.css')
+        emails, _ = self._poll()
+        self.assertIn(('email', 'en'), emails)
+        self.assertIn(('email', 'ar'), emails)
+        self.assertNotIn(('email_render_with_inference', 'en'), emails)
+
+    def test_template_changed(self):
+        self._touch(config.paths.templates, 'marketing', 'globale_template.html')
+        self.assertEqual(([('email_globale', 'en')], []), self._poll())
+
+    def test_global_changed(self):
+        self._touch(config.paths.source, 'fr', 'global.xml')
+        emails, _ = self._poll()
+        self.assertTrue(emails)
+        self.assertEqual({'fr'}, set(locale for _, locale in emails))
+
+    def test_section_changed(self):
+        self._touch(config.paths.sections, 'header-with-background.html')
+        self.assertEqual(([], []), self._poll())
+
+    def test_email_added_and_removed(self):
+        shutil.copy(os.path.join(self.root_path, config.paths.source, 'en', 'email.xml'),
+                    os.path.join(self.root_path, config.paths.source, 'en', 'new_email.xml'))
+        self.assertEqual(([('new_email', 'en')], []), self._poll())
+        fs.delete_file(self.root_path, config.paths.source, 'en', 'new_email.xml')
+        self.assertEqual(([], [('new_email', 'en')]), self._poll())
+
+    def test_style_change_in_email_updates_dependencies(self):
+        path = os.path.join(config.paths.source, 'en', 'email_render_with_inference.xml')
+        content = fs.read_file(self.root_path, path).replace('<resources ', '<resources style="basic_template.css" ')
+        fs.save_file(content, self.root_path, path)
+        self._touch(path)
+        self._poll()
+        self._touch(config.paths.templates, 'basic_template.css')
+        emails, _ = self._poll()
+        self.assertIn(('email_render_with_inference', 'en'), emails)
+
+    def test_render_only_affected(self):
+        self._touch(config.paths.source, 'fr', 'email.xml')
+        emails, _ = self.watcher.poll()
+        self.assertTrue(cmd.parse_emails(self.root_path, emails=emails))
+        self.assertEqual(['email.html', 'email.subject', 'email.text'],
+                         sorted(os.listdir(os.path.join(self.root_path, config.paths.destination, 'fr'))))
+        self.assertFalse(os.path.exists(os.path.join(self.root_path, config.paths.destination, 'en')))
+
+    def test_watch_session(self):
+        changes = [('fr', 'email.xml'), ('en', 'email_order.xml')]
+
+        def sleep(interval):
+            if not changes:
+                raise KeyboardInterrupt()
+            self._touch(config.paths.source, *changes.pop(0))
+
+        with patch('email_parser.cmd.time.sleep', side_effect=sleep), \
+                patch('email_parser.cmd.Parser', wraps=email_parser.Parser) as mock_parser:
+            self.assertTrue(cmd.watch_emails(self.root_path))
+        self.assertEqual(1, mock_parser.call_count)
+        destination = os.path.join(self.root_path, config.paths.destination)
+        self.assertEqual(['email.html', 'email.subject', 'email.text'],
+                         sorted(os.listdir(os.path.join(destination, 'fr'))))
+        self.assertEqual(['email_order.html', 'email_order.subject', 'email_order.text'],
+                         sorted(os.listdir(os.path.join(destination, 'en'))))
+
+
+class TestDependencyGraph(TestCase):
+    def setUp(self):
+        self.root_path = copy_repository()
+        self.parser = email_parser.Parser(self.root_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        config.init()
+
+    def _dependents(self, *path_parts):
+        return [(e.name, e.locale) for e in self.parser.get_dependents(os.path.join(*path_parts))]
+
+    def test_template_dependents(self):
+        dependents = self._dependents(config.paths.templates, 'marketing', 'globale_template.html')
+        self.assertEqual([('email_globale', 'en')], dependents)
+
+    def test_css_dependents(self):
+        dependents = self._dependents(config.paths.templates, 'basic_template.css')
+        self.assertIn(('email', 'en'), dependents)
+        self.assertNotIn(('email_render_with_inference', 'en'), dependents)
+
+    def test_global_dependents(self):
+        dependents = self._dependents(config.paths.source, 'fr', 'global.xml')
+        self.assertTrue(dependents)
+        self.assertEqual({'fr'}, set(locale for _, locale in dependents))
+
+    def test_absolute_path(self):
+        path = os.path.join(self.root_path, config.paths.templates, 'marketing', 'globale_template.html')
+        self.assertEqual([('email_globale', 'en')], self._dependents(path))
+
+    def test_fallback_dependents(self):
+        # fr/fallback.xml is malformed after its root element and rendered from the en one
+        self.assertIn(('fallback', 'fr'), self._dependents(config.paths.source, 'en', 'fallback.xml'))
+
+    def test_fallback_render_key(self):
+        key = self.parser.render_key('fallback', 'fr')
+        content = self.parser.get_email('fallback', 'en').replace('Dummy subject', 'Changed subject')
+        self.parser.save_email('fallback', 'en', content)
+        self.assertNotEqual(key, self.parser.render_key('fallback', 'fr'))
+
+    def test_get_dependencies(self):
+        dependencies = self.parser.get_dependencies('email_globale', 'en')
+        self.assertIn(os.path.realpath(os.path.join(self.root_path, config.paths.source, 'en', 'global.xml')),
+                      dependencies)
+        template = os.path.join(self.root_path, config.paths.templates, 'marketing', 'globale_template.html')
+        self.assertIn(os.path.realpath(template), dependencies)
+
+    def test_save_email_updates_graph(self):
+        css = (config.paths.templates, 'basic_template.css')
+        self.assertNotIn(('email_render_with_inference', 'en'), self._dependents(*css))
+        content = self.parser.get_email('email_render_with_inference', 'en')
+        self.parser.save_email('email_render_with_inference', 'en',
+                               content.replace('<resources ', '<resources style="basic_template.css" '))
+        self.assertIn(('email_render_with_inference', 'en'), self._dependents(*css))
+
+    def test_delete_email_updates_graph(self):
+        self.assertIn(('email', 'fr'), self._dependents(config.paths.templates, 'basic_template.css'))
+        self.parser.delete_email('email')
+        dependents = self._dependents(config.paths.templates, 'basic_template.css')
+        self.assertFalse([d for d in dependents if d[0] == 'email'])
+
+    def test_save_template_and_email(self):
+        template = (config.paths.templates, 'transactional', 'new_template.html')
+        self.assertEqual([], self._dependents(*template))
+        html = fs.read_file(self.root_path, config.paths.templates, 'transactional', 'basic_template.html')
+        self.parser.save_template('new_template.html', 'transactional', html)
+        content = self.parser.get_email('email', 'en').replace('basic_template.html', 'new_template.html')
+        self.parser.save_email('new_email', 'en', content)
+        self.assertEqual([('new_email', 'en')], self._dependents(*template))
+
+    def test_email_before_template(self):
+        template = (config.paths.templates, 'transactional', 'new_template.html')
+        # e.g. checked out before its template
+        content = self.parser.get_email('email', 'en').replace('basic_template.html', 'new_template.html')
+        fs.save_file(content, self.root_path, config.paths.source, 'en', 'new_email.xml')
+        self.assertEqual([('new_email', 'en')], self._dependents(*template))
+        html = fs.read_file(self.root_path, config.paths.templates, 'transactional', 'basic_template.html')
+        self.parser.save_template('new_template.html', 'transactional', html)
+        self.assertEqual([('new_email', 'en')], self._dependents(*template))
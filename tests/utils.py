@@ -0,0 +1,18 @@
+import os
+import shutil
+import tempfile
+
+from email_parser import config
+
+
+def copy_repository(root_path=None):
+    """
+    Copies sources and templates of the test repository.
+
+    :param root_path: directory of the copy, a new temporary directory by default
+    :returns: root path of the copy
+    """
+    root_path = root_path or tempfile.mkdtemp()
+    shutil.copytree(os.path.join('./tests', config.paths.source), os.path.join(root_path, config.paths.source))
+    shutil.copytree(os.path.join('./tests', config.paths.templates), os.path.join(root_path, config.paths.templates))
+    return root_path